@@ -0,0 +1,934 @@
+import os
+import sys
+import json
+import time
+import ast
+import base64
+import shutil
+import inspect
+import platform
+import tempfile
+import subprocess
+import hashlib
+import threading
+import argparse
+import numpy as np
+from openai import OpenAI
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from SciX_SearchPapers import fetch_papers_from_ads
+from SciX_Paper_Embeddings import embed_texts, embed_and_save_papers_with_openai
+from SciX_Embedding_Backends import OpenAIBackend, get_embedding_backend, length_sorted_batches, padding_overhead
+from SciX_Dedup import deduplicate_papers
+from SciX_cluster_subtopic import select_gmm_components, cluster_papers, CLUSTER_METHODS
+from SciX_Cluster_Scoring import CRITERIA
+from SciX_Reduction import reduce_embeddings
+from SciX_Embedding_Store import save_embedding_store
+from SciX_Cluster_Store import save_cluster_output, load_cluster_output
+from SciX_Vector_Index import INDEX_LIBRARIES, VectorIndex
+from SciX_subtopic_aspect_generation import generate_subtopic_aspects
+from SciX_outline_creation import generate_outline
+from SciX_Metrics import metrics
+
+
+VOCABULARY = [f"term{i}" for i in range(5000)]
+
+
+def make_synthetic_papers(n_papers, seed=0, abstract_words=80):
+    """
+    Generate ADS-like paper records with deterministic titles and abstracts.
+    """
+    rng = np.random.default_rng(seed)
+    words = rng.integers(0, len(VOCABULARY), size=(n_papers, abstract_words))
+    papers = []
+    for i in range(n_papers):
+        papers.append({
+            'title': [f"Synthetic paper {i} on topic {(i * 7 + seed) % 50}"],
+            'abstract': " ".join(VOCABULARY[w] for w in words[i]),
+            'year': str(1990 + i % 35),
+        })
+    return papers
+
+
+def make_synthetic_embeddings(n_papers, dim=1536, n_topics=20, spread=0.5, seed=0):
+    """
+    Gaussian blobs on the unit sphere, mimicking topic structure in ada-002 embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    topics = rng.integers(0, n_topics, size=n_papers)
+    # float32 throughout, so 100k x 1536 needs ~600MB rather than twice that
+    vectors = centers[topics] + spread * rng.standard_normal((n_papers, dim), dtype=np.float32) / np.sqrt(dim)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def make_duplicated_papers(n_papers, exact_rate=0.1, near_rate=0.05, seed=0):
+    """
+    Synthetic corpus where a fraction of records repeat an earlier title with different
+    casing/punctuation, and another fraction are preprint-style near copies.
+    """
+    rng = np.random.default_rng(seed)
+    papers = make_synthetic_papers(n_papers, seed=seed)
+    for i in range(1, n_papers):
+        r = rng.random()
+        source = papers[int(rng.integers(0, i))]
+        if r < exact_rate:
+            papers[i] = {**source, 'title': [source['title'][0].upper() + '.']}
+        elif r < exact_rate + near_rate:
+            words = source['abstract'].split()
+            words[int(rng.integers(0, len(words)))] = 'revised'
+            papers[i] = {**source, 'title': [source['title'][0] + ' (preprint)'], 'abstract': " ".join(words)}
+    return papers
+
+
+def start_mock_server(handler_class):
+    """
+    Start a threaded HTTP server on a free local port and return (server, base_url).
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def make_rate_limiter(rate_limit):
+    """
+    Return a callable implementing a per-second request quota. It returns
+    (allowed, headers) with X-RateLimit-* / Retry-After headers for the response.
+    """
+    state = {'remaining': rate_limit, 'reset': time.time() + 1}
+    lock = threading.Lock()
+
+    def check():
+        if rate_limit is None:
+            return True, {}
+        with lock:
+            if time.time() >= state['reset']:
+                state['remaining'], state['reset'] = rate_limit, time.time() + 1
+            state['remaining'] -= 1
+            remaining, reset = state['remaining'], state['reset']
+        if remaining < 0:
+            return False, {'Retry-After': f"{reset - time.time():.2f}"}
+        return True, {'X-RateLimit-Limit': str(rate_limit),
+                      'X-RateLimit-Remaining': str(remaining),
+                      'X-RateLimit-Reset': f"{reset:.2f}"}
+
+    return check
+
+
+class MockJSONHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+
+def make_ads_handler(papers, latency=0.05, rate_limit=None):
+    """
+    Build a handler class that answers /v1/search/query like ADS, with optional
+    per-request latency and a per-second X-RateLimit-* quota that returns 429 once exhausted.
+    """
+    check_rate_limit = make_rate_limiter(rate_limit)
+
+    class MockADSHandler(MockJSONHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            params = parse_qs(urlparse(self.path).query)
+            start = int(params.get('start', ['0'])[0])
+            rows = int(params.get('rows', ['10'])[0])
+            cursor = params.get('cursorMark', [None])[0]
+            if cursor is not None:
+                start = 0 if cursor == '*' else int(cursor)
+
+            allowed, headers = check_rate_limit()
+            if not allowed:
+                self._send(429, {'error': 'Too many requests'}, headers)
+                return
+
+            body = {'response': {'numFound': len(papers), 'start': start, 'docs': papers[start:start + rows]}}
+            if cursor is not None:
+                body['nextCursorMark'] = str(min(start + rows, len(papers)))
+            self._send(200, body, headers)
+
+    return MockADSHandler
+
+
+def stub_embedding(text, dim):
+    # Deterministic unit vector derived from the text, so identical inputs embed identically
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def make_embeddings_handler(dim=1536, latency=0.05, per_item_latency=0.0, rate_limit=None, max_items=2048):
+    """
+    Build a handler class that answers POST /v1/embeddings like the OpenAI API.
+    """
+    check_rate_limit = make_rate_limiter(rate_limit)
+
+    class StubEmbeddingsHandler(MockJSONHandler):
+        def do_POST(self):
+            request = self._read_json()
+            inputs = request.get('input', [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            time.sleep(latency + per_item_latency * len(inputs))
+
+            allowed, headers = check_rate_limit()
+            if not allowed:
+                self._send(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}}, headers)
+                return
+            if len(inputs) > max_items:
+                self._send(400, {'error': {'message': f'Too many inputs ({len(inputs)} > {max_items})',
+                                           'type': 'invalid_request_error'}})
+                return
+
+            data = []
+            for i, text in enumerate(inputs):
+                vector = stub_embedding(text, dim)
+                if request.get('encoding_format') == 'base64':
+                    embedding = base64.b64encode(vector.tobytes()).decode()
+                else:
+                    embedding = vector.tolist()
+                data.append({'object': 'embedding', 'index': i, 'embedding': embedding})
+            n_tokens = sum(len(text) // 4 + 1 for text in inputs)
+            self._send(200, {'object': 'list', 'data': data, 'model': request.get('model'),
+                             'usage': {'prompt_tokens': n_tokens, 'total_tokens': n_tokens}}, headers)
+
+    return StubEmbeddingsHandler
+
+
+def fake_aspect_response(messages):
+    # A well-formed aspect JSON naming the chunk after its first paper
+    user = messages[-1]['content']
+    first_paper = user.split('\n0: ', 1)[-1].split('\n', 1)[0]
+    return json.dumps({'Description': f"Papers like {first_paper}", 'Subtopic': first_paper[:60],
+                       'Relatedness': 4, 'Is Related': 'RELATED'})
+
+
+def make_chat_handler(responder=fake_aspect_response, latency=0.5, rate_limit=None, latency_fn=None,
+                      token_latency=0.0):
+    """
+    Build a handler class that answers POST /v1/chat/completions like the OpenAI API,
+    with the assistant message produced by `responder(messages)`. `latency_fn(messages,
+    latency)` can replace the fixed time to the first token, and every 4-character
+    "token" of the answer takes `token_latency` more. Requests with stream=true are
+    answered as server-sent events, one chunk per token.
+    """
+    check_rate_limit = make_rate_limiter(rate_limit)
+
+    class FakeChatHandler(MockJSONHandler):
+        def do_POST(self):
+            request = self._read_json()
+            time.sleep(latency_fn(request['messages'], latency) if latency_fn else latency)
+            allowed, headers = check_rate_limit()
+            if not allowed:
+                self._send(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}}, headers)
+                return
+
+            content = responder(request['messages'])
+            pieces = [content[i:i + 4] for i in range(0, len(content), 4)]
+            prompt_tokens = sum(len(m['content']) // 4 + 1 for m in request['messages'])
+            usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(pieces),
+                     'total_tokens': prompt_tokens + len(pieces)}
+            if request.get('stream'):
+                self._stream(request, pieces, usage)
+                return
+            time.sleep(token_latency * len(pieces))
+            self._send(200, {
+                'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': int(time.time()),
+                'model': request.get('model'),
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': content}}],
+                'usage': usage,
+            }, headers)
+
+        def _stream(self, request, pieces, usage):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.end_headers()
+            base = {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                    'model': request.get('model')}
+            events = [{**base, 'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': piece},
+                                            'finish_reason': None}]} for piece in pieces]
+            events.append({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+            if request.get('stream_options', {}).get('include_usage'):
+                events.append({**base, 'choices': [], 'usage': usage})
+            try:
+                for event in events:
+                    time.sleep(token_latency)
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # The client stopped reading, e.g. after a schema error
+
+    return FakeChatHandler
+
+
+def make_stub_openai_client(base_url):
+    # Retries are handled by our own scheduler, so the client's built-in ones are disabled
+    return OpenAI(api_key='stub', base_url=f"{base_url}/v1", max_retries=0)
+
+
+def benchmark_ads_fetch(n_papers=10000, rows=100, workers=(1, 4, 8, 16), latency=0.05):
+    """
+    Time fetch_papers_from_ads against a local mock ADS server and report pages/sec.
+    """
+    papers = make_synthetic_papers(n_papers)
+    server, base_url = start_mock_server(make_ads_handler(papers, latency=latency))
+    api_url = f"{base_url}/v1/search/query"
+    results = []
+    try:
+        runs = [('offset', w, False) for w in workers] + [('cursor', 1, True)]
+        for mode, n_workers, use_cursor in runs:
+            start = time.perf_counter()
+            fetched = fetch_papers_from_ads('benchmark', max_results=n_papers, rows=rows,
+                                            max_workers=n_workers, use_cursor=use_cursor, api_url=api_url)
+            elapsed = time.perf_counter() - start
+            pages = -(-len(fetched) // rows)
+            results.append({'mode': mode, 'workers': n_workers, 'papers': len(fetched),
+                            'pages': pages, 'seconds': round(elapsed, 3),
+                            'pages_per_sec': round(pages / elapsed, 1)})
+            print(f"ads fetch [{mode}, workers={n_workers}]: {pages} pages in {elapsed:.2f}s "
+                  f"({pages / elapsed:.1f} pages/sec)")
+    finally:
+        server.shutdown()
+    return results
+
+
+def benchmark_embedding_batches(sizes=(1000, 10000, 50000), workers=(1, 4, 8), dim=1536, latency=0.05,
+                                per_item_latency=0.0002):
+    """
+    Time embed_texts against a local stub embeddings endpoint and report papers/sec.
+    """
+    server, base_url = start_mock_server(make_embeddings_handler(dim=dim, latency=latency,
+                                                                 per_item_latency=per_item_latency))
+    client = make_stub_openai_client(base_url)
+    results = []
+    try:
+        for size in sizes:
+            texts = [f"Title: {p['title'][0]} ; Abstract: {p['abstract']}" for p in make_synthetic_papers(size)]
+            for n_workers in workers:
+                start = time.perf_counter()
+                embeddings = embed_texts(texts, client=client, max_workers=n_workers)
+                elapsed = time.perf_counter() - start
+                embedded = sum(e is not None for e in embeddings)
+                results.append({'papers': size, 'workers': n_workers, 'embedded': embedded,
+                                'seconds': round(elapsed, 3), 'papers_per_sec': round(size / elapsed, 1)})
+                print(f"embed [{size} papers, workers={n_workers}]: {elapsed:.2f}s ({size / elapsed:.1f} papers/sec)")
+    finally:
+        server.shutdown()
+    return results
+
+
+def benchmark_dedup(sizes=(1000, 10000, 100000)):
+    """
+    Time deduplicate_papers with and without near-duplicate detection.
+    """
+    results = []
+    for size in sizes:
+        papers = make_duplicated_papers(size)
+        for near in (False, True):
+            start = time.perf_counter()
+            kept, report = deduplicate_papers([dict(p) for p in papers], near_duplicates=near)
+            elapsed = time.perf_counter() - start
+            results.append({'papers': size, 'near_duplicates': near, 'kept': len(kept),
+                            'reasons': report['reasons'], 'seconds': round(elapsed, 3),
+                            'papers_per_sec': round(size / elapsed, 1)})
+            print(f"dedup [{size} papers, near_duplicates={near}]: {elapsed:.2f}s, kept {len(kept)}, "
+                  f"dropped {report['reasons']}")
+    return results
+
+
+def benchmark_gmm_sweep(n_papers=1000, dim=20, n_topics=15, n_jobs=-1):
+    """
+    Compare the original serial exhaustive GMM sweep with the parallel strategies.
+    """
+    embeddings = make_synthetic_embeddings(n_papers, dim=dim, n_topics=n_topics)
+    max_clusters = n_papers // 10
+    runs = [('serial exhaustive', 1, 'exhaustive', None),
+            ('parallel exhaustive', n_jobs, 'exhaustive', None),
+            ('parallel exhaustive + early stop', n_jobs, 'exhaustive', 10),
+            ('parallel coarse_to_fine', n_jobs, 'coarse_to_fine', None)]
+    results = []
+    for name, jobs, search, patience in runs:
+        start = time.perf_counter()
+        optimal_n, _, scores = select_gmm_components(embeddings, 5, max_clusters, n_jobs=jobs,
+                                                     search=search, patience=patience)
+        elapsed = time.perf_counter() - start
+        results.append({'run': name, 'optimal_n': int(optimal_n), 'fits': len(scores), 'seconds': round(elapsed, 3)})
+        print(f"gmm sweep [{name}]: n={optimal_n}, {len(scores)} fits in {elapsed:.2f}s")
+    return results
+
+
+def benchmark_cluster_scoring(sizes=(1000, 10000, 50000), dim=20, n_topics=15, max_clusters=40,
+                              sample_size=2000, exact_limit=10000, n_jobs=-1):
+    """
+    Compare the chosen number of clusters and sweep runtime for every scoring mode.
+    Exact silhouette is skipped above `exact_limit` points, where it is quadratic.
+    """
+    results = []
+    for size in sizes:
+        embeddings = make_synthetic_embeddings(size, dim=dim, n_topics=n_topics)
+        modes = [('silhouette exact', 'silhouette', None, False),
+                 ('silhouette sampled', 'silhouette', sample_size, False),
+                 ('silhouette sampled+precomputed', 'silhouette', sample_size, True)]
+        modes += [(c, c, None, False) for c in CRITERIA if c != 'silhouette']
+        for name, criterion, sample, precompute in modes:
+            if name == 'silhouette exact' and size > exact_limit:
+                continue
+            start = time.perf_counter()
+            optimal_n, _, scores = select_gmm_components(embeddings, 5, max_clusters, criterion=criterion,
+                                                         n_jobs=n_jobs, sample_size=sample,
+                                                         precompute_distances=precompute)
+            elapsed = time.perf_counter() - start
+            results.append({'papers': size, 'mode': name, 'optimal_n': int(optimal_n),
+                            'fits': len(scores), 'seconds': round(elapsed, 3)})
+            print(f"scoring [{size} points, {name}]: n={optimal_n} in {elapsed:.2f}s")
+    return results
+
+
+def make_synthetic_clusters(n_clusters=50, papers_per_cluster=40, seed=0):
+    # cluster_output-shaped dict of synthetic papers
+    papers = make_synthetic_papers(n_clusters * papers_per_cluster, seed=seed)
+    return {str(c): [{'title': p['title'][0], 'abstract': p['abstract'], 'link': ''}
+                     for p in papers[c * papers_per_cluster:(c + 1) * papers_per_cluster]]
+            for c in range(n_clusters)}
+
+
+def benchmark_aspect_generation(n_clusters=50, papers_per_cluster=40, concurrency=(1, 8, 32), latency=0.5,
+                                representatives=(True, False)):
+    """
+    Time generate_subtopic_aspects against a local fake chat-completions server, naming
+    clusters by their representative papers or by all of them, and count prompt tokens.
+    """
+    server, base_url = start_mock_server(make_chat_handler(latency=latency))
+    client = make_stub_openai_client(base_url)
+    results = []
+    try:
+        for representatives_only in representatives:
+            for max_concurrency in concurrency:
+                clusters = make_synthetic_clusters(n_clusters, papers_per_cluster)
+                metrics.reset()
+                start = time.perf_counter()
+                named = generate_subtopic_aspects(clusters, 'benchmark', max_concurrency=max_concurrency,
+                                                  openai_client=client, representatives_only=representatives_only)
+                elapsed = time.perf_counter() - start
+                related = sum(isinstance(v[0], dict) for v in named.values())
+                prompt_tokens = metrics.snapshot()['counters'].get('llm.prompt_tokens', 0)
+                results.append({'clusters': n_clusters, 'papers_per_cluster': papers_per_cluster,
+                                'representatives_only': representatives_only, 'concurrency': max_concurrency,
+                                'named': related, 'prompt_tokens': prompt_tokens, 'seconds': round(elapsed, 3)})
+                print(f"aspects [{n_clusters} clusters, {'representatives' if representatives_only else 'all papers'}, "
+                      f"concurrency={max_concurrency}]: {elapsed:.2f}s, {related} named, {prompt_tokens} prompt tokens")
+    finally:
+        server.shutdown()
+    return results
+
+
+def make_faulty_aspect_responder(bad_rate=0.2, seed=0):
+    """
+    A responder whose first answer to a prompt is, for a `bad_rate` share of prompts,
+    one of the usual failures: a mistyped first field, an answer cut off halfway, or a
+    ```json fence (harmless). Repair requests, which carry the faulty answer, get a valid one.
+    """
+    def responder(messages):
+        user = messages[-1]['content']
+        first_paper = user.split('\n0: ', 1)[-1].split('\n', 1)[0]
+        if len(messages) > 2:
+            first_paper = messages[1]['content'].split('\n0: ', 1)[-1].split('\n', 1)[0]
+        answer = {'Description': f"Papers like {first_paper}. " + 'Further synthetic detail. ' * 20,
+                  'Subtopic': first_paper[:60], 'Relatedness': 4, 'Is Related': 'RELATED'}
+        draw = int.from_bytes(hashlib.sha256(f"{seed}:{user}".encode()).digest()[:4], 'little') / 2 ** 32
+        if len(messages) > 2 or draw >= bad_rate:
+            return json.dumps(answer)
+        failure = int(draw / bad_rate * 3)
+        if failure == 0:
+            return json.dumps({'Relatedness': 'high', **{k: v for k, v in answer.items() if k != 'Relatedness'}})
+        if failure == 1:
+            text = json.dumps(answer)
+            return text[:len(text) // 2]
+        return f"```json\n{json.dumps(answer)}\n```"
+    return responder
+
+
+def benchmark_structured_output(n_clusters=50, bad_rate=0.2, latency=0.5, token_latency=0.002, streaming=(False, True),
+                                max_concurrency=8):
+    """
+    Name clusters against a fake chat server that answers a share of prompts with
+    malformed JSON, with and without streaming. Reports clusters named and failed,
+    repair requests, completion tokens, and mean time to the first token of an answer.
+    """
+    server, base_url = start_mock_server(make_chat_handler(make_faulty_aspect_responder(bad_rate), latency=latency,
+                                                           token_latency=token_latency))
+    client = make_stub_openai_client(base_url)
+    results = []
+    try:
+        for stream in streaming:
+            clusters = make_synthetic_clusters(n_clusters, 10)
+            metrics.reset()
+            start = time.perf_counter()
+            named = generate_subtopic_aspects(clusters, 'benchmark', max_concurrency=max_concurrency,
+                                              openai_client=client, stream=stream)
+            elapsed = time.perf_counter() - start
+            snapshot = metrics.snapshot()
+            counters, timers = snapshot['counters'], snapshot['timers']
+            first_token = timers.get('llm.first_token', timers.get('llm.call', {'count': 0}))
+            results.append({
+                'clusters': n_clusters, 'bad_rate': bad_rate, 'stream': stream,
+                'named': sum(isinstance(v[0], dict) for v in named.values()),
+                'failed': sum(v[0] == 'Failed' for v in named.values()),
+                'schema_errors': counters.get('llm.schema_errors', 0), 'repairs': counters.get('llm.repairs', 0),
+                'completion_tokens': counters.get('llm.completion_tokens', 0),
+                'first_token_seconds': round(first_token['seconds'] / first_token['count'], 3) if first_token['count'] else None,
+                'seconds': round(elapsed, 3)})
+            print(f"structured [{n_clusters} clusters, bad_rate={bad_rate}, stream={stream}]: {elapsed:.2f}s, "
+                  f"{results[-1]['named']} named, {results[-1]['failed']} failed, {results[-1]['repairs']} repairs")
+    finally:
+        server.shutdown()
+    return results
+
+
+def benchmark_embed_and_save(sizes=(1000, 10000), dim=1536, latency=0.05, per_item_latency=0.0002,
+                             rate_limit=None, max_workers=4):
+    """
+    Time embed_and_save_papers_with_openai end to end (dedup, batching, store write)
+    against a stub embeddings endpoint, cold and then answered from the embedding cache.
+    """
+    server, base_url = start_mock_server(make_embeddings_handler(dim=dim, latency=latency,
+                                                                 per_item_latency=per_item_latency,
+                                                                 rate_limit=rate_limit))
+    client = make_stub_openai_client(base_url)
+    output_dir = tempfile.mkdtemp(prefix='scix_bench_')
+    results = []
+    try:
+        for size in sizes:
+            papers = make_synthetic_papers(size)
+            for run in ('cold', 'cached'):
+                start = time.perf_counter()
+                store = embed_and_save_papers_with_openai([dict(p) for p in papers], f'bench_{size}', output_dir,
+                                                          client=client, max_workers=max_workers)
+                elapsed = time.perf_counter() - start
+                results.append({'papers': size, 'dim': dim, 'run': run, 'embedded': len(store),
+                                'seconds': round(elapsed, 3), 'papers_per_sec': round(size / elapsed, 1)})
+                print(f"embed+save [{size} papers, {run}]: {elapsed:.2f}s ({size / elapsed:.1f} papers/sec)")
+    finally:
+        server.shutdown()
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return results
+
+
+def benchmark_embedding_backends(sizes=(1000, 10000), backends=('openai', 'sentence-transformers', 'onnx'),
+                                 onnx_model=None, batch_size=64, latency=0.05, per_item_latency=0.0002):
+    """
+    Embedding throughput per backend on the same synthetic abstracts: OpenAI against the
+    stub endpoint, local models on this machine's CPU with and without length-sorted
+    batching (with the padding each adds). Backends that are not installed, or onnx
+    without an `onnx_model` export directory, are reported as skipped.
+    """
+    server, base_url = start_mock_server(make_embeddings_handler(latency=latency, per_item_latency=per_item_latency))
+    results = []
+    try:
+        for name in backends:
+            try:
+                if name == 'openai':
+                    backend = get_embedding_backend(name, client=make_stub_openai_client(base_url))
+                elif name == 'onnx' and onnx_model is None:
+                    results.append({'backend': name, 'skipped': 'no onnx_model given'})
+                    continue
+                else:
+                    backend = get_embedding_backend(name, onnx_model if name == 'onnx' else None,
+                                                    batch_size=batch_size)
+            except ImportError as e:
+                results.append({'backend': name, 'skipped': f'not installed ({e.name})'})
+                print(f"embed backends [{name}]: skipped, {e.name} is not installed")
+                continue
+
+            for size in sizes:
+                # Real abstracts vary in length a lot, which is what length sorting exploits
+                rng = np.random.default_rng(size)
+                texts = [f"Title: {p['title'][0]} ; Abstract: {' '.join(p['abstract'].split()[:rng.integers(30, 250)])}"
+                         for p in make_synthetic_papers(size, abstract_words=250)]
+                orders = (None,) if name == 'openai' else (True, False)
+                for sort_by_length in orders:
+                    row = {'backend': name, 'model': backend.model_id, 'papers': size}
+                    if sort_by_length is not None:
+                        backend.sort_by_length = sort_by_length
+                        lengths = [len(ids) for ids in backend.tokenize(texts)]
+                        batches = (length_sorted_batches(lengths, batch_size) if sort_by_length else
+                                   [list(range(i, min(i + batch_size, size))) for i in range(0, size, batch_size)])
+                        row.update({'batch_size': batch_size, 'sorted': sort_by_length,
+                                    'padding_overhead': padding_overhead(lengths, batches)})
+                    start = time.perf_counter()
+                    embeddings = backend.embed(texts)
+                    elapsed = time.perf_counter() - start
+                    row.update({'dim': len(embeddings[0]), 'seconds': round(elapsed, 3),
+                                'papers_per_sec': round(size / elapsed, 1)})
+                    results.append(row)
+                    print(f"embed backends [{name}, {size} papers"
+                          f"{'' if sort_by_length is None else ', sorted' if sort_by_length else ', arrival order'}]: "
+                          f"{elapsed:.2f}s ({size / elapsed:.1f} papers/sec)")
+    finally:
+        server.shutdown()
+    return results
+
+
+def benchmark_vector_index(sizes=(10000, 50000), dim=1536, k=10, n_queries=200, libraries=INDEX_LIBRARIES):
+    """
+    Build time, per-query latency and recall@k (against the exact scan) of each index
+    library over a synthetic embedding store. Libraries that are not installed are
+    reported as skipped.
+    """
+    output_dir = tempfile.mkdtemp(prefix='scix_bench_index_')
+    results = []
+    try:
+        for size in sizes:
+            query = f'bench_{size}'
+            embeddings = make_synthetic_embeddings(size, dim=dim)
+            save_embedding_store([{'title': f"Paper {i}", 'abstract': ''} for i in range(size)],
+                                 embeddings, query, output_dir)
+            # "Papers like this": stored papers, slightly perturbed so they are not exact hits
+            rng = np.random.default_rng(1)
+            queries = embeddings[rng.choice(size, n_queries, replace=False)]
+            queries = queries + rng.normal(0, 0.1 * np.abs(queries).mean(), queries.shape).astype(np.float32)
+            exact_rows = None
+            for library in ('exact',) + tuple(lib for lib in libraries if lib != 'exact'):
+                start = time.perf_counter()
+                try:
+                    index = VectorIndex(query, output_dir, library)
+                except ImportError as e:
+                    results.append({'papers': size, 'library': library, 'skipped': f'not installed ({e.name})'})
+                    continue
+                build_seconds = time.perf_counter() - start
+                index.search(queries[:1], k)  # Warm-up: page in the matrix, compute the exact norms
+                start = time.perf_counter()
+                for q in queries:
+                    rows, _ = index.search(q, k)
+                elapsed = time.perf_counter() - start
+                rows, _ = index.search(queries, k)
+                if exact_rows is None:
+                    exact_rows = rows
+                recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(rows, exact_rows)])
+                results.append({'papers': size, 'dim': dim, 'library': library, 'k': k,
+                                'build_seconds': round(build_seconds, 3), 'seconds': round(elapsed, 3),
+                                'ms_per_query': round(elapsed / n_queries * 1000, 3), 'recall': round(recall, 4)})
+                print(f"index [{size} papers, {library}]: build {build_seconds:.2f}s, "
+                      f"{elapsed / n_queries * 1000:.2f} ms/query, recall@{k} {recall:.3f}")
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return results
+
+
+def benchmark_cluster_output(sizes=(1000, 10000, 50000), n_clusters=50, memberships=1.5):
+    """
+    File size, write time and load time of `_cluster.json` in the old layout (full paper
+    dicts in every cluster) and the compact one (store rows and scores), with papers in
+    `memberships` clusters on average as the GMM soft assignment produces.
+    """
+    output_dir = tempfile.mkdtemp(prefix='scix_bench_clusters_')
+    rng = np.random.default_rng(0)
+    results = []
+    try:
+        for size in sizes:
+            query = f'bench_{size}'
+            papers = [{'title': p['title'][0], 'abstract': p['abstract'], 'link': ''}
+                      for p in make_synthetic_papers(size)]
+            save_embedding_store(papers, np.zeros((size, 1), dtype=np.float32), query, output_dir)
+            cluster_output = {}
+            for row in range(size):
+                n_memberships = 1 + rng.binomial(1, memberships - 1) if memberships > 1 else 1
+                for cluster in rng.choice(n_clusters, n_memberships, replace=False):
+                    cluster_output.setdefault(str(cluster), []).append(
+                        {**papers[row], 'row': row, 'probability': round(float(rng.random()), 4),
+                         'centroid_distance': round(float(rng.random()), 4)})
+            path = os.path.join(output_dir, query, f'{query}_cluster.json')
+            for layout in ('old', 'compact'):
+                start = time.perf_counter()
+                if layout == 'old':
+                    with open(path, 'w') as f:
+                        json.dump(cluster_output, f)
+                else:
+                    save_cluster_output(cluster_output, path, query, output_dir)
+                write_seconds = time.perf_counter() - start
+                start = time.perf_counter()
+                loaded = load_cluster_output(path, query, output_dir)
+                load_seconds = time.perf_counter() - start
+                start = time.perf_counter()
+                first_cluster = list(loaded.values())[0]
+                titles = [paper['title'] for paper in first_cluster]
+                access_seconds = time.perf_counter() - start
+                results.append({'papers': size, 'layout': layout, 'megabytes': round(os.path.getsize(path) / 1e6, 3),
+                                'write_seconds': round(write_seconds, 4), 'seconds': round(load_seconds, 4),
+                                'first_cluster_seconds': round(access_seconds, 4)})
+                print(f"cluster output [{size} papers, {layout}]: {os.path.getsize(path) / 1e6:.2f} MB, "
+                      f"write {write_seconds:.3f}s, load {load_seconds:.3f}s, "
+                      f"first cluster's {len(titles)} papers {access_seconds:.3f}s")
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return results
+
+
+def benchmark_cluster_methods(sizes=(1000, 10000), dim=1536, methods=CLUSTER_METHODS, n_clusters=50,
+                              quadratic_limit=10000, sample_limit=10000, n_jobs=-1):
+    """
+    Time cluster_papers for every cluster_method on synthetic embeddings. UMAP runs once
+    per size (its own row) and is served from the reduction cache for every method, so
+    the method rows time clustering alone. HCL and OPTICS are skipped above
+    `quadratic_limit` points; GMM silhouette is sampled above `sample_limit`. Methods
+    whose optional dependencies are missing are reported as skipped.
+    """
+    cache_dir = tempfile.mkdtemp(prefix='scix_bench_umap_')
+    results = []
+    try:
+        for size in sizes:
+            embeddings = make_synthetic_embeddings(size, dim=dim)
+            titles_abstracts = [(f"Paper {i}", "", "") for i in range(size)]
+            start = time.perf_counter()
+            _, report = reduce_embeddings(embeddings, cache_dir=cache_dir)
+            elapsed = time.perf_counter() - start
+            results.append({'papers': size, 'dim': dim, 'method': 'UMAP', 'seconds': round(elapsed, 3),
+                            'jit_seconds': round(report['jit_seconds'], 3)})
+            print(f"cluster [{size} papers, UMAP]: {elapsed:.2f}s (JIT {report['jit_seconds']:.2f}s)")
+
+            for method in methods:
+                row = {'papers': size, 'dim': dim, 'method': method}
+                if method in ('HCL', 'OPTICS') and size > quadratic_limit:
+                    results.append({**row, 'skipped': f'quadratic above {quadratic_limit} papers'})
+                    continue
+                start = time.perf_counter()
+                try:
+                    cluster_output, _, _ = cluster_papers(embeddings, titles_abstracts, min(n_clusters, size // 10),
+                                                          method, True, False, True, n_jobs=n_jobs,
+                                                          score_sample_size=2000 if size > sample_limit else None,
+                                                          umap_cache_dir=cache_dir)
+                except ImportError as e:
+                    results.append({**row, 'skipped': str(e)})
+                    print(f"cluster [{size} papers, {method}]: skipped ({e})")
+                    continue
+                elapsed = time.perf_counter() - start
+                results.append({**row, 'clusters': len(cluster_output), 'seconds': round(elapsed, 3)})
+                print(f"cluster [{size} papers, {method}]: {len(cluster_output)} clusters in {elapsed:.2f}s")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def fake_outline_response(messages):
+    user = messages[-1]['content']
+    if user.startswith('Subtopics: '):
+        # Hierarchical mode, labelling one chapter after its first subtopic
+        first = next(iter(json.loads(user[len('Subtopics: '):]).values()))
+        return json.dumps({'cluster_title': f"Chapter on {first['Subtopic']}", 'description': 'Synthetic'})
+    if user.startswith('Chapters: '):
+        # Hierarchical mode, ordering the chapters as given
+        return json.dumps({'order': list(json.loads(user[len('Chapters: '):]))})
+    # A valid single-prompt outline that groups the subtopics into chapters of ten, in input order
+    subtopics = ast.literal_eval(user.split('Subtopic dictionary: ', 1)[1])
+    ids = list(subtopics)
+    chapters = [ids[i:i + 10] for i in range(0, len(ids), 10)]
+    return json.dumps({
+        'clusters': [{'cluster_id': str(c + 1), 'cluster_title': f"Chapter {c + 1}", 'description': 'Synthetic'}
+                     for c in range(len(chapters))],
+        'subtopics': {sid: str(c + 1) for c, chapter in enumerate(chapters) for sid in chapter},
+    })
+
+
+def fake_outline_latency(messages, latency):
+    # Like a real model, answer time grows with the prompt: `latency` per 1000 prompt tokens, at least `latency`
+    prompt_tokens = sum(len(m['content']) // 4 + 1 for m in messages)
+    return latency * max(1.0, prompt_tokens / 1000)
+
+
+def benchmark_outline(subtopic_counts=(50, 200, 800), modes=('single', 'hierarchical'), latency=0.5, dim=1536):
+    """
+    Time generate_outline in each mode against local fake chat-completions and
+    embeddings servers. The fake model's latency grows with prompt length, so the
+    single prompt slows down with more subtopics while the hierarchical calls stay small.
+    """
+    server, base_url = start_mock_server(make_chat_handler(fake_outline_response, latency=latency,
+                                                           latency_fn=fake_outline_latency))
+    embed_server, embed_url = start_mock_server(make_embeddings_handler(dim, latency=0.05))
+    client = make_stub_openai_client(base_url)
+    embedding_backend = OpenAIBackend(client=make_stub_openai_client(embed_url))
+    results = []
+    try:
+        for n_subtopics in subtopic_counts:
+            subtopics = {str(i): {'Subtopic': f"Subtopic {i}",
+                                  'Description': f"Synthetic subtopic {i} about " + ' '.join(VOCABULARY[(i * 40 + j) % len(VOCABULARY)] for j in range(40)),
+                                  'Relatedness': 4, 'Is Related': 'RELATED'} for i in range(n_subtopics)}
+            for mode in modes:
+                start = time.perf_counter()
+                outline = generate_outline(subtopics, 'benchmark', None, openai_client=client, mode=mode,
+                                           embedding_backend=embedding_backend)
+                elapsed = time.perf_counter() - start
+                results.append({'subtopics': n_subtopics, 'mode': mode,
+                                'chapters': len(outline['clusters']) if outline else 0,
+                                'assigned': len(outline['subtopics']) if outline else 0,
+                                'seconds': round(elapsed, 3)})
+                print(f"outline [{n_subtopics} subtopics, {mode}]: {elapsed:.2f}s")
+    finally:
+        server.shutdown()
+        embed_server.shutdown()
+    return results
+
+
+def run_suite(sizes=(1000, 10000), dim=1536, latency=0.05, llm_latency=0.5, rate_limit=None):
+    """
+    Every remote-facing stage at the same corpus sizes, for comparable runs: ADS fetch,
+    embedding + store, each clustering method, aspect naming and outline creation.
+    """
+    return {
+        'ads': [row for size in sizes for row in benchmark_ads_fetch(size, workers=(1, 8), latency=latency)],
+        'embed_save': benchmark_embed_and_save(sizes, dim, latency, rate_limit=rate_limit),
+        'cluster': benchmark_cluster_methods(sizes, dim),
+        'aspects': benchmark_aspect_generation(n_clusters=max(10, min(sizes) // 40), concurrency=(8,),
+                                               latency=llm_latency),
+        'outline': benchmark_outline(latency=llm_latency),
+    }
+
+
+def benchmark_environment():
+    # Recorded with every results file so runs from different machines or commits are not mixed up
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'numpy': np.__version__}
+
+
+def _row_key(row):
+    # A result row's identity: everything except the measurements
+    return json.dumps({k: v for k, v in row.items() if not k.endswith('seconds') and not k.endswith('_per_sec')},
+                      sort_keys=True)
+
+
+def compare_results(old, new):
+    """
+    Print the speed ratio of every result row present in both runs, matched on all
+    non-timing fields. Ratios above 1 mean the new run is slower.
+    """
+    for bench, rows in new['results'].items():
+        old_rows = {_row_key(row): row for row in old['results'].get(bench, [])}
+        for row in rows:
+            key = _row_key(row)
+            before = old_rows.get(key)
+            if before and before.get('seconds') and row.get('seconds') is not None:
+                print(f"{bench} {key}: {before['seconds']:.3f}s -> {row['seconds']:.3f}s "
+                      f"(x{row['seconds'] / before['seconds']:.2f})")
+
+
+# Modules that must import without these heavy dependencies, so a run that only reuses
+# cached results starts quickly
+LIGHT_IMPORTS = ('SciX_Pipeline', 'SciX_cluster_subtopic', 'SciX_subtopic_aspect_generation',
+                 'SciX_outline_creation', 'SciX_Reduction', 'SciX_Cluster_Scoring', 'SciX_Paper_Embeddings',
+                 'SciX_Incremental')
+HEAVY_DEPENDENCIES = ('openai', 'umap', 'numba', 'sklearn', 'streamlit')
+
+
+def parse_importtime(stderr):
+    # `python -X importtime` lines: "import time: self [us] | cumulative | imported package"
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+def benchmark_import_time(modules=LIGHT_IMPORTS, budget_seconds=0.5):
+    """
+    Regression check for startup cost: import each module in a fresh interpreter with
+    `python -X importtime` and fail it if it takes over `budget_seconds` or loads one
+    of HEAVY_DEPENDENCIES.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for module in modules:
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                   cwd=here, capture_output=True, text=True)
+        timings = parse_importtime(completed.stderr)
+        seconds = timings.get(module, 0) / 1e6
+        heavy = sorted(name for name in timings if name.split('.')[0] in HEAVY_DEPENDENCIES and '.' not in name)
+        slowest = sorted(((t, name) for name, t in timings.items() if name != module), reverse=True)[:3]
+        ok = completed.returncode == 0 and seconds <= budget_seconds and not heavy
+        results.append({'module': module, 'seconds': round(seconds, 3), 'heavy_imports': heavy, 'ok': ok,
+                        'slowest': [{'module': name, 'seconds': round(t / 1e6, 3)} for t, name in slowest]})
+        print(f"import {module}: {seconds:.3f}s {'ok' if ok else 'FAIL'}"
+              f"{' (loads ' + ', '.join(heavy) + ')' if heavy else ''}")
+    return results
+
+
+BENCHMARKS = {
+    'ads': benchmark_ads_fetch,
+    'embed': benchmark_embedding_batches,
+    'dedup': benchmark_dedup,
+    'gmm': benchmark_gmm_sweep,
+    'scoring': benchmark_cluster_scoring,
+    'aspects': benchmark_aspect_generation,
+    'imports': benchmark_import_time,
+    'embed_save': benchmark_embed_and_save,
+    'cluster': benchmark_cluster_methods,
+    'outline': benchmark_outline,
+    'embed_backends': benchmark_embedding_backends,
+    'index': benchmark_vector_index,
+    'cluster_output': benchmark_cluster_output,
+    'structured': benchmark_structured_output,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bench', dest='bench', choices=sorted(BENCHMARKS) + ['suite'], default='ads', help='benchmark to run; suite runs every stage at the same sizes')
+    parser.add_argument('--sizes', dest='sizes', nargs='+', type=int, default=None, help='corpus sizes, e.g. 1000 10000 100000')
+    parser.add_argument('--dim', dest='dim', type=int, default=1536, help='embedding dimension (ada-002 is 1536)')
+    parser.add_argument('--latency', dest='latency', type=float, default=None, help='mock server latency per request in seconds')
+    parser.add_argument('--rate_limit', dest='rate_limit', type=int, default=None, help='mock server requests per second before answering 429')
+    parser.add_argument('--onnx_model', dest='onnx_model', type=str, default=None, help='exported ONNX model directory for the embed_backends benchmark')
+    parser.add_argument('--output', dest='output', type=str, default=None, help='JSON file to write results to (default: benchmark_results/<bench>_<time>.json)')
+    parser.add_argument('--compare', dest='compare', type=str, default=None, help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    if args.bench == 'suite':
+        options = {'sizes': tuple(args.sizes or (1000, 10000)), 'dim': args.dim, 'rate_limit': args.rate_limit}
+        if args.latency is not None:
+            options['latency'] = args.latency
+        results = run_suite(**options)
+    else:
+        # Only pass the options this benchmark takes
+        accepted = inspect.signature(BENCHMARKS[args.bench]).parameters
+        options = {'sizes': tuple(args.sizes) if args.sizes else None, 'dim': args.dim,
+                   'latency': args.latency, 'rate_limit': args.rate_limit, 'onnx_model': args.onnx_model}
+        options = {k: v for k, v in options.items() if k in accepted and v is not None}
+        results = {args.bench: BENCHMARKS[args.bench](**options)}
+
+    report = {'environment': benchmark_environment(), 'bench': args.bench, 'options': options, 'results': results}
+    output = args.output or os.path.join('benchmark_results', f"{args.bench}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), report)
+    if args.bench == 'imports' and not all(result['ok'] for result in results['imports']):
+        sys.exit(1)
@@ -0,0 +1,55 @@
+import numpy as np
+
+CRITERIA = ('silhouette', 'bic', 'aic', 'davies_bouldin', 'calinski_harabasz')
+
+
+class ClusterScorer:
+    """
+    Scores candidate clusterings so that higher is always better.
+
+    criterion='silhouette' is O(n^2) per candidate, so it can be restricted to a fixed
+    random sample (`sample_size`, same rows for every candidate) and/or use a pairwise
+    distance matrix computed once and reused across the whole sweep (`precompute`).
+    'bic'/'aic' (GMM only), 'davies_bouldin' and 'calinski_harabasz' are linear-time
+    alternatives.
+    """
+
+    def __init__(self, embeddings, criterion='silhouette', sample_size=None, precompute=False,
+                 metric='euclidean', seed=42):
+        if criterion not in CRITERIA:
+            raise ValueError(f"Invalid scoring criterion: {criterion}. Choose from {CRITERIA}")
+        self.criterion = criterion
+        self.metric = metric
+        self.sample = None
+        self.distances = None
+
+        if criterion == 'silhouette':
+            if sample_size is not None and sample_size < len(embeddings):
+                rng = np.random.default_rng(seed)
+                self.sample = np.sort(rng.choice(len(embeddings), size=sample_size, replace=False))
+            if precompute:
+                from sklearn.metrics import pairwise_distances
+                rows = embeddings if self.sample is None else embeddings[self.sample]
+                self.distances = pairwise_distances(rows, metric=metric).astype(np.float32)
+
+    def score(self, embeddings, labels, model=None):
+        from sklearn.metrics import silhouette_score, davies_bouldin_score, calinski_harabasz_score
+        if self.criterion in ('bic', 'aic'):
+            if model is None or not hasattr(model, self.criterion):
+                raise ValueError(f"The '{self.criterion}' criterion needs a fitted GaussianMixture")
+            return -getattr(model, self.criterion)(embeddings)
+
+        if self.criterion == 'silhouette' and self.sample is not None:
+            labels = np.asarray(labels)[self.sample]
+        if len(np.unique(labels)) < 2:
+            # All of these scores need at least 2 clusters to be meaningful
+            return -np.inf
+
+        if self.criterion == 'silhouette':
+            if self.distances is not None:
+                return silhouette_score(self.distances, labels, metric='precomputed')
+            rows = embeddings if self.sample is None else embeddings[self.sample]
+            return silhouette_score(rows, labels, metric=self.metric)
+        if self.criterion == 'davies_bouldin':
+            return -davies_bouldin_score(embeddings, labels)
+        return calinski_harabasz_score(embeddings, labels)
@@ -0,0 +1,271 @@
+import os
+import json
+import hashlib
+import argparse
+from collections.abc import Sequence
+import numpy as np
+from SciX_Embedding_Store import embedding_store_paths, load_embedding_store
+
+try:  # orjson is optional; it parses and writes these files several times faster
+    import orjson
+except ImportError:
+    orjson = None
+
+CLUSTER_FORMAT = 1
+SCORE_FIELDS = ('probability', 'centroid_distance', 'representative')
+STAMP_SAMPLE_ROWS = 16  # Store rows whose vectors are hashed into a cluster file's store stamp
+FAILED = 'Failed'  # Subtopic of clusters whose naming failed after every repair; name_the_clusters retries them
+
+
+class ClusterStoreMismatch(ValueError):
+    """
+    A compact cluster file whose rows were written for a different embedding store.
+    """
+
+
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class PapersTable:
+    """
+    The papers of a query, by embedding store row. The store's metadata file is only
+    parsed the first time a paper is looked up.
+    """
+
+    def __init__(self, query, output_dir):
+        self.query = query
+        self.output_dir = output_dir
+        self._metadata = None
+
+    def __getitem__(self, row):
+        if self._metadata is None:
+            _, metadata_path = embedding_store_paths(self.query, self.output_dir)
+            with open(metadata_path, 'rb') as f:
+                self._metadata = [loads(line) for line in f]
+        return self._metadata[row]
+
+
+class ClusterMembers(Sequence):
+    """
+    The papers of one cluster as store rows plus per-paper scores. Behaves like the
+    list of paper dicts `cluster_papers` returns; each dict (title, abstract, link,
+    row and scores) is built from the papers table on first access.
+    """
+
+    def __init__(self, rows, scores, papers):
+        self.rows = rows
+        self.scores = scores  # field -> list aligned with rows; None (or -1 for 'representative') if unknown
+        self._papers = papers
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i not in self._cache:
+            meta = self._papers[self.rows[i]]
+            paper = {'title': meta['title'], 'abstract': meta['abstract'], 'link': meta.get('link', ''),
+                     'row': self.rows[i]}
+            for field, values in self.scores.items():
+                value = values[i]
+                if value is not None and not (field == 'representative' and value < 0):
+                    paper[field] = value
+            self._cache[i] = paper
+        return self._cache[i]
+
+    def append(self, paper):
+        # Papers added later (e.g. by an incremental update) may not have every score
+        self.rows.append(paper['row'])
+        for field, values in self.scores.items():
+            values.append(paper.get(field, -1 if field == 'representative' else None))
+        self._cache.pop(len(self.rows) - 1, None)
+
+
+def compact_members(papers):
+    """
+    Rows and score columns of a cluster, from a ClusterMembers or a list of paper dicts
+    with a 'row' key. Raises KeyError for a paper without one.
+    """
+    if isinstance(papers, ClusterMembers):
+        return {'rows': papers.rows, **papers.scores}
+    members = {'rows': [paper['row'] for paper in papers]}
+    for field in SCORE_FIELDS:
+        if any(field in paper for paper in papers):
+            members[field] = [paper.get(field, -1 if field == 'representative' else None) for paper in papers]
+    return members
+
+
+def membership(papers):
+    # Which papers a cluster holds: store rows when every paper has one, otherwise titles
+    if isinstance(papers, ClusterMembers):
+        return tuple(papers.rows)
+    if all('row' in paper for paper in papers):
+        return tuple(paper['row'] for paper in papers)
+    return tuple(str(paper['title']) for paper in papers)
+
+
+def store_stamp(store, n_rows=None):
+    """
+    Row count and a hash of evenly spaced vectors among the first `n_rows` rows of the
+    store. Appending rows keeps the stamp of the earlier ones; re-embedding or dropping
+    papers changes it.
+    """
+    n_rows = len(store) if n_rows is None else n_rows
+    rows = np.unique(np.linspace(0, n_rows - 1, STAMP_SAMPLE_ROWS).astype(int)) if n_rows else []
+    digest = hashlib.sha256(str(n_rows).encode())
+    digest.update(np.ascontiguousarray(store.vectors[rows], dtype=np.float32).tobytes())
+    return {'rows': n_rows, 'fingerprint': digest.hexdigest()[:16]}
+
+
+def check_store(stamp, path, query, output_dir):
+    # Rows are only meaningful for the store they were written against
+    store = load_embedding_store(query, output_dir)
+    if len(store) < stamp['rows'] or store_stamp(store, stamp['rows']) != stamp:
+        raise ClusterStoreMismatch(f"{os.path.basename(path)} was written for a different embedding store "
+                                   f"({stamp['rows']} rows, now {len(store)})")
+
+
+def with_rows(papers, row_of_title):
+    # Papers without a store row (written before rows were kept) are matched by title
+    return [paper if 'row' in paper or paper['title'] not in row_of_title
+            else {**paper, 'row': row_of_title[paper['title']]} for paper in papers]
+
+
+def _compact_clusters(clusters, query, output_dir):
+    """
+    compact_members of every cluster, resolving missing rows by title, and the number
+    of papers that are not in the store (the clusters are None if there are any).
+    """
+    if any(not isinstance(papers, ClusterMembers) and any('row' not in paper for paper in papers)
+           for papers in clusters.values()):
+        store = load_embedding_store(query, output_dir)
+        row_of_title = {meta['title']: row for row, meta in enumerate(store.metadata)}
+        clusters = {cluster_id: papers if isinstance(papers, ClusterMembers) else with_rows(papers, row_of_title)
+                    for cluster_id, papers in clusters.items()}
+    missing = sum(1 for papers in clusters.values() if not isinstance(papers, ClusterMembers)
+                  for paper in papers if 'row' not in paper)
+    if missing:
+        return None, missing
+    return {cluster_id: compact_members(papers) for cluster_id, papers in clusters.items()}, 0
+
+
+def _write(payload, path):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(dumps(payload))
+    os.replace(tmp_path, path)
+
+
+def _write_legacy(payload, path, missing):
+    print(f"Warning: {missing} papers in {os.path.basename(path)} are not in the embedding store; "
+          f"writing it with full paper dicts")
+    _write(payload, path)
+
+
+def save_cluster_output(cluster_output, path, query, output_dir):
+    """
+    Write cluster_output as store rows and score columns per cluster instead of full
+    paper dicts, stamped with the store they refer to. Papers without a row are matched
+    to the store by title; if one is not in it, the file keeps full paper dicts.
+    """
+    clusters, missing = _compact_clusters(cluster_output, query, output_dir)
+    if clusters is None:
+        _write_legacy({cluster_id: list(papers) for cluster_id, papers in cluster_output.items()}, path, missing)
+        return
+    _write({'format': CLUSTER_FORMAT, 'store': store_stamp(load_embedding_store(query, output_dir)),
+            'clusters': clusters}, path)
+
+
+def save_named_clusters(named, path, query, output_dir):
+    """
+    Write {cluster_id: (subtopic, papers)} like save_cluster_output, with the subtopics
+    kept in a separate table.
+    """
+    clusters, missing = _compact_clusters({cluster_id: papers for cluster_id, (_, papers) in named.items()},
+                                          query, output_dir)
+    if clusters is None:
+        _write_legacy({cluster_id: [subtopic, list(papers)] for cluster_id, (subtopic, papers) in named.items()},
+                      path, missing)
+        return
+    _write({'format': CLUSTER_FORMAT, 'store': store_stamp(load_embedding_store(query, output_dir)),
+            'subtopics': {cluster_id: subtopic for cluster_id, (subtopic, _) in named.items()},
+            'clusters': clusters}, path)
+
+
+def _members(compact, papers):
+    scores = {field: values for field, values in compact.items() if field != 'rows'}
+    return ClusterMembers(compact['rows'], scores, papers)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def load_cluster_output(path, query, output_dir):
+    """
+    {cluster_id: papers} from either layout; compact files give ClusterMembers whose
+    paper dicts are only built when read. ClusterStoreMismatch if the store has been
+    rewritten since the file was saved.
+    """
+    data = _read(path)
+    if data.get('format') != CLUSTER_FORMAT:
+        return data  # Old layout: already full paper dicts
+    if 'store' in data:
+        check_store(data['store'], path, query, output_dir)
+    papers = PapersTable(query, output_dir)
+    return {cluster_id: _members(compact, papers) for cluster_id, compact in data['clusters'].items()}
+
+
+def load_named_clusters(path, query, output_dir):
+    """
+    {cluster_id: [subtopic, papers]} from either layout, as name_the_clusters returns it.
+    """
+    data = _read(path)
+    if data.get('format') != CLUSTER_FORMAT:
+        return data
+    if 'store' in data:
+        check_store(data['store'], path, query, output_dir)
+    papers = PapersTable(query, output_dir)
+    return {cluster_id: [data['subtopics'][cluster_id], _members(compact, papers)]
+            for cluster_id, compact in data['clusters'].items()}
+
+
+def has_failed_clusters(path):
+    # Reads only the subtopics, so checking a named file needs neither the store nor the papers
+    data = _read(path)
+    if data.get('format') != CLUSTER_FORMAT:
+        return any(subtopic == FAILED for subtopic, _ in data.values())
+    return any(subtopic == FAILED for subtopic in data['subtopics'].values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--query', dest='query', type=str, help='query whose cluster files to convert')
+    parser.add_argument('--output_dir', dest='output_dir', default='Data', type=str, help='data directory')
+    args = parser.parse_args()
+
+    # Rewrite old-layout files in the compact layout; the savers match papers to store rows by title
+    query_dir = os.path.join(args.output_dir, args.query)
+    cluster_path = os.path.join(query_dir, f'{args.query}_cluster.json')
+    named_path = os.path.join(query_dir, f'{args.query}_clusters_with_subtopics.json')
+    for path, load, save in ((cluster_path, load_cluster_output, save_cluster_output),
+                             (named_path, load_named_clusters, save_named_clusters)):
+        if not os.path.exists(path):
+            continue
+        before = os.path.getsize(path)
+        save(load(path, args.query, args.output_dir), path, args.query, args.output_dir)
+        print(f"{os.path.basename(path)}: {before / 1e6:.2f} MB -> {os.path.getsize(path) / 1e6:.2f} MB")
@@ -0,0 +1,128 @@
+import re
+import zlib
+import unicodedata
+from collections import Counter, defaultdict
+import numpy as np
+
+# splitmix64 finalizer constants; uint64 products wrap modulo 2**64
+_MIX1 = np.uint64(0xbf58476d1ce4e5b9)
+_MIX2 = np.uint64(0x94d049bb133111eb)
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_title(title):
+    """
+    Normalize a title (string or ADS-style list of strings) for exact duplicate
+    matching; returns None if there is no usable title.
+    """
+    if isinstance(title, list):
+        title = " ".join(title)
+    if not isinstance(title, str):
+        return None
+    title = unicodedata.normalize('NFKC', title).lower()
+    title = _NON_ALNUM.sub(' ', title).strip()
+    return title or None
+
+
+def shingles(text, k=3):
+    # Word k-grams of the normalized text, hashed to 32-bit integers
+    words = _NON_ALNUM.sub(' ', unicodedata.normalize('NFKC', text).lower()).split()
+    if len(words) < k:
+        words = words + [''] * (k - len(words))
+    return np.fromiter({zlib.crc32(" ".join(words[i:i + k]).encode()) for i in range(len(words) - k + 1)},
+                       dtype=np.uint64)
+
+
+class PaperDeduplicator:
+    """
+    Streaming dedup stage: exact duplicates are caught with a normalized-title hash
+    set, and optionally near duplicates (e.g. preprint vs journal version) with
+    MinHash signatures over title+abstract shingles, bucketed by LSH bands.
+    Every drop is counted by reason in `dropped`.
+    """
+
+    def __init__(self, near_duplicates=False, threshold=0.8, num_perm=128, bands=32, seed=42):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.near_duplicates = near_duplicates
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.seen_titles = set()
+        self.dropped = Counter()
+        self.kept = 0
+
+        rng = np.random.default_rng(seed)
+        self._seeds = rng.integers(0, np.iinfo(np.uint64).max, size=(num_perm, 1), dtype=np.uint64, endpoint=True)
+        self._buckets = [defaultdict(list) for _ in range(bands)]
+        self._signatures = []
+
+    def minhash(self, text):
+        # One seeded splitmix64 mix of the shingle hashes per permutation. A linear
+        # (a * h + b) mod p with a small `a` barely reorders the hashes, so every
+        # permutation picked nearly the same minimum and near duplicates were missed
+        z = shingles(text)[None, :] ^ self._seeds
+        z = (z ^ (z >> np.uint64(30))) * _MIX1
+        z = (z ^ (z >> np.uint64(27))) * _MIX2
+        return (z ^ (z >> np.uint64(31))).min(axis=1)
+
+    def check(self, title, abstract=''):
+        """
+        Return the reason the record is a duplicate, or None after recording it as kept.
+        """
+        key = normalize_title(title)
+        if key is None:
+            self.dropped['invalid_title'] += 1
+            return 'invalid_title'
+        if key in self.seen_titles:
+            self.dropped['duplicate_title'] += 1
+            return 'duplicate_title'
+
+        if self.near_duplicates:
+            signature = self.minhash(f"{key} {abstract or ''}")
+            band_keys = [signature[b * self.rows:(b + 1) * self.rows].tobytes() for b in range(self.bands)]
+            candidates = {idx for b, band_key in enumerate(band_keys) for idx in self._buckets[b].get(band_key, ())}
+            for idx in candidates:
+                if np.mean(self._signatures[idx] == signature) >= self.threshold:
+                    self.dropped['near_duplicate'] += 1
+                    return 'near_duplicate'
+            for b, band_key in enumerate(band_keys):
+                self._buckets[b][band_key].append(len(self._signatures))
+            self._signatures.append(signature)
+
+        self.seen_titles.add(key)
+        self.kept += 1
+        return None
+
+    def report(self):
+        return {'kept': self.kept, 'dropped': sum(self.dropped.values()), 'reasons': dict(self.dropped)}
+
+
+def deduplicate_papers(papers, near_duplicates=False, threshold=0.8, dedup=None):
+    """
+    Validate and deduplicate papers in one linear pass. Titles given as lists are
+    joined into strings. Returns (kept_papers, report) where the report counts
+    dropped records by reason. Pass a `dedup` already fed with earlier papers to
+    also drop papers seen before.
+    """
+    if dedup is None:
+        dedup = PaperDeduplicator(near_duplicates=near_duplicates, threshold=threshold)
+    kept = []
+    for idx, paper in enumerate(papers):
+        if not isinstance(paper, dict):
+            dedup.dropped['not_a_dict'] += 1
+            continue
+
+        title = paper.get('title')
+        abstract = paper.get('abstract')
+        if isinstance(title, list):
+            title = " ".join(title)
+            paper['title'] = title
+        if not isinstance(title, str) or not isinstance(abstract, str):
+            dedup.dropped['invalid_title_or_abstract'] += 1
+            continue
+
+        if dedup.check(title, abstract) is None:
+            kept.append(paper)
+
+    return kept, dedup.report()
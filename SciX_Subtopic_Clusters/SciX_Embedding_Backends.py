@@ -0,0 +1,261 @@
+import os
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from SciX_Metrics import metrics
+
+EMBEDDING_BACKENDS = ('openai', 'sentence-transformers', 'onnx')
+LOCAL_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+LOCAL_BATCH_SIZE = 64
+LOCAL_MAX_LENGTH = 256  # Tokens per text; longer abstracts are truncated
+
+
+def length_sorted_batches(lengths, batch_size=LOCAL_BATCH_SIZE):
+    """
+    Group text indices into batches of similar token length, longest first, so padding
+    each batch to its own longest text wastes little compute.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def padding_overhead(lengths, batches):
+    # Padded tokens as a fraction of real tokens when every batch is padded to its longest text
+    real = sum(lengths)
+    padded = sum(max(lengths[i] for i in batch) * len(batch) for batch in batches)
+    return round(padded / real - 1, 4) if real else 0.0
+
+
+def pad_batch(token_ids, pad_id=0):
+    """
+    Pad a batch of token id lists to the longest one in the batch (dynamic padding) and
+    return int64 input_ids and attention_mask matrices.
+    """
+    width = max(len(ids) for ids in token_ids)
+    input_ids = np.full((len(token_ids), width), pad_id, dtype=np.int64)
+    attention_mask = np.zeros((len(token_ids), width), dtype=np.int64)
+    for row, ids in enumerate(token_ids):
+        input_ids[row, :len(ids)] = ids
+        attention_mask[row, :len(ids)] = 1
+    return input_ids, attention_mask
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def mean_pool(token_embeddings, attention_mask):
+    # Average the token vectors of the real (unpadded) tokens, then L2-normalize
+    mask = attention_mask[:, :, None].astype(np.float32)
+    pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+    return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+
+class OpenAIBackend:
+    """
+    The OpenAI embeddings API, sent in token-budgeted concurrent batches by
+    SciX_Paper_Embeddings.embed_texts.
+    """
+    name = 'openai'
+
+    def __init__(self, model=None, client=None, max_workers=4, **batch_options):
+        from SciX_Paper_Embeddings import EMBEDDING_MODEL
+        self.model = model or EMBEDDING_MODEL
+        self.client = client
+        self.max_workers = max_workers
+        self.batch_options = batch_options  # max_batch_tokens / max_batch_items
+
+    @property
+    def model_id(self):
+        return self.model
+
+    def embed(self, texts, cache=None):
+        from SciX_Paper_Embeddings import embed_texts
+        return embed_texts(texts, self.model, self.client, self.max_workers, cache=cache,
+                           **self.batch_options)
+
+
+class LocalBackend:
+    """
+    Base for models that run on this machine. Texts are tokenized once, grouped into
+    length-sorted batches, padded per batch and encoded on a thread pool (the model
+    runtimes release the GIL). Subclasses provide tokenize() and encode_batch().
+    """
+    name = None
+
+    def __init__(self, model, batch_size=LOCAL_BATCH_SIZE, max_length=LOCAL_MAX_LENGTH, max_workers=None,
+                 sort_by_length=True):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.sort_by_length = sort_by_length  # Off only to measure what sorting saves
+
+    @property
+    def model_id(self):
+        # Embedding cache key; vectors from different backends must never be mixed
+        return f"{self.name}:{self.model}"
+
+    def tokenize(self, texts):
+        raise NotImplementedError
+
+    def encode_batch(self, input_ids, attention_mask):
+        raise NotImplementedError
+
+    def encode(self, texts):
+        """
+        Return a float32 matrix of L2-normalized embeddings aligned with `texts`.
+        """
+        token_ids = self.tokenize(texts)
+        lengths = [len(ids) for ids in token_ids]
+        if self.sort_by_length:
+            batches = length_sorted_batches(lengths, self.batch_size)
+        else:
+            batches = [list(range(i, min(i + self.batch_size, len(texts)))) for i in range(0, len(texts), self.batch_size)]
+
+        def run(batch):
+            with metrics.timer('embed.batch'):
+                return self.encode_batch(*pad_batch([token_ids[i] for i in batch], self.pad_id))
+
+        embeddings = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for batch, vectors in zip(batches, executor.map(run, batches)):
+                if embeddings is None:
+                    embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+                embeddings[batch] = vectors
+                metrics.increment('embed.texts', len(batch))
+                metrics.increment('embed.tokens', sum(lengths[i] for i in batch))
+        return embeddings
+
+    def embed(self, texts, cache=None):
+        """
+        Same contract as embed_texts: a list aligned with `texts`, only cache misses encoded.
+        """
+        embeddings = cache.get_many(self.model_id, texts) if cache is not None else [None] * len(texts)
+        missing = [i for i, vector in enumerate(embeddings) if vector is None]
+        if cache is not None:
+            metrics.increment('embed_cache.hits', len(texts) - len(missing))
+            metrics.increment('embed_cache.misses', len(missing))
+        if not missing:
+            return embeddings
+
+        vectors = self.encode([texts[i] for i in missing])
+        for i, vector in zip(missing, vectors):
+            embeddings[i] = vector
+        if cache is not None:
+            cache.put_many(self.model_id, [texts[i] for i in missing], vectors)
+        return embeddings
+
+
+class SentenceTransformersBackend(LocalBackend):
+    """
+    A sentence-transformers model (optional dependency) on the CPU, e.g. all-MiniLM-L6-v2.
+    """
+    name = 'sentence-transformers'
+
+    def __init__(self, model=LOCAL_MODEL, device='cpu', **kwargs):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        super().__init__(model, **kwargs)
+        # Split the cores between the pool's workers instead of oversubscribing them
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // self.max_workers))
+        self._model = SentenceTransformer(model, device=device)
+        self._model.max_seq_length = self.max_length
+        self.pad_id = self._model.tokenizer.pad_token_id or 0
+
+    def tokenize(self, texts):
+        return self._model.tokenizer(texts, truncation=True, max_length=self.max_length)['input_ids']
+
+    def encode_batch(self, input_ids, attention_mask):
+        import torch
+        features = {'input_ids': torch.from_numpy(input_ids), 'attention_mask': torch.from_numpy(attention_mask)}
+        with torch.inference_mode():
+            embeddings = self._model(features)['sentence_embedding']
+            embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
+        return embeddings.cpu().numpy().astype(np.float32)
+
+
+class ONNXBackend(LocalBackend):
+    """
+    A transformer exported to ONNX (e.g. with `optimum-cli export onnx`), run with
+    onnxruntime (optional dependency). `model` is the export directory holding
+    model.onnx and tokenizer.json; token vectors are mean-pooled over the attention mask.
+    """
+    name = 'onnx'
+
+    def __init__(self, model, **kwargs):
+        import onnxruntime
+        from tokenizers import Tokenizer
+        super().__init__(model, **kwargs)
+        self._tokenizer = Tokenizer.from_file(os.path.join(model, 'tokenizer.json'))
+        self._tokenizer.enable_truncation(self.max_length)
+        self._tokenizer.no_padding()  # Padding happens per batch in pad_batch
+        self.pad_id = self._tokenizer.token_to_id('[PAD]') or 0
+
+        # Split the cores between the pool's workers instead of oversubscribing them
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = max(1, (os.cpu_count() or 1) // self.max_workers)
+        self._session = onnxruntime.InferenceSession(os.path.join(model, 'model.onnx'), options,
+                                                     providers=['CPUExecutionProvider'])
+        self._inputs = {i.name for i in self._session.get_inputs()}
+        self._model_hash = file_digest(os.path.join(model, 'model.onnx'))
+
+    @property
+    def model_id(self):
+        # Keyed on the weights, since different exports often share a directory name
+        return f"{self.name}:{os.path.basename(os.path.normpath(self.model))}:{self._model_hash[:16]}"
+
+    def tokenize(self, texts):
+        return [encoding.ids for encoding in self._tokenizer.encode_batch(texts)]
+
+    def encode_batch(self, input_ids, attention_mask):
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self._inputs:
+            feeds['token_type_ids'] = np.zeros_like(input_ids)
+        token_embeddings = self._session.run(None, feeds)[0]
+        return mean_pool(token_embeddings, attention_mask).astype(np.float32)
+
+
+def get_embedding_backend(name='openai', model=None, **kwargs):
+    """
+    Build an embedding backend by name; local backends import their runtime only here.
+    """
+    if name == 'openai':
+        return OpenAIBackend(model, **kwargs)
+    if name == 'sentence-transformers':
+        return SentenceTransformersBackend(model or LOCAL_MODEL, **kwargs)
+    if name == 'onnx':
+        if model is None:
+            raise ValueError("The onnx backend needs the directory of an exported model")
+        return ONNXBackend(model, **kwargs)
+    raise ValueError(f"Unknown embedding backend: {name}. Choose from {', '.join(EMBEDDING_BACKENDS)}")
+
+
+def backend_info(backend, dim):
+    # What gets recorded next to an embedding store, so later papers and queries match it
+    return {'backend': backend.name, 'model': backend.model, 'dim': int(dim)}
+
+
+def backend_for_store(store, **kwargs):
+    """
+    The backend that produced an embedding store (stores without info came from OpenAI).
+    """
+    info = store.info
+    return get_embedding_backend(info.get('backend', 'openai'), info.get('model'), **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', dest='backend', default='sentence-transformers', choices=EMBEDDING_BACKENDS, help='embedding backend')
+    parser.add_argument('--model', dest='model', default=None, type=str, help='model name, or the export directory for onnx')
+    parser.add_argument('--text', dest='texts', nargs='+', default=['Dark matter halos of dwarf galaxies'], help='texts to embed')
+    args = parser.parse_args()
+
+    backend = get_embedding_backend(args.backend, args.model)
+    for text, vector in zip(args.texts, backend.embed(args.texts)):
+        print(f"{backend.model_id} [{len(vector)}]: {text[:60]}")
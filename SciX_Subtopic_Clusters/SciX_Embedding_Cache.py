@@ -0,0 +1,75 @@
+import os
+import time
+import hashlib
+import unicodedata
+import argparse
+import numpy as np
+
+from SciX_SQLite_Cache import SQLiteLRUCache
+
+EMBEDDING_CACHE_FILE = '.embedding_cache.sqlite'
+DEFAULT_MAX_ENTRIES = 500000
+
+
+def normalize_text(text):
+    # Whitespace and unicode differences should not produce separate cache entries
+    return " ".join(unicodedata.normalize('NFC', text).split())
+
+
+def make_cache_key(model, text):
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache(SQLiteLRUCache):
+    """
+    Content-addressed on-disk embedding cache shared by every query under one output
+    directory. Entries are keyed by sha256(model, normalized text), stored as float32
+    blobs, and the least recently used ones are evicted past `max_entries`.
+    """
+
+    TABLE = 'embeddings'
+    COLUMNS = 'model TEXT NOT NULL, vector BLOB NOT NULL'
+    INDEX = 'idx_last_used'
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        super().__init__(path, max_entries)
+
+    def get_many(self, model, texts):
+        """
+        Return a list aligned with `texts` holding cached float32 vectors or None.
+        """
+        keys = [make_cache_key(model, text) for text in texts]
+        with self._lock:
+            found = dict(self._select('key, vector', keys))
+            if found:
+                self._touch(found, time.time())
+
+        vectors = [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+        n_hits = sum(v is not None for v in vectors)
+        self.hits += n_hits
+        self.misses += len(vectors) - n_hits
+        return vectors
+
+    def put_many(self, model, texts, vectors):
+        now = time.time()
+        self._insert([(make_cache_key(model, text), model, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                      for text, vector in zip(texts, vectors) if vector is not None])
+
+
+def open_embedding_cache(output_dir, max_entries=DEFAULT_MAX_ENTRIES):
+    # One cache per data directory, so overlapping queries share their embeddings
+    return EmbeddingCache(os.path.join(output_dir, EMBEDDING_CACHE_FILE), max_entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output_dir', dest='output_dir', default='Data', type=str, help='data directory holding the cache')
+    parser.add_argument('--max_entries', dest='max_entries', default=None, type=int, help='evict down to this many entries')
+    args = parser.parse_args()
+
+    cache = open_embedding_cache(args.output_dir)
+    if args.max_entries is not None:
+        cache.max_entries = args.max_entries
+        print(f"Evicted {cache.evict()} entries")
+    print(cache.stats())
+    cache.close()
@@ -0,0 +1,158 @@
+import os
+import json
+import pickle
+import argparse
+from itertools import islice
+import numpy as np
+
+
+def embedding_store_paths(query, output_dir):
+    base = os.path.join(output_dir, query, f'{query}_embeddings')
+    return f'{base}.npy', f'{base}_meta.jsonl'
+
+
+def embedding_info_path(query, output_dir):
+    return os.path.join(output_dir, query, f'{query}_embeddings_info.json')
+
+
+def embedding_store_exists(query, output_dir):
+    return all(os.path.exists(path) for path in embedding_store_paths(query, output_dir))
+
+
+class EmbeddingStore:
+    """
+    Columnar embedding store: a contiguous float32 matrix memory-mapped from
+    `{query}_embeddings.npy` plus `{query}_embeddings_meta.jsonl` holding the
+    title/abstract/link of each row, aligned by row index. `{query}_embeddings_info.json`
+    records which embedding backend and model produced the vectors.
+
+    Indexing or iterating yields the legacy (title, abstract, link, vector) tuples;
+    slicing gives a list of them.
+    """
+
+    def __init__(self, vectors_path, metadata_path):
+        self.vectors_path = vectors_path
+        self.metadata_path = metadata_path
+        self.vectors = np.load(vectors_path, mmap_mode='r')
+        self._metadata = None
+        self._info = None
+
+    @property
+    def info(self):
+        # Empty for stores written before backends were recorded (those are OpenAI vectors)
+        if self._info is None:
+            info_path = self.metadata_path.replace('_meta.jsonl', '_info.json')
+            self._info = {}
+            if os.path.exists(info_path):
+                with open(info_path, 'r') as f:
+                    self._info = json.load(f)
+        return self._info
+
+    def load_metadata(self, limit=None):
+        # Only parse as many metadata rows as the caller needs
+        if self._metadata is not None:
+            return self._metadata[:limit]
+        with open(self.metadata_path, 'r') as f:
+            rows = [json.loads(line) for line in islice(f, limit)]
+        if limit is None or len(rows) == len(self.vectors):
+            self._metadata = rows
+        return rows
+
+    @property
+    def metadata(self):
+        return self.load_metadata()
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            # A list of tuples, as slicing the legacy list did; only the rows needed are parsed
+            start, stop, step = i.indices(len(self))
+            metadata = self.load_metadata(limit=stop if step > 0 else None)
+            return [(metadata[j]['title'], metadata[j]['abstract'], metadata[j].get('link', ''), self.vectors[j])
+                    for j in range(start, stop, step)]
+        meta = self.metadata[i]
+        return (meta['title'], meta['abstract'], meta.get('link', ''), self.vectors[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def save_embedding_store(metadata, vectors, query, output_dir, info=None):
+    """
+    Write the float32 matrix and row-aligned metadata, each via a temp file and an
+    atomic rename, and return the opened store. `info` describes the embedding backend.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if len(metadata) != len(vectors):
+        raise ValueError(f"metadata has {len(metadata)} rows but vectors has {len(vectors)}")
+
+    vectors_path, metadata_path = embedding_store_paths(query, output_dir)
+    os.makedirs(os.path.dirname(vectors_path), exist_ok=True)
+
+    with open(f'{vectors_path}.tmp', 'wb') as f:
+        np.save(f, vectors)
+    with open(f'{metadata_path}.tmp', 'w') as f:
+        for meta in metadata:
+            json.dump({'title': meta['title'], 'abstract': meta['abstract'], 'link': meta.get('link', '')}, f)
+            f.write('\n')
+    os.replace(f'{vectors_path}.tmp', vectors_path)
+    os.replace(f'{metadata_path}.tmp', metadata_path)
+    info_path = embedding_info_path(query, output_dir)
+    if info is not None:
+        with open(info_path, 'w') as f:
+            json.dump(info, f, indent=4)
+    elif os.path.exists(info_path):
+        os.remove(info_path)  # It described the vectors just replaced
+
+    return EmbeddingStore(vectors_path, metadata_path)
+
+
+def append_to_embedding_store(metadata, vectors, query, output_dir):
+    """
+    Add rows after the existing ones (row indices of earlier papers do not change)
+    and return the reopened store.
+    """
+    store = load_embedding_store(query, output_dir)
+    return save_embedding_store(store.metadata + list(metadata),
+                                np.vstack([store.vectors, np.asarray(vectors, dtype=np.float32)]),
+                                query, output_dir, store.info or None)
+
+
+def load_embedding_store(query, output_dir):
+    return EmbeddingStore(*embedding_store_paths(query, output_dir))
+
+
+def migrate_pickle_to_store(query, output_dir, remove_pickle=False):
+    """
+    Convert a legacy `{query}_embeddings.pkl` list of (title, abstract, link, vector)
+    tuples into the columnar store.
+    """
+    pickle_path = os.path.join(output_dir, query, f'{query}_embeddings.pkl')
+    with open(pickle_path, 'rb') as f:
+        tuples = pickle.load(f)
+
+    metadata = [{'title': t[0], 'abstract': t[1], 'link': t[2]} for t in tuples]
+    vectors = np.array([t[3] for t in tuples], dtype=np.float32)
+    store = save_embedding_store(metadata, vectors, query, output_dir)
+
+    if remove_pickle:
+        os.remove(pickle_path)
+    print(f"Migrated {len(store)} embeddings for '{query}' to {store.vectors_path}")
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--query', dest='query', type=str, default=None, help='query to migrate (default: every query in output_dir)')
+    parser.add_argument('--output_dir', dest='output_dir', type=str, default='Data', help='data directory')
+    parser.add_argument('--remove_pickle', dest='remove_pickle', action='store_true', help='delete the .pkl after a successful migration')
+    args = parser.parse_args()
+
+    queries = [args.query] if args.query else sorted(
+        d for d in os.listdir(args.output_dir) if not d.startswith('.'))
+    for query in queries:
+        if os.path.exists(os.path.join(args.output_dir, query, f'{query}_embeddings.pkl')):
+            migrate_pickle_to_store(query, args.output_dir, args.remove_pickle)
@@ -0,0 +1,253 @@
+import os
+import json
+import argparse
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+
+from SciX_SearchPapers import ADS_API_URL, fetch_papers_from_ads
+from SciX_Navigator_utils import load_embeddings
+from SciX_Dedup import PaperDeduplicator, deduplicate_papers
+from SciX_Paper_Embeddings import format_paper_for_embedding
+from SciX_Embedding_Backends import backend_for_store
+from SciX_Embedding_Cache import open_embedding_cache
+from SciX_Embedding_Store import append_to_embedding_store
+from SciX_Cluster_Store import load_cluster_output, save_cluster_output, load_named_clusters, save_named_clusters
+from SciX_Vector_Index import build_vector_index, load_vector_index
+from SciX_cluster_subtopic import assign_new_papers, cluster_model_path
+from SciX_subtopic_aspect_generation import generate_subtopic_aspects, FAILED
+from SciX_outline_creation import get_outline_for_subtopics
+from SciX_Response_Cache import open_response_cache
+from SciX_Pipeline import record_external_update
+
+DEFAULT_RENAME_THRESHOLD = 0.2  # Re-name a cluster once it has grown by at least this fraction
+
+
+def manifest_path(query, output_dir):
+    return f"{output_dir}/{query}/{query}_manifest.jsonl"
+
+
+def pending_papers_path(query, output_dir):
+    return f"{output_dir}/{query}/{query}_pending.jsonl"
+
+
+def load_pending_papers(query, output_dir):
+    # Papers fetched by an earlier update that could not be embedded yet
+    path = pending_papers_path(query, output_dir)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_pending_papers(papers, query, output_dir):
+    path = pending_papers_path(query, output_dir)
+    if not papers:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(f'{path}.tmp', 'w') as f:
+        for paper in papers:
+            json.dump(paper, f)
+            f.write('\n')
+    os.replace(f'{path}.tmp', path)
+
+
+def last_run_date(query, output_dir):
+    """
+    Date (YYYY-MM-DD) of the last incremental update, or of the original fetch if
+    there has not been one yet.
+    """
+    path = manifest_path(query, output_dir)
+    if os.path.exists(path):
+        with open(path) as f:
+            lines = [line for line in f if line.strip()]
+        if lines:
+            return json.loads(lines[-1])['run_at'][:10]
+    mtime = os.path.getmtime(f"{output_dir}/{query}/{query}.jsonl")
+    return datetime.fromtimestamp(mtime, timezone.utc).strftime('%Y-%m-%d')
+
+
+def _subtopic_label(subtopic):
+    return subtopic['Subtopic'] if isinstance(subtopic, dict) else subtopic
+
+
+def update_query(query, output_dir, since=None, max_results=1000, rename_threshold=DEFAULT_RENAME_THRESHOLD,
+                 client=None, chat_client=None, api_url=ADS_API_URL, max_workers=4, near_duplicates=False):
+    """
+    Add papers published since the last run to an existing query without recomputing it:
+    fetch only papers entered after `since`, embed only those that are new, assign them
+    to the existing clusters with the saved model, re-name only clusters that grew by at
+    least `rename_threshold`, and regenerate the outline only if a cluster was renamed
+    or created. Every run appends a record of what changed to `{query}_manifest.jsonl`.
+    """
+    query_dir = f"{output_dir}/{query}"
+    cluster_path = f"{query_dir}/{query}_cluster.json"
+    named_path = f"{query_dir}/{query}_clusters_with_subtopics.json"
+    outline_path = f"{query_dir}/{query}_outline.json"
+    model_path = cluster_model_path(query, output_dir)
+    for path in (f"{query_dir}/{query}.jsonl", cluster_path, model_path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found; run the full pipeline for '{query}' first")
+
+    since = since or last_run_date(query, output_dir)
+    manifest = {'run_at': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'since': since}
+
+    # 1. Fetch papers entered since the last run; the date range overlaps by a day, dedup handles that.
+    # Papers an earlier run could not embed are tried again first
+    pending = load_pending_papers(query, output_dir)
+    fetched = pending + fetch_papers_from_ads(f"({query}) AND entdate:[{since} TO *]", max_results,
+                                              max_workers=max_workers, api_url=api_url)
+
+    store = load_embeddings(query, output_dir)
+    dedup = PaperDeduplicator(near_duplicates=near_duplicates)
+    for meta in store.load_metadata():
+        dedup.check(meta['title'], meta['abstract'])
+    dedup.kept = 0
+    dedup.dropped.clear()
+    new_papers, dedup_report = deduplicate_papers(fetched, dedup=dedup)
+    manifest.update({'fetched': len(fetched) - len(pending), 'pending': len(pending),
+                     'duplicates': dedup_report['dropped']})
+    print(f"Fetched {len(fetched) - len(pending)} papers since {since} (+{len(pending)} pending), "
+          f"{len(new_papers)} are new")
+
+    if not new_papers:
+        save_pending_papers([], query, output_dir)
+        manifest.update({'added': 0, 'clusters': {}, 'renamed': {}, 'outline_regenerated': False})
+        _append_manifest(manifest, query, output_dir)
+        return manifest
+
+    # Nothing is written until the papers are embedded and assigned, so a failure before
+    # step 4 leaves every file as it was and the next run fetches the same papers again
+
+    # 2. Embed only the new papers, with the backend that built the store
+    backend_options = {'client': client} if store.info.get('backend', 'openai') == 'openai' else {}
+    backend = backend_for_store(store, max_workers=max_workers, **backend_options)
+    cache = open_embedding_cache(output_dir)
+    try:
+        embeddings = backend.embed([format_paper_for_embedding(p) for p in new_papers], cache)
+    finally:
+        cache.close()
+    embedded = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+    failed = [paper for paper, embedding in zip(new_papers, embeddings) if embedding is None]
+    manifest['embedding_failures'] = len(failed)
+    new_papers = [new_papers[i] for i in embedded]
+    new_vectors = np.vstack([embeddings[i] for i in embedded]) if embedded else np.empty((0, 0), np.float32)
+    first_row = len(store)
+
+    # 3. Assign them to the existing clusters without refitting
+    model_bundle = joblib.load(model_path)
+    cluster_output = load_cluster_output(cluster_path, query, output_dir)
+    assignments = []
+    if new_papers:
+        if hasattr(model_bundle['model'], 'predict'):
+            assignments = assign_new_papers(model_bundle, new_vectors)
+        else:
+            # HDBSCAN, graph and hierarchical models cannot predict; use the nearest cluster centroid
+            nearest = load_vector_index(query, output_dir).nearest_clusters(new_vectors, k=1)
+            assignments = [np.array([int(clusters[0][0])]) for clusters in nearest]
+        model_bundle['row_indices'] = model_bundle['row_indices'] + list(range(first_row, first_row + len(new_papers)))
+
+    previous_sizes = {cluster_id: len(papers) for cluster_id, papers in cluster_output.items()}
+    added = {}
+    for row, (paper, cluster_ids) in enumerate(zip(new_papers, assignments), start=first_row):
+        record = {'title': paper['title'], 'abstract': paper['abstract'], 'link': paper.get('link', ''), 'row': row}
+        for cluster_id in map(str, cluster_ids):
+            cluster_output.setdefault(cluster_id, []).append(record)
+            added[cluster_id] = added.get(cluster_id, 0) + 1
+
+    # 4. Write the papers, their vectors, the model's rows and the clusters together.
+    # Papers that could not be embedded wait in the pending file for the next run
+    if new_papers:
+        with open(f"{query_dir}/{query}.jsonl", 'a') as f:
+            for paper in new_papers:
+                json.dump(paper, f)
+                f.write('\n')
+        store = append_to_embedding_store(new_papers, new_vectors, query, output_dir)
+        joblib.dump(model_bundle, model_path)
+        save_cluster_output(cluster_output, cluster_path, query, output_dir)
+        build_vector_index(query, output_dir)
+        # Otherwise the next pipeline run sees changed inputs and recomputes the query from scratch
+        record_external_update(query, output_dir, through='cluster')
+    save_pending_papers(failed, query, output_dir)
+
+    manifest['added'] = len(new_papers)
+    manifest['unassigned'] = sum(1 for cluster_ids in assignments if len(cluster_ids) == 0)
+    manifest['clusters'] = {cluster_id: {'before': previous_sizes.get(cluster_id, 0), 'added': n}
+                            for cluster_id, n in added.items()}
+
+    # 5. Re-name only the clusters that changed enough; the rest keep their subtopic. The
+    # manifest is written even if this fails, since the papers above are already added
+    manifest['renamed'] = {}
+    manifest['outline_regenerated'] = False
+    try:
+        if os.path.exists(named_path):
+            _rename_clusters(named_path, outline_path, cluster_output, previous_sizes, added, manifest, query,
+                             output_dir, rename_threshold, chat_client)
+        if new_papers:
+            record_external_update(query, output_dir)
+    finally:
+        _append_manifest(manifest, query, output_dir)
+    print(f"Added {manifest['added']} papers to {len(added)} clusters, re-named {len(manifest['renamed'])}")
+    return manifest
+
+
+def _rename_clusters(named_path, outline_path, cluster_output, previous_sizes, added, manifest, query, output_dir,
+                     rename_threshold, chat_client):
+    named = load_named_clusters(named_path, query, output_dir)
+
+    to_rename = {}
+    for cluster_id, n in added.items():
+        before = previous_sizes.get(cluster_id, 0)
+        if cluster_id not in named or not before or n / before >= rename_threshold:
+            # The representatives picked at clustering time predate the new papers
+            to_rename[cluster_id] = [{k: v for k, v in paper.items() if k != 'representative'}
+                                     for paper in cluster_output[cluster_id]]
+        else:
+            named[cluster_id] = [named[cluster_id][0], cluster_output[cluster_id]]
+    # Clusters an earlier run could not name are asked again whether or not they grew
+    for cluster_id, (subtopic, _) in named.items():
+        if subtopic == FAILED and cluster_id not in to_rename:
+            to_rename[cluster_id] = list(cluster_output[cluster_id])
+
+    if to_rename:
+        print(f"Re-naming {len(to_rename)} of {len(cluster_output)} clusters")
+        response_cache = open_response_cache(output_dir)
+        try:
+            renamed = generate_subtopic_aspects(to_rename, query, openai_client=chat_client,
+                                                response_cache=response_cache)
+        finally:
+            response_cache.close()
+        for cluster_id, (subtopic, papers) in renamed.items():
+            before = _subtopic_label(named[cluster_id][0]) if cluster_id in named else None
+            manifest['renamed'][cluster_id] = {'before': before, 'after': _subtopic_label(subtopic)}
+            named[cluster_id] = [subtopic, papers]
+
+    save_named_clusters(named, named_path, query, output_dir)
+
+    # 6. The outline only refers to subtopic names, so it is stale only if one changed
+    changed = any(r['before'] != r['after'] for r in manifest['renamed'].values())
+    if changed and os.path.exists(outline_path):
+        os.remove(outline_path)
+        manifest['outline_regenerated'] = get_outline_for_subtopics(named, query, output_dir) is not None
+
+
+def _append_manifest(manifest, query, output_dir):
+    with open(manifest_path(query, output_dir), 'a') as f:
+        json.dump(manifest, f)
+        f.write('\n')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--query', dest='query', type=str, help='query to update')
+    parser.add_argument('--output_dir', dest='output_dir', default='Data', type=str, help='data directory')
+    parser.add_argument('--since', dest='since', default=None, type=str, help='fetch papers entered on or after this date (YYYY-MM-DD); default: the last run')
+    parser.add_argument('--max_results', dest='max_results', default=1000, type=int, help='maximum number of papers to fetch')
+    parser.add_argument('--rename_threshold', dest='rename_threshold', default=DEFAULT_RENAME_THRESHOLD, type=float, help='re-name clusters that grew by at least this fraction')
+    parser.add_argument('--near_duplicates', dest='near_duplicates', action='store_true', help='also drop near-duplicate papers')
+    args = parser.parse_args()
+
+    update_query(args.query, args.output_dir, args.since, args.max_results, args.rename_threshold,
+                 near_duplicates=args.near_duplicates)
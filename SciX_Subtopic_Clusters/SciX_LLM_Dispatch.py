@@ -0,0 +1,206 @@
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from SciX_Navigator_utils import count_tokens
+from SciX_Metrics import metrics
+
+OPENAI_API_KEY = 'YOUR-API-KEY'
+client = None  # The OpenAI chat client shared by the naming and outline stages
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # Created on first use so importing the LLM modules stays fast; the lock keeps
+    # concurrently running queries from each building one
+    global client
+    with _client_lock:
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(api_key=OPENAI_API_KEY)
+    return client
+
+
+def retryable_errors():
+    # openai is imported on first use so that importing this module stays fast
+    import openai
+    return (openai.RateLimitError, openai.APITimeoutError,
+            openai.APIConnectionError, openai.InternalServerError)
+
+
+class RateLimiter:
+    """
+    Thread-safe requests-per-minute / tokens-per-minute budget. Both buckets refill
+    continuously; acquire() blocks until the request and its tokens fit.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens=0):
+        if self.tokens_per_minute:
+            # A single oversized request may use the whole budget rather than wait forever
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill()
+                requests_ok = not self.requests_per_minute or self._requests >= 1
+                tokens_ok = not self.tokens_per_minute or self._tokens >= tokens
+                if requests_ok and tokens_ok:
+                    if self.requests_per_minute:
+                        self._requests -= 1
+                    if self.tokens_per_minute:
+                        self._tokens -= tokens
+                    return
+                wait = 0.0
+                if not requests_ok:
+                    wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+                if not tokens_ok:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+            time.sleep(wait)
+
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _record_usage(usage):
+    if usage is not None:
+        metrics.increment('llm.prompt_tokens', usage.prompt_tokens)
+        metrics.increment('llm.completion_tokens', usage.completion_tokens)
+
+
+def _stream_completion(client, model, messages, validator, options):
+    # Feed the answer to the validator as it arrives; a SchemaError it raises closes the
+    # stream, so the rest of a bad answer is neither waited for nor read
+    start = time.perf_counter()
+    stream = client.chat.completions.create(model=model, messages=messages, stream=True,
+                                            stream_options={'include_usage': True}, **options)
+    parts = []
+    try:
+        for chunk in stream:
+            _record_usage(getattr(chunk, 'usage', None))
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if not parts:
+                metrics.record('llm.first_token', time.perf_counter() - start)
+            parts.append(chunk.choices[0].delta.content)
+            validator.feed(parts[-1])
+    except Exception:
+        metrics.increment('llm.aborted_streams')
+        raise
+    finally:
+        stream.close()
+    return ''.join(parts)
+
+
+def chat_completion(client, model, messages, limiter=None, max_retries=5, backoff=1.0,
+                    expected_completion_tokens=500, cache=None, cacheable=None, response_format=None,
+                    validator=None):
+    """
+    One chat completion under the rate limiter, retried on rate limits and transient
+    errors with full-jitter exponential backoff. Returns the message content.
+
+    With a ResponseCache, a cached answer is returned without calling the API, and a
+    fresh answer is stored if `cacheable(content)` accepts it (default: always).
+
+    With a `validator` (see SciX_Structured_Output) the answer is streamed into
+    validator.feed(); whatever that raises ends the call. `response_format` is passed
+    to the API, e.g. {"type": "json_object"} for JSON mode.
+    """
+    options = {'response_format': response_format} if response_format is not None else {}
+    if cache is not None:
+        cached = cache.get(model, messages)
+        if cached is not None:
+            metrics.increment('response_cache.hits')
+            if validator is not None:
+                validator.feed(cached)
+            return cached
+        metrics.increment('response_cache.misses')
+
+    prompt_tokens = sum(count_tokens(m['content'], model) for m in messages)
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire(prompt_tokens + expected_completion_tokens)
+        try:
+            with metrics.timer('llm.call'):
+                if validator is not None:
+                    validator.reset()
+                    content = _stream_completion(client, model, messages, validator, options)
+                else:
+                    response = client.chat.completions.create(model=model, messages=messages, **options)
+                    content = response.choices[0].message.content
+                    _record_usage(getattr(response, 'usage', None))
+            if cache is not None and (cacheable is None or cacheable(content)):
+                cache.put(model, messages, content)
+            return content
+        except retryable_errors() as e:
+            if attempt == max_retries:
+                raise
+            # Jitter spreads out workers that were throttled at the same moment
+            wait = (_retry_after(e) or 0) + random.uniform(0, backoff * 2 ** attempt)
+            metrics.increment('llm.retries')
+            print(f"Chat completion failed ({type(e).__name__}), retrying in {wait:.1f}s "
+                  f"(attempt {attempt + 1}/{max_retries})")
+            time.sleep(wait)
+
+
+def dispatch_chat_requests(client, model, message_lists, max_concurrency=8, requests_per_minute=None,
+                           tokens_per_minute=None, on_complete=None, max_retries=5, cache=None,
+                           cacheable=None):
+    """
+    Run many chat completions concurrently under a concurrency limit and RPM/TPM budget.
+
+    Returns a list aligned with `message_lists`; each item is the response content or
+    the exception that request finally failed with. `on_complete(done, total)` is
+    called from the caller's thread as each request finishes.
+    """
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    def request(messages):
+        return chat_completion(client, model, messages, limiter, max_retries, cache=cache, cacheable=cacheable)
+
+    return run_concurrently(request, message_lists, max_concurrency, on_complete)
+
+
+def run_concurrently(request, items, max_concurrency=8, on_complete=None):
+    """
+    Call `request(item)` for every item on a thread pool. Returns a list aligned with
+    `items` of results or the exceptions raised; `on_complete(done, total)` is called
+    from the caller's thread as each request finishes.
+    """
+    results = [None] * len(items)
+    if not items:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {executor.submit(request, item): i for i, item in enumerate(items)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                results[futures[future]] = e
+            if on_complete is not None:
+                on_complete(done, len(items))
+    return results
@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    Thread-safe run metrics: named timers (count, total, max seconds) and counters
+    (tokens, cache hits, retries, ...). One process-wide instance, `metrics`, is shared
+    by every module; work done in other processes reports back through merge().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.timers = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def record(self, name, seconds):
+        with self._lock:
+            timer = self.timers.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            timer['count'] += 1
+            timer['seconds'] += seconds
+            timer['max_seconds'] = max(timer['max_seconds'], seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def increment(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, snapshot):
+        with self._lock:
+            for name, other in snapshot['timers'].items():
+                timer = self.timers.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+                timer['count'] += other['count']
+                timer['seconds'] += other['seconds']
+                timer['max_seconds'] = max(timer['max_seconds'], other['max_seconds'])
+            for name, n in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            timers = {name: {'count': t['count'], 'seconds': round(t['seconds'], 4),
+                             'max_seconds': round(t['max_seconds'], 4)}
+                      for name, t in sorted(self.timers.items())}
+            counters = dict(sorted(self.counters.items()))
+        return {'wall_seconds': round(time.time() - self.started, 3), 'peak_rss_mb': peak_rss_mb(),
+                'timers': timers, 'counters': counters}
+
+
+metrics = Metrics()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS; children covers process pools
+    scale = 1 / (1024 * 1024) if sys.platform == 'darwin' else 1 / 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {'self': round(own * scale, 1), 'children': round(children * scale, 1)}
+
+
+def write_metrics(path, extra=None):
+    """
+    Write the current snapshot (plus any `extra` fields) as JSON and return it.
+    """
+    report = {**metrics.snapshot(), **(extra or {})}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=4)
+    return report
+
+
+@contextmanager
+def profile(output_path, profiler='cprofile'):
+    """
+    Profile the enclosed block. 'cprofile' writes pstats data (`python -m pstats` or
+    snakeviz can read it); 'pyinstrument' (optional dependency) writes an HTML report.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    if profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+        p = Profiler()
+        p.start()
+        try:
+            yield
+        finally:
+            p.stop()
+            with open(output_path, 'w') as f:
+                f.write(p.output_html())
+    elif profiler == 'cprofile':
+        import cProfile
+        p = cProfile.Profile()
+        p.enable()
+        try:
+            yield
+        finally:
+            p.disable()
+            p.dump_stats(output_path)
+    else:
+        raise ValueError(f"Unknown profiler: {profiler}. Choose 'cprofile' or 'pyinstrument'")
+    print(f"Profile written to {output_path}")
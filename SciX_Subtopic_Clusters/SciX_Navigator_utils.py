@@ -1,6 +1,7 @@
 import os
 import json
-import pickle
+from functools import lru_cache
+from SciX_Embedding_Store import embedding_store_exists, load_embedding_store, migrate_pickle_to_store
 
 
 def check_if_query_exists(query,output_dir):
@@ -11,26 +12,62 @@ def check_if_query_exists(query,output_dir):
         return False
 
 def check_if_embedding_exists(query,output_dir):
-    # Check if the embeddings exist in the output directory
+    # Check if the embeddings exist in the output directory (columnar store or legacy pickle)
+    if embedding_store_exists(query, output_dir):
+        return True
     if os.path.exists(os.path.join(f"{output_dir}/{query}/{query}_embeddings.pkl")):
         return True
     else:
         return False
 
 
-def load_papers(query,output_dir):
-    # Load the papers from the file
-    papers = []
+def load_papers(query,output_dir,lazy=False):
+    # Load the papers from the file; lazy=True returns an iterator instead of a list
+    if lazy:
+        return iter_papers(query, output_dir)
+    return list(iter_papers(query, output_dir))
+
+def iter_papers(query,output_dir):
+    # Yield the papers one at a time so large result sets never sit fully in memory
     with open(os.path.join(f"{output_dir}/{query}/{query}.jsonl"), 'r') as file:
         for line in file:
-            papers.append(json.loads(line))
-    return papers
+            if line.strip():
+                yield json.loads(line)
 
 def load_embeddings(query,output_dir):
-    # Load the embeddings from the file
-    with open(os.path.join(f"{output_dir}/{query}/{query}_embeddings.pkl"), 'rb') as file:
-        embeddings = pickle.load(file)
-    return embeddings
+    # Memory-map the embedding store, migrating a legacy pickle on first use
+    if not embedding_store_exists(query, output_dir):
+        return migrate_pickle_to_store(query, output_dir)
+    return load_embedding_store(query, output_dir)
+
+@lru_cache(maxsize=None)
+def _get_encoding(model):
+    # tiktoken is optional; without it token counts fall back to a ~4 characters/token estimate
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text, model="text-embedding-ada-002"):
+    # Count (or estimate) the number of tokens the model will see for this text
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text, max_tokens, model="text-embedding-ada-002"):
+    # Cut text down to at most max_tokens tokens
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
 
 def get_list_of_dir_names(output_dir):
     for f in os.listdir(output_dir):
@@ -1,122 +1,211 @@
-import json
-import os
-import pickle
-# from openai import OpenAI
-import openai
-from openai import OpenAI
-import streamlit as st
+import time
+import random
 import argparse
-from SciX_Navigator_utils import load_papers
+from concurrent.futures import ThreadPoolExecutor
+from SciX_Navigator_utils import load_papers, count_tokens, truncate_to_tokens
+from SciX_Embedding_Cache import open_embedding_cache
+from SciX_Dedup import deduplicate_papers
+from SciX_Embedding_Store import save_embedding_store
+from SciX_Embedding_Backends import EMBEDDING_BACKENDS, OpenAIBackend, get_embedding_backend, backend_info
+from SciX_Progress import report
+from SciX_Metrics import metrics
+from SciX_LLM_Dispatch import retryable_errors
 import numpy as np
 
-openai.api_key = 'YOUR-API-KEY'
-
-def is_title_already_in_data(doc, data):
-    title = doc.get('title')
-    
-    # Convert title from list to string if needed
-    if isinstance(title, list):
-        title = " ".join(title)
-    
-    if not isinstance(title, str):
-        print(f"Skipping document with invalid or missing title: {title}")
-        return False
-
-    title = title.lower().strip()
-
-    for d in data:
-        existing_title = d.get('title')
-        if isinstance(existing_title, list):
-            existing_title = " ".join(existing_title)
-        if isinstance(existing_title, str) and title == existing_title.lower().strip():
-            return False
-
-    return True
-
-def embed_and_save_papers_with_openai(papers, query, output_dir):
-    data = []
-
-    # Ensure papers is a list
-    if not isinstance(papers, list):
-        print(f"Error: 'papers' is not a list. Type: {type(papers)}")
+OPENAI_API_KEY = 'YOUR-API-KEY'
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+MAX_INPUT_TOKENS = 8191  # Per-input limit of the embedding model
+MAX_BATCH_TOKENS = 100000  # Token budget for one embeddings request
+MAX_BATCH_ITEMS = 2048  # Maximum number of inputs per embeddings request
+
+
+def default_client():
+    # The openai module's own client, imported on first use so that importing this module stays fast
+    import openai
+    if openai.api_key is None:
+        openai.api_key = OPENAI_API_KEY
+    return openai
+
+
+def pack_embedding_batches(texts, max_batch_tokens=MAX_BATCH_TOKENS, max_batch_items=MAX_BATCH_ITEMS,
+                           model=EMBEDDING_MODEL):
+    """
+    Greedily pack text indices into batches that stay under the token and item budgets.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        n_tokens = count_tokens(text, model)
+        if current and (current_tokens + n_tokens > max_batch_tokens or len(current) >= max_batch_items):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += n_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def embed_batch(texts, model=EMBEDDING_MODEL, client=None, max_retries=6, backoff=1.0):
+    """
+    Embed one batch, retrying rate limits and transient errors with jittered backoff.
+    A rejected batch is split in half so one bad input only loses itself (returned as None).
+    """
+    import openai
+    client = client or default_client()
+    for attempt in range(max_retries + 1):
+        try:
+            with metrics.timer('embed.batch'):
+                response = client.embeddings.create(input=texts, model=model)
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                metrics.increment('embed.tokens', usage.total_tokens)
+            metrics.increment('embed.texts', len(texts))
+            return [np.asarray(item.embedding, dtype=np.float32) for item in sorted(response.data, key=lambda d: d.index)]
+        except retryable_errors() as e:
+            if attempt == max_retries:
+                print(f"Giving up on a batch of {len(texts)} texts after {max_retries} retries: {e}")
+                return [None] * len(texts)
+            wait = backoff * 2 ** attempt + random.uniform(0, backoff)
+            metrics.increment('embed.retries')
+            print(f"Embedding batch of {len(texts)} texts failed ({type(e).__name__}), retrying in {wait:.1f}s")
+            time.sleep(wait)
+        except openai.BadRequestError as e:
+            if len(texts) == 1:
+                print(f"Skipping text rejected by the embedding API: {e}")
+                return [None]
+            middle = len(texts) // 2
+            return (embed_batch(texts[:middle], model, client, max_retries, backoff) +
+                    embed_batch(texts[middle:], model, client, max_retries, backoff))
+
+
+def embed_texts(texts, model=EMBEDDING_MODEL, client=None, max_workers=4,
+                max_batch_tokens=MAX_BATCH_TOKENS, max_batch_items=MAX_BATCH_ITEMS, cache=None):
+    """
+    Embed texts in token-budgeted batches dispatched concurrently; results keep the
+    input order, with None for any text that could not be embedded. With a cache,
+    only the cache misses are sent to the API.
+    """
+    if cache is not None:
+        embeddings = cache.get_many(model, texts)
+    else:
+        embeddings = [None] * len(texts)
+    missing = [i for i, vector in enumerate(embeddings) if vector is None]
+    if cache is not None:
+        metrics.increment('embed_cache.hits', len(texts) - len(missing))
+        metrics.increment('embed_cache.misses', len(missing))
+    if not missing:
+        return embeddings
+
+    to_embed = [truncate_to_tokens(texts[i], MAX_INPUT_TOKENS, model) for i in missing]
+    batches = pack_embedding_batches(to_embed, max_batch_tokens, max_batch_items, model)
+
+    def run(batch):
+        return embed_batch([to_embed[i] for i in batch], model, client)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch, vectors in zip(batches, executor.map(run, batches)):
+            for i, vector in zip(batch, vectors):
+                embeddings[missing[i]] = vector
+            if cache is not None:
+                cache.put_many(model, [texts[missing[i]] for i in batch], vectors)
+    return embeddings
+
+
+def format_paper_for_embedding(paper):
+    return f"Title: {paper['title'].strip()} ; Abstract: {paper['abstract'].strip()}"
+
+def embed_and_save_papers_with_openai(papers, query, output_dir, client=None, model=EMBEDDING_MODEL,
+                                      max_workers=4, max_batch_tokens=MAX_BATCH_TOKENS,
+                                      max_batch_items=MAX_BATCH_ITEMS, use_cache=True, near_duplicates=False,
+                                      backend=None):
+    # `backend` (see SciX_Embedding_Backends) replaces the OpenAI API, e.g. with a local model
+    if backend is None:
+        backend = OpenAIBackend(model, client, max_workers, max_batch_tokens=max_batch_tokens,
+                                max_batch_items=max_batch_items)
+
+    # Ensure papers is a list or a lazy iterator such as load_papers(..., lazy=True)
+    if isinstance(papers, (str, bytes, dict)) or not hasattr(papers, '__iter__'):
+        print(f"Error: 'papers' is not an iterable of papers. Type: {type(papers)}")
         return
 
-    # Loop through papers and check their structure
-    for idx, paper in enumerate(papers):
-        if not isinstance(paper, dict):
-            print(f"Skipping non-dict paper at index {idx}: {paper}")
-            continue
+    # Drop invalid records and duplicate titles (optionally near duplicates) in one pass
+    data, dedup_report = deduplicate_papers(papers, near_duplicates=near_duplicates)
+    if dedup_report['dropped']:
+        print(f"Dropped {dedup_report['dropped']} papers: {dedup_report['reasons']}")
 
-        title = paper.get('title')
-        abstract = paper.get('abstract')
-
-        # Convert title from list to string if needed
-        if isinstance(title, list):
-            title = " ".join(title)
-            paper['title'] = title
-
-        if not isinstance(title, str) or not isinstance(abstract, str):
-            print(f"Skipping paper at index {idx} due to invalid title or abstract. Title: {title}, Abstract: {abstract}")
-            continue
-
-        if is_title_already_in_data(paper, data):
-            data.append(paper)
-
-    st.write(f"Found {len(data)} valid papers about {query} for embedding")
+    report(f"Found {len(data)} valid papers about {query} for embedding")
 
     if not data:
         print("No valid papers found for embedding.")
         return
 
-    data_for_embedding = [f"Title: {d['title'].strip()} ; Abstract: {d['abstract'].strip()}" for d in data]
+    data_for_embedding = [format_paper_for_embedding(d) for d in data]
 
-    try:
-        # Use the new embeddings method in v1.0.0+
-        response = openai.embeddings.create(
-            input=data_for_embedding,
-            model="text-embedding-ada-002"  # Adjust model as needed
-        )
+    cache = open_embedding_cache(output_dir) if use_cache else None
 
-        # Access response data using dot notation
-        text_embedding_tuplist = [
-            (text['title'], text['abstract'], text.get('link', ''), np.array(embedding.embedding))
-            for text, embedding in zip(data, response.data)
-        ]
+    try:
+        embeddings = backend.embed(data_for_embedding, cache)
+        if cache is not None:
+            stats = cache.stats()
+            report(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses")
 
-        pickle_output_path = os.path.join(output_dir, query, f'{query}_embeddings.pkl')
-        os.makedirs(os.path.dirname(pickle_output_path), exist_ok=True)
+        embedded = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+        if len(embedded) < len(data):
+            print(f"{len(data) - len(embedded)} papers could not be embedded and were dropped")
 
-        with open(pickle_output_path, 'wb') as f:
-            pickle.dump(text_embedding_tuplist, f)
+        store = save_embedding_store([data[i] for i in embedded],
+                                     np.vstack([embeddings[i] for i in embedded]),
+                                     query, output_dir, backend_info(backend, len(embeddings[embedded[0]])))
 
-        st.write(f"Text Embedding Done! Saved to {pickle_output_path}")
-        return text_embedding_tuplist
+        # The vector index is built on its first lookup; it notices the store was rewritten
+        report(f"Text Embedding Done! Saved to {store.vectors_path}")
+        return store
 
     except Exception as e:
         print(f"Error during embedding creation: {e}")
 
+    finally:
+        if cache is not None:
+            cache.close()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--query', dest='query', type=str, help='Query to search')
+    parser.add_argument('--output_dir', dest='output_dir', default='Data', type=str, help='data directory')
+    parser.add_argument('--max_workers', dest='max_workers', default=4, type=int, help='number of concurrent embedding requests')
+    parser.add_argument('--max_batch_tokens', dest='max_batch_tokens', default=MAX_BATCH_TOKENS, type=int, help='token budget per embedding request')
+    parser.add_argument('--max_batch_items', dest='max_batch_items', default=MAX_BATCH_ITEMS, type=int, help='maximum number of papers per embedding request')
+    parser.add_argument('--no_cache', dest='use_cache', action='store_false', help='do not read or write the shared embedding cache')
+    parser.add_argument('--near_duplicates', dest='near_duplicates', action='store_true', help='also drop near-duplicate papers (MinHash over title+abstract)')
+    parser.add_argument('--backend', dest='backend', default='openai', choices=EMBEDDING_BACKENDS, help='embedding backend; sentence-transformers and onnx run on this machine')
+    parser.add_argument('--model', dest='model', default=None, type=str, help='embedding model (for onnx, the exported model directory)')
+    parser.add_argument('--batch_size', dest='batch_size', default=None, type=int, help='texts per batch for local backends')
     args = parser.parse_args()
 
     query = args.query
-    output_dir = 'Data'
+    output_dir = args.output_dir
     
     # Load papers from the specified source
     papers = load_papers(query, output_dir)
     
-    # Debug: Print the number of papers loaded
     print(f"Loaded {len(papers)} papers for the query '{query}'")
-    
-    # Print the structure of the first few papers to understand the issue
-    if papers:
-        print("First few papers loaded:")
-        for i, paper in enumerate(papers[:5]):
-            print(f"Paper {i+1}: {paper}")
 
     # Check if papers were loaded correctly
     if not papers:
         print("No papers found or failed to load papers.")
     else:
-        embed_and_save_papers_with_openai(papers, query, output_dir)
\ No newline at end of file
+        backend = None
+        if args.backend != 'openai':
+            local_options = {'batch_size': args.batch_size} if args.batch_size else {}
+            backend = get_embedding_backend(args.backend, args.model, max_workers=args.max_workers, **local_options)
+        embed_and_save_papers_with_openai(papers, query, output_dir, model=args.model or EMBEDDING_MODEL,
+                                          max_workers=args.max_workers,
+                                          max_batch_tokens=args.max_batch_tokens,
+                                          max_batch_items=args.max_batch_items,
+                                          use_cache=args.use_cache,
+                                          near_duplicates=args.near_duplicates,
+                                          backend=backend)
\ No newline at end of file
@@ -0,0 +1,376 @@
+import os
+import sys
+import json
+import time
+import fnmatch
+import hashlib
+import argparse
+import threading
+import multiprocessing
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from SciX_Navigator_utils import get_list_of_dir_names
+from SciX_Metrics import metrics, write_metrics, profile
+from SciX_Embedding_Store import embedding_store_paths
+from SciX_Cluster_Store import load_cluster_output, load_named_clusters, has_failed_clusters
+from SciX_Embedding_Backends import EMBEDDING_BACKENDS, get_embedding_backend
+
+PIPELINE_STATE_FILE = '.pipeline_state.json'
+BATCH_REPORT_FILE = '.batch_report.json'
+
+
+class Stage:
+    """
+    One step of the pipeline. `run(query, output_dir, params)` must write every path
+    returned by `outputs(query, output_dir)`. CPU-bound stages run in the clustering
+    process pool, or one at a time, so network-bound stages of other queries overlap them.
+    `complete(query, output_dir)`, when given, says whether up-to-date outputs are also
+    finished; if not, the stage runs again on top of them instead of being skipped.
+    """
+
+    def __init__(self, name, run, outputs, deps=(), params=(), cpu_bound=False, complete=None):
+        self.name = name
+        self.run = run
+        self.outputs = outputs
+        self.deps = tuple(deps)
+        self.params = tuple(params)
+        self.cpu_bound = cpu_bound
+        self.complete = complete
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _query_file(suffix):
+    return lambda query, output_dir: [f"{output_dir}/{query}/{query}{suffix}"]
+
+
+# Each stage imports its module when it runs, so a run where everything is up to date
+# never loads openai, umap or sklearn
+def _search(query, output_dir, p):
+    from SciX_SearchPapers import search_papers_in_ads
+    search_papers_in_ads(query, output_dir, p['max_results'], p['max_workers'], p['use_cursor'])
+
+
+def _embed(query, output_dir, p):
+    from SciX_Navigator_utils import load_papers
+    from SciX_Paper_Embeddings import embed_and_save_papers_with_openai
+    backend = get_embedding_backend(p['embedding_backend'], p['embedding_model'], max_workers=p['max_workers'])
+    embed_and_save_papers_with_openai(load_papers(query, output_dir, lazy=True), query, output_dir,
+                                      near_duplicates=p['near_duplicates'], backend=backend)
+
+
+def _cluster(query, output_dir, p):
+    from SciX_Navigator_utils import load_embeddings
+    from SciX_cluster_subtopic import run_cluster_subtopics
+    run_cluster_subtopics(load_embeddings(query, output_dir), query, output_dir, n_jobs=p['n_jobs'],
+                          top_k=p['top_k'], cluster_method=p['cluster_method'], n_clusters=p['n_clusters'])
+
+
+def _name(query, output_dir, p):
+    from SciX_subtopic_aspect_generation import name_the_clusters
+    name_the_clusters(load_cluster_output(f"{output_dir}/{query}/{query}_cluster.json", query, output_dir),
+                      query, output_dir)
+
+
+def _outline(query, output_dir, p):
+    from SciX_outline_creation import get_outline_for_subtopics
+    get_outline_for_subtopics(load_named_clusters(f"{output_dir}/{query}/{query}_clusters_with_subtopics.json",
+                                                  query, output_dir), query, output_dir, p['outline_mode'])
+
+
+def _names_complete(query, output_dir):
+    # Clusters that could not be named are retried by name_the_clusters on the next run
+    return not has_failed_clusters(f"{output_dir}/{query}/{query}_clusters_with_subtopics.json")
+
+
+def _cluster_outputs(query, output_dir):
+    # Same paths as SciX_cluster_subtopic.cluster_model_path, without importing the module
+    return [f"{output_dir}/{query}/{query}_cluster.json", f"{output_dir}/{query}/{query}_cluster_model.joblib"]
+
+
+STAGES = [
+    Stage('search', _search, _query_file('.jsonl'), params=('max_results', 'use_cursor')),
+    Stage('embed', _embed, lambda query, output_dir: list(embedding_store_paths(query, output_dir)),
+          deps=('search',), params=('near_duplicates', 'embedding_backend', 'embedding_model')),
+    Stage('cluster', _cluster, _cluster_outputs,
+          deps=('embed',), params=('top_k', 'cluster_method', 'n_clusters'), cpu_bound=True),
+    Stage('name', _name, _query_file('_clusters_with_subtopics.json'), deps=('cluster',), complete=_names_complete),
+    Stage('outline', _outline, _query_file('_outline.json'), deps=('name',), params=('outline_mode',)),
+]
+
+STAGES_BY_NAME = {stage.name: stage for stage in STAGES}
+
+DEFAULT_PARAMS = {'max_results': 1000, 'max_workers': 4, 'use_cursor': False, 'near_duplicates': False,
+                  'embedding_backend': 'openai', 'embedding_model': None,
+                  'n_jobs': -1, 'top_k': 1000, 'cluster_method': 'GMM', 'n_clusters': None, 'outline_mode': 'auto'}
+
+
+def topological_order(stages):
+    # Dependencies first; raises on unknown or cyclic dependencies
+    by_name = {stage.name: stage for stage in stages}
+    ordered, visiting, done = [], set(), set()
+
+    def visit(stage):
+        if stage.name in done:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"Pipeline stages have a dependency cycle through '{stage.name}'")
+        visiting.add(stage.name)
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+            visit(by_name[dep])
+        visiting.discard(stage.name)
+        done.add(stage.name)
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return ordered
+
+
+def fingerprint_files(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _input_fingerprint(stage, query, params, output_fingerprints):
+    # What the stage's result depends on: the query, its own parameters and its inputs' contents
+    payload = {'stage': stage.name, 'query': query,
+               'params': {name: params[name] for name in stage.params},
+               'inputs': [output_fingerprints[dep] for dep in stage.deps]}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _write_state(state_path, state):
+    with open(f'{state_path}.tmp', 'w') as f:
+        json.dump(state, f, indent=4)
+    os.replace(f'{state_path}.tmp', state_path)
+
+
+def record_external_update(query, output_dir, through=None, stages=STAGES):
+    """
+    Adopt outputs that were rewritten outside the pipeline (by SciX_Incremental) as
+    current: each stage's input and output fingerprints are recomputed from the files
+    on disk with the parameters of its last run, so the next run skips it instead of
+    recomputing. Stops after `through`, and at the first stage with no recorded run or
+    missing outputs, which then runs again as usual. Returns the stages adopted.
+    """
+    state_path = f"{output_dir}/{query}/{PIPELINE_STATE_FILE}"
+    if not os.path.exists(state_path):
+        return []
+    state = _read_json(state_path)
+    output_fingerprints, adopted = {}, []
+    for stage in topological_order(stages):
+        previous = state.get(stage.name, {})
+        outputs = stage.outputs(query, output_dir)
+        if 'params' not in previous or not all(os.path.exists(path) for path in outputs):
+            break
+        output_fingerprints[stage.name] = fingerprint_files(outputs)
+        state[stage.name] = {'input': _input_fingerprint(stage, query, previous['params'], output_fingerprints),
+                             'output': output_fingerprints[stage.name], 'params': previous['params']}
+        adopted.append(stage.name)
+        if stage.name == through:
+            break
+    _write_state(state_path, state)
+    return adopted
+
+
+def _run_stage(stage_name, query, output_dir, params):
+    # Entry point for the clustering process pool; stages are looked up by name so a
+    # Stage object never has to be pickled. The worker's metrics are sent back to be merged.
+    metrics.reset()
+    STAGES_BY_NAME[stage_name].run(query, output_dir, params)
+    return metrics.snapshot()
+
+
+def run_query_pipeline(query, output_dir, params=None, stages=STAGES, force=(), cpu_lock=None, cpu_pool=None):
+    """
+    Run the stages for one query in dependency order. A stage is skipped only when
+    its outputs exist and its inputs (upstream output contents) and parameters match
+    the last successful run; otherwise its stale outputs are removed and it runs.
+    CPU-bound stages run in `cpu_pool` when given, otherwise under `cpu_lock`.
+    Returns a list of {'stage', 'status', 'seconds'} records.
+    """
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    cpu_lock = cpu_lock or threading.Lock()
+    state_path = f"{output_dir}/{query}/{PIPELINE_STATE_FILE}"
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    state = _read_json(state_path) if os.path.exists(state_path) else {}
+
+    output_fingerprints = {}
+    timings = []
+    for stage in topological_order(stages):
+        start = time.perf_counter()
+        outputs = stage.outputs(query, output_dir)
+        input_fingerprint = _input_fingerprint(stage, query, params, output_fingerprints)
+        previous = state.get(stage.name, {})
+
+        current = (stage.name not in force and previous.get('input') == input_fingerprint
+                   and all(os.path.exists(path) for path in outputs))
+        if current and (stage.complete is None or stage.complete(query, output_dir)):
+            status = 'skipped'
+        else:
+            # The stage functions reuse any existing output file, so clear stale ones first;
+            # current but incomplete ones are kept for the stage to finish
+            for path in outputs if not current else ():
+                if os.path.exists(path):
+                    os.remove(path)
+            if stage.cpu_bound and cpu_pool is not None and STAGES_BY_NAME.get(stage.name) is stage:
+                metrics.merge(cpu_pool.submit(_run_stage, stage.name, query, output_dir, params).result())
+            elif stage.cpu_bound:
+                with cpu_lock:
+                    stage.run(query, output_dir, params)
+            else:
+                stage.run(query, output_dir, params)
+            missing = [path for path in outputs if not os.path.exists(path)]
+            if missing:
+                raise RuntimeError(f"Stage '{stage.name}' for '{query}' did not produce {missing}")
+            status = 'ran'
+
+        output_fingerprints[stage.name] = fingerprint_files(outputs)
+        # The stage's parameters are kept so record_external_update can re-fingerprint it
+        state[stage.name] = {'input': input_fingerprint, 'output': output_fingerprints[stage.name],
+                             'params': {name: params[name] for name in stage.params}}
+        _write_state(state_path, state)
+
+        seconds = time.perf_counter() - start
+        metrics.record(f'stage.{stage.name}', seconds)
+        metrics.increment(f'stage.{status}')
+        timings.append({'stage': stage.name, 'status': status, 'seconds': round(seconds, 3)})
+        print(f"[{query}] {stage.name}: {status} in {timings[-1]['seconds']:.2f}s")
+    return timings
+
+
+def resolve_queries(queries=(), queries_file=None, pattern=None, output_dir='Data'):
+    """
+    Collect queries from the command line, a file (one per line, '#' starts a comment)
+    and/or a glob over the query directories already under `output_dir`, in that
+    order and without repeats.
+    """
+    resolved = list(queries or [])
+    if queries_file:
+        with open(queries_file) as f:
+            resolved += [line.split('#', 1)[0].strip() for line in f]
+    if pattern:
+        resolved += sorted(name for name in get_list_of_dir_names(output_dir)
+                           if os.path.isdir(os.path.join(output_dir, name)) and fnmatch.fnmatch(name, pattern))
+    return list(dict.fromkeys(query for query in resolved if query))
+
+
+def _run_isolated(query, output_dir, params, force, cpu_lock, cpu_pool):
+    # One failing query is recorded and must not stop the rest of the batch
+    try:
+        return {'timings': run_query_pipeline(query, output_dir, params, STAGES, force, cpu_lock, cpu_pool)}
+    except Exception as e:
+        print(f"[{query}] failed: {type(e).__name__}: {e}")
+        return {'error': f"{type(e).__name__}: {e}", 'traceback': traceback.format_exc()}
+
+
+def run_pipeline(queries, output_dir, params=None, force=(), max_parallel_queries=2, cluster_workers=0,
+                 metrics_path=None):
+    """
+    Run the pipeline for many queries in one long-lived process. Up to
+    `max_parallel_queries` queries share a thread pool for the network-bound stages.
+    Clustering runs in a pool of `cluster_workers` processes (0 keeps it in this
+    process, one query at a time), so the next queries are fetched and embedded while
+    others are clustered, and imports and numba JIT are paid once per worker.
+    A failed query does not stop the others. Returns {query: {'timings'} or {'error'}}
+    and writes the same to `{output_dir}/.batch_report.json`. Timers, counters and peak
+    memory for the run are written to `metrics_path` (see SciX_Metrics).
+    """
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    if cluster_workers and params['n_jobs'] == -1:
+        # Split the cores between the clustering processes instead of oversubscribing them
+        params['n_jobs'] = max(1, (os.cpu_count() or 1) // cluster_workers)
+
+    cpu_lock = threading.Lock()
+    # Spawned rather than forked: the parent already runs fetch/embed threads, and a forked
+    # child can inherit a lock one of them held
+    cpu_pool = (ProcessPoolExecutor(max_workers=cluster_workers, mp_context=multiprocessing.get_context('spawn'))
+                if cluster_workers else None)
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_parallel_queries)) as executor:
+            futures = {query: executor.submit(_run_isolated, query, output_dir, params, force, cpu_lock, cpu_pool)
+                       for query in queries}
+            results = {query: future.result() for query, future in futures.items()}
+    finally:
+        if cpu_pool is not None:
+            cpu_pool.shutdown()
+    elapsed = time.perf_counter() - start
+
+    for query, result in results.items():
+        print(f"\n{query}")
+        if 'error' in result:
+            print(f"  FAILED: {result['error']}")
+            continue
+        for t in result['timings']:
+            print(f"  {t['stage']:<10} {t['status']:<8} {t['seconds']:>9.2f}s")
+        print(f"  {'total':<19} {sum(t['seconds'] for t in result['timings']):>9.2f}s")
+
+    failed = [query for query, result in results.items() if 'error' in result]
+    print(f"\n{len(results) - len(failed)} of {len(results)} queries succeeded in {elapsed:.1f}s")
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, BATCH_REPORT_FILE), 'w') as f:
+        json.dump({'seconds': round(elapsed, 3), 'failed': failed, 'queries': results}, f, indent=4)
+    if metrics_path:
+        write_metrics(metrics_path, {'params': params, 'failed': failed,
+                                     'queries': {q: r.get('timings') for q, r in results.items()}})
+        print(f"Metrics written to {metrics_path}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--query', dest='queries', nargs='*', default=[], type=str, help='one or more queries to run')
+    parser.add_argument('--queries_file', dest='queries_file', default=None, type=str, help='file with one query per line')
+    parser.add_argument('--glob', dest='pattern', default=None, type=str, help='also run every query directory under output_dir matching this pattern, e.g. "*asteroid*"')
+    parser.add_argument('--output_dir', dest='output_dir', default='Data', type=str, help='data directory')
+    parser.add_argument('--max_results', dest='max_results', default=1000, type=int, help='maximum number of papers to fetch')
+    parser.add_argument('--use_cursor', dest='use_cursor', action='store_true', help='use cursorMark deep paging')
+    parser.add_argument('--near_duplicates', dest='near_duplicates', action='store_true', help='also drop near-duplicate papers')
+    parser.add_argument('--embedding_backend', dest='embedding_backend', default='openai', choices=EMBEDDING_BACKENDS, help='embedding backend; sentence-transformers and onnx run on this machine')
+    parser.add_argument('--embedding_model', dest='embedding_model', default=None, type=str, help='embedding model (for onnx, the exported model directory)')
+    parser.add_argument('--cluster_method', dest='cluster_method', default='GMM', type=str, help='clustering method')
+    parser.add_argument('--top_k', dest='top_k', default=1000, type=int, help='number of papers to cluster')
+    parser.add_argument('--n_clusters', dest='n_clusters', default=None, type=int, help='maximum number of clusters')
+    parser.add_argument('--outline_mode', dest='outline_mode', default='auto', choices=['auto', 'single', 'hierarchical'], help='outline in one prompt, map-reduce over subtopic groups, or auto by prompt size')
+    parser.add_argument('--force', dest='force', nargs='*', default=[], choices=[s.name for s in STAGES], help='stages to re-run regardless of fingerprints')
+    parser.add_argument('--max_parallel_queries', dest='max_parallel_queries', default=2, type=int, help='queries whose stages may overlap')
+    parser.add_argument('--cluster_workers', dest='cluster_workers', default=0, type=int, help='processes for clustering (0: cluster in this process, one query at a time)')
+    parser.add_argument('--metrics_file', dest='metrics_file', default=None, type=str, help='where to write the run metrics JSON (default: output_dir/.metrics/run_<time>.json)')
+    parser.add_argument('--profile', dest='profile', default=None, choices=['cprofile', 'pyinstrument'], help='also profile the run and write the report next to the metrics file')
+    args = parser.parse_args()
+
+    queries = resolve_queries(args.queries, args.queries_file, args.pattern, args.output_dir)
+    if not queries:
+        parser.error("no queries given; use --query, --queries_file or --glob")
+
+    params = {'max_results': args.max_results, 'use_cursor': args.use_cursor, 'near_duplicates': args.near_duplicates,
+              'embedding_backend': args.embedding_backend, 'embedding_model': args.embedding_model,
+              'cluster_method': args.cluster_method, 'top_k': args.top_k, 'n_clusters': args.n_clusters,
+              'outline_mode': args.outline_mode}
+    metrics_file = args.metrics_file or os.path.join(args.output_dir, '.metrics',
+                                                     f"run_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    if args.profile:
+        suffix = '.prof' if args.profile == 'cprofile' else '.html'
+        with profile(os.path.splitext(metrics_file)[0] + suffix, args.profile):
+            results = run_pipeline(queries, args.output_dir, params, args.force, args.max_parallel_queries,
+                                   args.cluster_workers, metrics_file)
+    else:
+        results = run_pipeline(queries, args.output_dir, params, args.force, args.max_parallel_queries,
+                               args.cluster_workers, metrics_file)
+    sys.exit(1 if any('error' in result for result in results.values()) else 0)
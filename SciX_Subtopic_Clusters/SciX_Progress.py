@@ -0,0 +1,56 @@
+import sys
+
+
+def running_in_streamlit():
+    # Only true inside `streamlit run`; streamlit is never imported just to find out
+    if 'streamlit' not in sys.modules:
+        return False
+    try:
+        from streamlit.runtime import exists
+    except ImportError:
+        return False
+    return exists()
+
+
+def report(message):
+    """
+    Show a status message in the Streamlit app when running inside one, otherwise print it.
+    """
+    if running_in_streamlit():
+        import streamlit as st
+        st.write(message)
+    else:
+        print(message)
+
+
+class Progress:
+    """
+    Progress bar drawn with st.progress inside a Streamlit app and with tqdm otherwise.
+    update(n) advances it by n items, like tqdm.
+    """
+
+    def __init__(self, total, text=''):
+        self.total = total
+        self.text = text
+        self.done = 0
+        if running_in_streamlit():
+            import streamlit as st
+            self._bar = st.progress(0, text=text)
+            self._tqdm = None
+        else:
+            from tqdm import tqdm
+            self._bar = None
+            self._tqdm = tqdm(total=total, desc=text or None)
+
+    def update(self, n=1):
+        self.done += n
+        if self._tqdm is not None:
+            self._tqdm.update(n)
+        else:
+            self._bar.progress(min(self.done / self.total, 1.0) if self.total else 1.0, text=self.text)
+
+    def close(self):
+        if self._tqdm is not None:
+            self._tqdm.close()
+        else:
+            self._bar.progress(1.0, text=self.text)
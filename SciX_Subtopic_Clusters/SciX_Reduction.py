@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import joblib
+
+from SciX_Metrics import metrics
+
+NN_DESCENT_MIN_ROWS = 4096  # UMAP finds exact neighbours below this many rows and uses NN-descent above
+MAX_CACHED_REDUCTIONS = 8  # Reductions kept per cache directory; the least recently used are pruned
+_UMAP_JIT_WARM = set()  # (stage, approximate) pairs already compiled in this process
+
+
+def fingerprint_matrix(matrix):
+    # Hash of the float32 contents, so the same vectors match whatever format they were loaded from
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    digest = hashlib.sha256(str(matrix.shape).encode())
+    digest.update(matrix.tobytes())
+    return digest.hexdigest()
+
+
+def _params_key(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def warm_up_umap(n_components=20, metric='cosine', transform=False, n_rows=0):
+    """
+    Trigger numba JIT compilation with a tiny fit (and transform) so it is not billed
+    to the real one. `n_rows` is the size of the real fit: from NN_DESCENT_MIN_ROWS
+    rows UMAP switches to NN-descent, so the tiny fit is forced onto it as well and
+    that path gets compiled too. Returns the seconds spent (0 once already warm).
+    """
+    approximate = n_rows >= NN_DESCENT_MIN_ROWS
+    stages = ('fit', 'transform') if transform else ('fit',)
+    if all((stage, approximate) in _UMAP_JIT_WARM for stage in stages):
+        return 0.0
+    start = time.perf_counter()
+    import umap  # Pulls in numba; only paid once something is actually reduced
+    sample = np.random.default_rng(0).standard_normal((64, n_components + 4)).astype(np.float32)
+    reducer = umap.UMAP(n_neighbors=5, n_components=min(n_components, 8), metric=metric, random_state=0,
+                        force_approximation_algorithm=approximate)
+    reducer.fit(sample)
+    _UMAP_JIT_WARM.add(('fit', approximate))
+    if transform:
+        reducer.transform(sample[:8])
+        _UMAP_JIT_WARM.add(('transform', approximate))
+    return time.perf_counter() - start
+
+
+def reduce_embeddings(embeddings, cache_dir=None, n_neighbors=None, n_components=20, metric='cosine',
+                      min_dist=0, seed=42):
+    """
+    UMAP reduction as a cached stage. Returns (reduced, report).
+
+    Results are persisted under `cache_dir` keyed by (input fingerprint, n_neighbors,
+    n_components, metric, seed), keeping the MAX_CACHED_REDUCTIONS most recently used.
+    When the input extends a previously reduced matrix
+    (same leading rows, same parameters), the stored reducer `transform`s only the
+    new rows. `report` separates numba JIT warm-up time from fit/transform time and
+    holds the fitted reducer under 'reducer', so callers can transform later rows
+    into the same space. n_neighbors=None uses sqrt(n - 1), capped at 50.
+    """
+    reduced, report = _reduce(embeddings, cache_dir, n_neighbors, n_components, metric, min_dist, seed)
+    metrics.increment(f"umap.cache_{report['cache']}")
+    for step in ('jit', 'fit', 'transform'):
+        if report[f'{step}_seconds']:
+            metrics.record(f'umap.{step}', report[f'{step}_seconds'])
+    return reduced, report
+
+
+def _reduce(embeddings, cache_dir, n_neighbors, n_components, metric, min_dist, seed):
+    params = {'n_neighbors': n_neighbors, 'n_components': n_components, 'metric': metric,
+              'min_dist': min_dist, 'seed': seed}
+    report = {'cache': 'miss', 'jit_seconds': 0.0, 'fit_seconds': 0.0, 'transform_seconds': 0.0, 'reducer': None}
+
+    fingerprint = fingerprint_matrix(embeddings)
+    index_path = os.path.join(cache_dir, 'umap_index.json') if cache_dir else None
+    index = []
+    if index_path and os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+
+    params_key = _params_key(params)
+    entries = [e for e in index if e['params_key'] == params_key]
+
+    for entry in entries:
+        if entry['fingerprint'] == fingerprint:
+            report['cache'] = 'hit'
+            entry['last_used'] = time.time()
+            _write_index(cache_dir, index)
+            report['reducer'] = joblib.load(os.path.join(cache_dir, entry['reducer']))
+            return np.load(os.path.join(cache_dir, entry['reduced'])), report
+
+    # Reuse a reducer fitted on a prefix of these rows, if there is one
+    for entry in sorted(entries, key=lambda e: e['n_rows'], reverse=True):
+        if entry['n_rows'] < len(embeddings) and fingerprint_matrix(embeddings[:entry['n_rows']]) == entry['fingerprint']:
+            reducer = joblib.load(os.path.join(cache_dir, entry['reducer']))
+            previous = np.load(os.path.join(cache_dir, entry['reduced']))
+            report['jit_seconds'] = warm_up_umap(n_components, metric, transform=True, n_rows=entry['n_rows'])
+            start = time.perf_counter()
+            added = reducer.transform(embeddings[entry['n_rows']:])
+            report['transform_seconds'] = time.perf_counter() - start
+            report['cache'] = 'transform'
+            report['reducer'] = reducer
+            reduced = np.vstack([previous, added])
+            _save_reduction(cache_dir, index, params_key, fingerprint, reduced, entry['reducer'])
+            print(f"UMAP: transformed {len(added)} new rows with the reducer fitted on {entry['n_rows']}")
+            return reduced, report
+
+    report['jit_seconds'] = warm_up_umap(n_components, metric, n_rows=len(embeddings))
+    import umap
+    if n_neighbors is None:
+        n_neighbors = int(np.min([int((len(embeddings) - 1) ** 0.5), 50]))
+    reducer = umap.UMAP(n_neighbors=n_neighbors,
+                        n_components=n_components,
+                        min_dist=min_dist,
+                        metric=metric,
+                        random_state=seed)
+    start = time.perf_counter()
+    reduced = reducer.fit_transform(embeddings)
+    report['fit_seconds'] = time.perf_counter() - start
+    report['reducer'] = reducer
+    print(f"UMAP: JIT warm-up {report['jit_seconds']:.2f}s, fit {report['fit_seconds']:.2f}s")
+
+    if cache_dir:
+        reducer_file = f"umap_{params_key}_{fingerprint[:16]}.joblib"
+        os.makedirs(cache_dir, exist_ok=True)
+        joblib.dump(reducer, os.path.join(cache_dir, reducer_file))
+        _save_reduction(cache_dir, index, params_key, fingerprint, reduced, reducer_file)
+    return reduced, report
+
+
+def _save_reduction(cache_dir, index, params_key, fingerprint, reduced, reducer_file):
+    reduced_file = f"umap_{params_key}_{fingerprint[:16]}.npy"
+    np.save(os.path.join(cache_dir, reduced_file), reduced)
+    index.append({'params_key': params_key, 'fingerprint': fingerprint, 'n_rows': len(reduced),
+                  'reduced': reduced_file, 'reducer': reducer_file, 'last_used': time.time()})
+    _write_index(cache_dir, _prune(cache_dir, index))
+
+
+def _prune(cache_dir, index, max_entries=MAX_CACHED_REDUCTIONS):
+    # Drop the least recently used entries and the files no remaining entry refers to
+    # (reductions extended by transform share their reducer file)
+    index = sorted(index, key=lambda e: e.get('last_used', 0))
+    removed, kept = index[:max(0, len(index) - max_entries)], index[max(0, len(index) - max_entries):]
+    in_use = {e['reduced'] for e in kept} | {e['reducer'] for e in kept}
+    for entry in removed:
+        for name in (entry['reduced'], entry['reducer']):
+            path = os.path.join(cache_dir, name)
+            if name not in in_use and os.path.exists(path):
+                os.remove(path)
+    return kept
+
+
+def _write_index(cache_dir, index):
+    index_path = os.path.join(cache_dir, 'umap_index.json')
+    with open(f'{index_path}.tmp', 'w') as f:
+        json.dump(index, f, indent=4)
+    os.replace(f'{index_path}.tmp', index_path)
@@ -0,0 +1,83 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+
+from SciX_SQLite_Cache import SQLiteLRUCache
+
+RESPONSE_CACHE_FILE = '.llm_response_cache.sqlite'
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_TTL_DAYS = 90
+
+
+def make_response_key(model, messages):
+    # The key covers the model and every message, i.e. the system prompt and the user content
+    payload = json.dumps({'model': model, 'messages': [[m['role'], m['content']] for m in messages]})
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache(SQLiteLRUCache):
+    """
+    Persistent LLM response cache keyed by sha256(model, system prompt, user content).
+    Entries expire after `ttl_seconds` (None keeps them forever), and the least
+    recently used ones are evicted past `max_entries`.
+    """
+
+    TABLE = 'responses'
+    COLUMNS = 'model TEXT NOT NULL, response TEXT NOT NULL, created REAL NOT NULL'
+    INDEX = 'idx_responses_last_used'
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_DAYS * 86400):
+        super().__init__(path, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.expired = 0
+
+    def get(self, model, messages):
+        key = make_response_key(model, messages)
+        now = time.time()
+        with self._lock:
+            rows = self._select('response, created', [key])
+            row = rows[0] if rows else None
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._delete("key = ?", (key,))
+                self.expired += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._touch([key], now)
+            self.hits += 1
+            return row[0]
+
+    def put(self, model, messages, response):
+        now = time.time()
+        self._insert([(make_response_key(model, messages), model, response, now, now)])
+
+    def _expire(self):
+        if self.ttl_seconds is None:
+            return 0
+        return self._delete("created < ?", (time.time() - self.ttl_seconds,))
+
+    def stats(self):
+        stats = super().stats()
+        hit_rate = stats.pop('hit_rate')
+        return {**stats, 'expired': self.expired, 'hit_rate': hit_rate}
+
+
+def open_response_cache(output_dir, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_DAYS * 86400):
+    # One cache per data directory, shared by aspect generation and outline creation
+    return ResponseCache(os.path.join(output_dir, RESPONSE_CACHE_FILE), max_entries, ttl_seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output_dir', dest='output_dir', default='Data', type=str, help='data directory holding the cache')
+    parser.add_argument('--max_entries', dest='max_entries', default=DEFAULT_MAX_ENTRIES, type=int, help='evict down to this many entries')
+    parser.add_argument('--ttl_days', dest='ttl_days', default=DEFAULT_TTL_DAYS, type=float, help='drop entries older than this')
+    args = parser.parse_args()
+
+    cache = open_response_cache(args.output_dir, args.max_entries, args.ttl_days * 86400)
+    print(f"Evicted {cache.evict()} entries")
+    print(cache.stats())
+    cache.close()
@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import threading
+
+EVICT_FRACTION = 0.05  # Share of max_entries freed at once, so a full cache does not evict on every put
+MAX_SQL_PARAMS = 500  # Keys per IN (...) query, well under SQLite's bound-parameter limit
+
+
+class SQLiteLRUCache:
+    """
+    Base of the on-disk caches: one SQLite table of `key TEXT PRIMARY KEY`, the
+    subclass's COLUMNS and `last_used REAL`, shared by threads. The number of rows is
+    counted when the cache is opened and then kept up to date by every write, so a put
+    never scans the table. Once it passes `max_entries`, the least recently used rows
+    are evicted down to (1 - EVICT_FRACTION) * max_entries.
+    Another process writing the same file is only noticed at the next recount, so
+    the cache can run slightly over `max_entries` until then.
+    """
+
+    TABLE = None
+    COLUMNS = None  # Column definitions between `key` and `last_used`
+    INDEX = None
+
+    def __init__(self, path, max_entries):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                key TEXT PRIMARY KEY,
+                {self.COLUMNS},
+                last_used REAL NOT NULL
+            )""")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {self.INDEX} ON {self.TABLE}(last_used)")
+        self._conn.commit()
+        self._count = self._recount()
+
+    def _recount(self):
+        return self._conn.execute(f"SELECT COUNT(*) FROM {self.TABLE}").fetchone()[0]
+
+    def _select(self, columns, keys):
+        # Rows of the given keys that are in the cache; call with the lock held
+        rows = []
+        for i in range(0, len(keys), MAX_SQL_PARAMS):
+            chunk = keys[i:i + MAX_SQL_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            rows += self._conn.execute(
+                f"SELECT {columns} FROM {self.TABLE} WHERE key IN ({placeholders})", chunk).fetchall()
+        return rows
+
+    def _touch(self, keys, now):
+        # Mark entries as used; call with the lock held
+        self._conn.executemany(f"UPDATE {self.TABLE} SET last_used = ? WHERE key = ?", [(now, key) for key in keys])
+        self._conn.commit()
+
+    def _delete(self, where, params=()):
+        # Call with the lock held; returns the number of rows removed
+        removed = self._conn.execute(f"DELETE FROM {self.TABLE} WHERE {where}", params).rowcount
+        self._conn.commit()
+        self._count -= removed
+        return removed
+
+    def _insert(self, rows):
+        """
+        INSERT OR REPLACE rows whose first value is the key, counting only the new keys,
+        and evict once the count passes max_entries.
+        """
+        if not rows:
+            return
+        with self._lock:
+            # A replaced key is not a new row; the keys are looked up on the primary key index
+            existing = len(self._select('key', list({row[0] for row in rows})))
+            placeholders = ",".join("?" * len(rows[0]))
+            self._conn.executemany(f"INSERT OR REPLACE INTO {self.TABLE} VALUES ({placeholders})", rows)
+            self._conn.commit()
+            self._count += len({row[0] for row in rows}) - existing
+            full = self._count > self.max_entries
+        if full:
+            self.evict(int(self.max_entries * (1 - EVICT_FRACTION)))
+
+    def _expire(self):
+        # Rows to drop regardless of use, e.g. past a TTL; call with the lock held
+        return 0
+
+    def evict(self, max_entries=None):
+        """
+        Drop expired entries, then the least recently used ones beyond `max_entries`
+        (default: the cache's own). Returns the number of entries removed.
+        """
+        max_entries = self.max_entries if max_entries is None else max_entries
+        with self._lock:
+            removed = self._expire()
+            self._count = self._recount()
+            excess = self._count - max_entries
+            if excess > 0:
+                removed += self._delete(f"key IN (SELECT key FROM {self.TABLE} ORDER BY last_used ASC LIMIT ?)",
+                                        (excess,))
+        return removed
+
+    def stats(self):
+        with self._lock:
+            self._count = self._recount()
+            entries = self._count
+        lookups = self.hits + self.misses
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -2,38 +2,223 @@ import json
 import requests
 import os
 import time
+import random
 import argparse
+import threading
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from requests.adapters import HTTPAdapter
+from SciX_Navigator_utils import load_papers
+from SciX_Metrics import metrics
 
 ADS_API_TOKEN = 'YOUR-API-KEY'  # Replace with your actual ADS API token
+ADS_API_URL = 'https://api.adsabs.harvard.edu/v1/search/query'
 
-def fetch_papers_from_ads(query, max_results=100):
-    headers = {
-        'Authorization': f'Bearer {ADS_API_TOKEN}'
-    }
-    fields = "title,abstract,year"
-    rows = 100  # Adjust based on the API's max limit
-    start = 0
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+QUOTA_RESET_MARGIN = 0.1  # Seconds added to X-RateLimit-Reset for clock skew and rounding
 
-    papers = []
+# When the ADS quota resets, once a response reported it used up; shared by every request
+_quota_reset_at = 0.0
+_quota_lock = threading.Lock()
 
-    while len(papers) < max_results:
-        url = f"https://api.adsabs.harvard.edu/v1/search/query?q={query}&fl={fields}&start={start}&rows={rows}&sort=relevance"
-        response = requests.get(url, headers=headers)
-        data = response.json()
 
-        if 'response' not in data or 'docs' not in data['response']:
-            print(data)  # Print any error messages
-            break
+class ADSFetchError(RuntimeError):
+    pass
+
+
+def create_ads_session(pool_size=8):
+    """
+    Create one pooled HTTP session that is shared by every page request.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Authorization': f'Bearer {ADS_API_TOKEN}'})
+    return session
+
+
+def _retry_after_seconds(value):
+    # Retry-After is either a number of seconds or an HTTP date; None if it is neither
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)  # HTTP dates are always GMT
+    return retry_at.timestamp() - time.time()
+
+
+def _quota_reset_seconds(headers):
+    # Seconds until the X-RateLimit-* window resets, or None while requests remain
+    if headers.get('X-RateLimit-Remaining') != '0' or not headers.get('X-RateLimit-Reset'):
+        return None
+    try:
+        return float(headers['X-RateLimit-Reset']) - time.time()
+    except ValueError:
+        return None
+
+
+def _retry_wait(response, attempt, backoff, max_wait):
+    # Prefer the server's own hints: Retry-After, then the X-RateLimit-* window
+    headers = response.headers if response is not None else {}
+    wait = _retry_after_seconds(headers['Retry-After']) if headers.get('Retry-After') else None
+    if wait is None:
+        wait = _quota_reset_seconds(headers)
+    if wait is None:
+        wait = backoff * 2 ** attempt + random.uniform(0, backoff)
+    return min(max(wait, 0), max_wait)
 
-        papers.extend(data['response']['docs'])
-        start += rows
 
-        if len(papers) >= max_results or len(data['response']['docs']) < rows:
+def _wait_for_quota():
+    # The quota belongs to the token, so every thread and query waits for its reset
+    wait = _quota_reset_at - time.time()
+    if wait > 0:
+        metrics.increment('ads.quota_waits')
+        time.sleep(wait)
+
+
+def _note_quota(response, max_wait):
+    # A successful response that used up the quota pauses the next requests until it
+    # resets, instead of letting each of them run into a 429
+    global _quota_reset_at
+    wait = _quota_reset_seconds(response.headers)
+    if wait is not None and wait > 0:
+        wait = min(wait + QUOTA_RESET_MARGIN, max_wait)
+        with _quota_lock:
+            _quota_reset_at = max(_quota_reset_at, time.time() + wait)
+        print(f"ADS rate limit reached; pausing requests for {wait:.1f}s")
+
+
+def fetch_ads_page(session, params, api_url=ADS_API_URL, max_retries=5, backoff=1.0, max_wait=60):
+    """
+    Fetch a single page of ADS results, retrying on rate limits and server errors.
+    """
+    for attempt in range(max_retries + 1):
+        response = None
+        _wait_for_quota()
+        try:
+            with metrics.timer('ads.page_request'):
+                response = session.get(api_url, params=params, timeout=60)
+            if response.status_code not in RETRY_STATUS_CODES:
+                _note_quota(response, max_wait)
+                break
+        except (requests.ConnectionError, requests.Timeout) as e:
+            print(f"Request for start={params.get('start')} failed: {e}")
+
+        if attempt == max_retries:
             break
+        wait = _retry_wait(response, attempt, backoff, max_wait)
+        metrics.increment('ads.retries')
+        print(f"Retrying start={params.get('start')} in {wait:.1f}s (attempt {attempt + 1}/{max_retries})")
+        time.sleep(wait)
+
+    if response is None:
+        return {}
+    try:
+        return response.json()
+    except ValueError:
+        return {'error': response.text, 'status_code': response.status_code}
+
+
+def iter_ads_pages(query, max_results=100, rows=100, max_workers=4, use_cursor=False,
+                   api_url=ADS_API_URL, session=None, offset=0):
+    """
+    Yield pages of ADS docs in relevance order as soon as they arrive, starting at `offset`.
+    """
+    if offset >= max_results:
+        return  # Checked before a session is opened, since nothing would close it
+
+    fields = "title,abstract,year"
+    rows = min(rows, max_results)
+    own_session = session is None
+    if own_session:
+        session = create_ads_session(pool_size=max_workers)
+
+    base_params = {'q': query, 'fl': fields, 'rows': rows}
+    try:
+        if use_cursor:
+            pages = _iter_with_cursor(session, base_params, max_results, offset, api_url)
+        else:
+            pages = _iter_concurrently(session, base_params, max_results, rows, max_workers, offset, api_url)
 
+        remaining = max_results - offset
+        for page in pages:
+            if remaining <= 0:
+                break
+            yield page[:remaining]
+            remaining -= len(page)
+    finally:
+        if own_session:
+            session.close()
+
+
+def fetch_papers_from_ads(query, max_results=100, rows=100, max_workers=4, use_cursor=False,
+                          api_url=ADS_API_URL, session=None):
+    papers = []
+    try:
+        for page in iter_ads_pages(query, max_results, rows, max_workers, use_cursor, api_url, session):
+            papers.extend(page)
+    except ADSFetchError as e:
+        print(e)  # Keep whatever was fetched before the error
     return papers[:max_results]
 
 
+def _iter_concurrently(session, base_params, max_results, rows, max_workers, offset, api_url):
+    # The first page tells us how many results exist; the rest are fetched in parallel
+    data = fetch_ads_page(session, {**base_params, 'start': offset, 'sort': 'relevance'}, api_url)
+    if 'response' not in data or 'docs' not in data['response']:
+        raise ADSFetchError(data)
+
+    yield data['response']['docs']
+    total = min(max_results, data['response'].get('numFound', 0))
+    starts = iter(range(offset + rows, total, rows))
+
+    def fetch(start):
+        return fetch_ads_page(session, {**base_params, 'start': start, 'sort': 'relevance'}, api_url)
+
+    # Keep a bounded window of in-flight pages and yield them in request order,
+    # so relevance ranking is preserved and unconsumed pages never pile up in memory
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque(executor.submit(fetch, start) for start in islice(starts, 2 * max_workers))
+        while in_flight:
+            page = in_flight.popleft().result()
+            if 'response' not in page or 'docs' not in page['response']:
+                for future in in_flight:
+                    future.cancel()
+                raise ADSFetchError(page)
+            for start in islice(starts, 1):
+                in_flight.append(executor.submit(fetch, start))
+            yield page['response']['docs']
+
+
+def _iter_with_cursor(session, base_params, max_results, offset, api_url):
+    # cursorMark deep paging needs a sort with a unique tiebreaker; cursors cannot
+    # seek, so when resuming we page from the beginning and skip `offset` docs
+    seen = 0
+    cursor = '*'
+    while seen < max_results:
+        data = fetch_ads_page(session, {**base_params, 'sort': 'score desc,id desc', 'cursorMark': cursor}, api_url)
+        if 'response' not in data or 'docs' not in data['response']:
+            raise ADSFetchError(data)
+
+        docs = data['response']['docs']
+        if seen + len(docs) > offset:
+            yield docs[max(offset - seen, 0):]
+        seen += len(docs)
+        next_cursor = data.get('nextCursorMark')
+        if not docs or next_cursor is None or next_cursor == cursor:
+            break
+        cursor = next_cursor
+
+
 def save_to_jsonl(papers, dir_name, query):
     if not os.path.exists(dir_name):
         os.makedirs(dir_name)
@@ -44,11 +229,71 @@ def save_to_jsonl(papers, dir_name, query):
             file.write('\n')
 
 
-def search_papers_in_ads(query, output_dir, max_results=1000):
-    papers = fetch_papers_from_ads(query, max_results)
-    save_to_jsonl(papers, os.path.join(f"{output_dir}/{query}"), query)
-    print(f"Total {len(papers)} papers")
-    return papers
+def count_resumable_papers(dir_name, query):
+    """
+    Return how many complete records a previous interrupted run left in the
+    `.part` file, truncating any half-written trailing line.
+    """
+    part_path = os.path.join(dir_name, f'{query}.jsonl.part')
+    if not os.path.exists(part_path):
+        return 0
+
+    count = 0
+    valid_bytes = 0
+    with open(part_path, 'rb') as file:
+        for line in file:
+            if not line.endswith(b'\n'):
+                break
+            count += 1
+            valid_bytes += len(line)
+
+    with open(part_path, 'r+b') as file:
+        file.truncate(valid_bytes)
+    return count
+
+
+def stream_pages_to_jsonl(pages, dir_name, query, resume=True):
+    """
+    Append each page to `{query}.jsonl.part` as it arrives and atomically rename it
+    to `{query}.jsonl` once the stream is exhausted. If the stream raises, the
+    `.part` file is left in place for the next run to resume from.
+    Returns the number of papers written.
+    """
+    os.makedirs(dir_name, exist_ok=True)
+    part_path = os.path.join(dir_name, f'{query}.jsonl.part')
+    written = count_resumable_papers(dir_name, query) if resume else 0
+
+    with open(part_path, 'a' if written else 'w') as file:
+        for page in pages:
+            for paper in page:
+                json.dump(paper, file)
+                file.write('\n')
+            written += len(page)
+            # Make every completed page durable so a crash can resume after it
+            file.flush()
+            os.fsync(file.fileno())
+
+    os.replace(part_path, os.path.join(dir_name, f'{query}.jsonl'))
+    return written
+
+
+def search_papers_in_ads(query, output_dir, max_results=1000, max_workers=4, use_cursor=False, resume=True,
+                         api_url=ADS_API_URL, lazy=False):
+    """
+    Fetch the papers for `query` into `{query}.jsonl` and return them as a list, read
+    back from that file. lazy=True returns an iterator over the file instead, for
+    result sets too large to hold in memory.
+    """
+    dir_name = os.path.join(f"{output_dir}/{query}")
+    offset = count_resumable_papers(dir_name, query) if resume else 0
+    if offset:
+        print(f"Resuming {query} after {offset} already written papers")
+
+    pages = iter_ads_pages(query, max_results, max_workers=max_workers, use_cursor=use_cursor,
+                           api_url=api_url, offset=offset)
+    total = stream_pages_to_jsonl(pages, dir_name, query, resume=resume)
+    print(f"Total {total} papers")
+    return load_papers(query, output_dir, lazy=lazy)
 
 
 if __name__ == "__main__":
@@ -56,6 +301,9 @@ if __name__ == "__main__":
     parser.add_argument('--query', dest='query', type=str, help='query to search')
     parser.add_argument('--output_dir', dest='output_dir', type=str, help='output directory to save the papers')
     parser.add_argument('--max_results', dest='max_results', default=1000, type=int, help='maximum number of papers to fetch')
+    parser.add_argument('--max_workers', dest='max_workers', default=4, type=int, help='number of concurrent page requests')
+    parser.add_argument('--use_cursor', dest='use_cursor', action='store_true', help='use cursorMark deep paging instead of concurrent pages')
+    parser.add_argument('--no_resume', dest='resume', action='store_false', help='discard a partially written result file instead of resuming it')
     args = parser.parse_args()
 
-    search_papers_in_ads(args.query, args.output_dir, args.max_results)
\ No newline at end of file
+    search_papers_in_ads(args.query, args.output_dir, args.max_results, args.max_workers, args.use_cursor, args.resume)
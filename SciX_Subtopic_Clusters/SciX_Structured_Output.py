@@ -0,0 +1,233 @@
+import json
+import threading
+import jsonschema
+from SciX_LLM_Dispatch import chat_completion, RateLimiter, run_concurrently
+from SciX_Metrics import metrics
+
+JSON_MODE = {"type": "json_object"}
+MAX_REPAIRS = 2  # Repair requests per answer
+REPAIR_BUDGET_SHARE = 0.25  # Repair requests across a batch, as a share of its requests
+MAX_PREAMBLE_CHARS = 200  # Text tolerated before the JSON object starts (e.g. a ```json fence)
+
+
+class SchemaError(ValueError):
+    """
+    An LLM answer that is not a JSON object of the expected shape.
+    """
+
+
+class Schema:
+    """
+    A JSON Schema for an LLM answer (a JSON object), checked with jsonschema. Each
+    top-level member can be checked on its own against its property's subschema, so a
+    streamed answer is rejected at the first wrong field.
+    """
+
+    def __init__(self, json_schema):
+        jsonschema.Draft202012Validator.check_schema(json_schema)
+        self.json_schema = json_schema
+        self._validator = jsonschema.Draft202012Validator(json_schema)
+        self._field_validators = {field: jsonschema.Draft202012Validator(subschema)
+                                  for field, subschema in json_schema.get('properties', {}).items()}
+
+    def describe(self):
+        return ', '.join(f'"{field}"' for field in self.json_schema.get('properties', {}))
+
+    def validate_field(self, field, value):
+        if field not in self._field_validators:
+            return  # Extra fields are checked with the whole object, if the schema forbids them
+        _raise_first_error(self._field_validators[field], value, prefix=f'"{field}"')
+
+    def validate(self, value):
+        _raise_first_error(self._validator, value)
+        return value
+
+
+def _raise_first_error(validator, value, prefix=None):
+    error = jsonschema.exceptions.best_match(validator.iter_errors(value))
+    if error is None:
+        return
+    path = [prefix] if prefix else []
+    path += [json.dumps(part) for part in error.absolute_path]
+    raise SchemaError(f"{'/'.join(path) + ': ' if path else ''}{error.message}")
+
+
+class JSONStreamValidator:
+    """
+    Checks a streamed answer as it arrives. Every top-level member of the JSON object is
+    validated against the schema as soon as it is complete, so a wrong field stops the
+    stream early instead of after the whole completion is paid for. Text before the
+    object (a ```json fence) and after it is ignored.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.reset()
+
+    def reset(self):
+        # Called before every attempt, so a retried stream starts from scratch
+        self.text = ''
+        self._pos = 0
+        self._start = None  # Index of the object's opening brace
+        self._end = None  # Index just past its closing brace
+        self._member_start = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, piece):
+        self.text += piece
+        if self._end is not None:
+            return
+        text = self.text
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            if self._start is None:
+                if char == '{':
+                    self._start = self._member_start = i + 1
+                    self._depth = 1
+                elif i >= MAX_PREAMBLE_CHARS:
+                    raise SchemaError("the answer does not start with a JSON object")
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._check_member(text[self._member_start:i])
+                    self._end = i + 1
+                    break
+            elif char == ',' and self._depth == 1:
+                self._check_member(text[self._member_start:i])
+                self._member_start = i + 1
+        self._pos = len(text)
+
+    def _check_member(self, member):
+        if not member.strip():
+            return  # The empty object
+        try:
+            parsed = json.loads('{' + member + '}')
+        except json.JSONDecodeError as e:
+            raise SchemaError(f"invalid JSON: {e}") from None
+        for field, value in parsed.items():
+            self.schema.validate_field(field, value)
+
+    def result(self):
+        """
+        The complete, validated object; SchemaError if the answer stopped early.
+        """
+        if self._start is None:
+            raise SchemaError("the answer contains no JSON object")
+        if self._end is None:
+            raise SchemaError("the answer was cut off before the JSON object was complete")
+        try:
+            value = json.loads(self.text[self._start - 1:self._end])
+        except json.JSONDecodeError as e:
+            raise SchemaError(f"invalid JSON: {e}") from None
+        return self.schema.validate(value)
+
+
+def _require_content(content):
+    # A refusal or a tool call comes back without any message content
+    if not content:
+        raise SchemaError("the answer has no content")
+    return content
+
+
+def parse_structured(content, schema):
+    # Validate a complete answer the same way a streamed one is
+    validator = JSONStreamValidator(schema)
+    validator.feed(_require_content(content))
+    return validator.result()
+
+
+class RetryBudget:
+    """
+    Thread-safe count of the repair requests a batch may still make.
+    """
+
+    def __init__(self, total):
+        self.remaining = total
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+def structured_completion(client, model, messages, schema, limiter=None, max_retries=5, cache=None,
+                          max_repairs=MAX_REPAIRS, budget=None, stream=True):
+    """
+    A chat completion in JSON mode, returned as a dict validated against `schema`.
+    Streamed answers are checked member by member and cut off at the first invalid one.
+    An invalid answer is sent back with the error for a corrected one, up to
+    `max_repairs` times and while the shared `budget` lasts; after that SchemaError is
+    raised. Only valid answers are cached, keyed by the original messages.
+    """
+    validator = JSONStreamValidator(schema)
+    attempt_messages = messages
+    for repair in range(max_repairs + 1):
+        validator.reset()
+        try:
+            content = chat_completion(client, model, attempt_messages, limiter, max_retries,
+                                      cache=cache if repair == 0 else None,
+                                      cacheable=lambda content: _is_valid(content, schema),
+                                      response_format=JSON_MODE, validator=validator if stream else None)
+            if not stream:
+                validator.feed(_require_content(content))
+            result = validator.result()
+        except SchemaError as e:
+            metrics.increment('llm.schema_errors')
+            if repair == max_repairs or (budget is not None and not budget.take()):
+                raise SchemaError(f"{e} (after {repair} repairs)") from None
+            metrics.increment('llm.repairs')
+            # Ask again with the faulty answer (as far as it was read) and what is wrong with it
+            attempt_messages = messages + [
+                {"role": "assistant", "content": validator.text},
+                {"role": "user", "content": f"That answer is not valid: {e}. Reply with only the complete JSON "
+                                            f"object with the fields {schema.describe()}."}
+            ]
+            continue
+        if repair and cache is not None:
+            cache.put(model, messages, json.dumps(result))
+        return result
+
+
+def _is_valid(content, schema):
+    try:
+        parse_structured(content, schema)
+    except SchemaError:
+        return False
+    return True
+
+
+def dispatch_structured_requests(client, model, message_lists, schema, max_concurrency=8, requests_per_minute=None,
+                                 tokens_per_minute=None, on_complete=None, max_retries=5, cache=None,
+                                 max_repairs=MAX_REPAIRS, repair_budget=None, stream=True):
+    """
+    Like dispatch_chat_requests, but every answer is a validated dict (or the exception
+    it finally failed with). The batch shares a budget of `repair_budget` repair
+    requests, by default a quarter of its size.
+    """
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    if repair_budget is None:
+        repair_budget = max(MAX_REPAIRS, int(len(message_lists) * REPAIR_BUDGET_SHARE))
+    budget = RetryBudget(repair_budget)
+
+    def request(messages):
+        return structured_completion(client, model, messages, schema, limiter, max_retries, cache,
+                                     max_repairs, budget, stream)
+
+    return run_concurrently(request, message_lists, max_concurrency, on_complete)
@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+from SciX_Navigator_utils import load_embeddings
+from SciX_Cluster_Store import ClusterMembers, load_cluster_output, store_stamp
+from SciX_Metrics import metrics
+
+INDEX_LIBRARIES = ('hnswlib', 'faiss', 'exact')
+EXACT_BLOCK_ROWS = 16384  # Rows of the memory-mapped matrix scored per matmul
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+
+def vector_index_path(query, output_dir, library):
+    extension = {'hnswlib': 'hnsw', 'faiss': 'faiss'}[library]
+    return os.path.join(output_dir, query, f'{query}_index.{extension}')
+
+
+def available_library(library='auto'):
+    # hnswlib, then faiss, then the exact scan, which needs nothing beyond numpy
+    if library != 'auto':
+        return library
+    for candidate in ('hnswlib', 'faiss'):
+        try:
+            __import__(candidate)
+            return candidate
+        except ImportError:
+            continue
+    return 'exact'
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+class VectorIndex:
+    """
+    Cosine nearest-neighbour lookup over a query's embedding store, for "papers like
+    this" and for placing new papers in existing clusters. Uses an HNSW graph saved
+    next to the store (hnswlib or faiss, both optional) and otherwise an exact scan:
+    blocked float32 matmuls over the memory-mapped matrix.
+    """
+
+    def __init__(self, query, output_dir, library='auto'):
+        self.query = query
+        self.output_dir = output_dir
+        self.store = load_embeddings(query, output_dir)
+        self.library = available_library(library)
+        self._index = None
+        self._inverse_norms = None
+        self._centroids = None
+        if self.library != 'exact':
+            self._index = self._load_or_build()
+
+    def __len__(self):
+        return len(self.store)
+
+    # --- HNSW (hnswlib / faiss) ---
+
+    def _load_or_build(self):
+        path = vector_index_path(self.query, self.output_dir, self.library)
+        index = None
+        stamp = self._read_stamp(path)
+        if (os.path.exists(path) and stamp is not None and stamp['rows'] <= len(self.store)
+                and store_stamp(self.store, stamp['rows']) == stamp):
+            index = self._read(path)
+        # Otherwise the store was rewritten (re-embedded or deduplicated); its old graph is useless
+        if index is None:
+            index = self._create()
+        if self._count(index) < len(self.store):
+            # New rows (e.g. from an incremental update) are added without a rebuild
+            with metrics.timer('index.build'):
+                self._add(index, self._count(index), len(self.store))
+            self._write(index, path)
+        return index
+
+    def _create(self):
+        dim = self.store.vectors.shape[1]
+        if self.library == 'hnswlib':
+            import hnswlib
+            index = hnswlib.Index(space='cosine', dim=dim)
+            index.init_index(max_elements=max(len(self.store), 1), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+            index.set_ef(HNSW_EF_SEARCH)
+            return index
+        import faiss
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+
+    def _read(self, path):
+        if self.library == 'hnswlib':
+            import hnswlib
+            index = hnswlib.Index(space='cosine', dim=self.store.vectors.shape[1])
+            index.load_index(path, max_elements=len(self.store))
+            index.set_ef(HNSW_EF_SEARCH)
+            return index
+        import faiss
+        index = faiss.read_index(path)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+
+    def _write(self, index, path):
+        tmp_path = f'{path}.tmp'
+        if self.library == 'hnswlib':
+            index.save_index(tmp_path)
+        else:
+            import faiss
+            faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, path)
+        # The rows of the store the graph was built from, checked before it is reused
+        with open(f'{path}.json', 'w') as f:
+            json.dump(store_stamp(self.store, self._count(index)), f)
+
+    def _read_stamp(self, path):
+        if not os.path.exists(f'{path}.json'):
+            return None
+        with open(f'{path}.json') as f:
+            return json.load(f)
+
+    def _count(self, index):
+        return index.get_current_count() if self.library == 'hnswlib' else index.ntotal
+
+    def _add(self, index, start, stop):
+        if self.library == 'hnswlib' and index.get_max_elements() < stop:
+            index.resize_index(stop)
+        for block_start in range(start, stop, EXACT_BLOCK_ROWS):
+            block_stop = min(block_start + EXACT_BLOCK_ROWS, stop)
+            block = normalize_rows(self.store.vectors[block_start:block_stop])
+            if self.library == 'hnswlib':
+                index.add_items(block, np.arange(block_start, block_stop))
+            else:
+                index.add(block)  # faiss ids are insertion order, i.e. store rows
+
+    # --- Exact scan ---
+
+    def _exact_search(self, queries, k):
+        if self._inverse_norms is None:
+            norms = np.concatenate([np.linalg.norm(self.store.vectors[i:i + EXACT_BLOCK_ROWS], axis=1)
+                                    for i in range(0, len(self.store), EXACT_BLOCK_ROWS)])
+            self._inverse_norms = (1 / np.maximum(norms, 1e-12)).astype(np.float32)
+
+        # Keep a running top-k per query across blocks
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.store), EXACT_BLOCK_ROWS):
+            block = self.store.vectors[start:start + EXACT_BLOCK_ROWS]
+            scores = (queries @ block.T) * self._inverse_norms[start:start + len(block)]
+            rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+            scores = np.hstack([best_scores, scores])
+            rows = np.hstack([best_rows, rows])
+            keep = min(k, scores.shape[1])
+            top = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_rows = np.take_along_axis(rows, top, axis=1)
+        return best_rows, best_scores
+
+    # --- Queries ---
+
+    def search(self, vectors, k=10):
+        """
+        Top-k store rows by cosine similarity for each query vector. Returns row and
+        score matrices of shape (n_queries, k), best first.
+        """
+        queries = normalize_rows(vectors)
+        k = min(k, len(self.store))
+        with metrics.timer(f'index.search.{self.library}'):
+            if self.library == 'hnswlib':
+                rows, distances = self._index.knn_query(queries, k=k)
+                scores = 1 - distances
+            elif self.library == 'faiss':
+                scores, rows = self._index.search(queries, k)
+            else:
+                rows, scores = self._exact_search(queries, k)
+        order = np.argsort(-scores, axis=1)
+        return np.take_along_axis(rows, order, axis=1).astype(np.int64), np.take_along_axis(scores, order, axis=1)
+
+    def _results(self, rows, scores):
+        metadata = self.store.metadata
+        return [{'row': int(row), 'title': metadata[row]['title'], 'link': metadata[row].get('link', ''),
+                 'score': round(float(score), 4)} for row, score in zip(rows, scores) if row >= 0]
+
+    def similar_to_paper(self, row, k=10):
+        # The paper itself is always its own best match, so ask for one more and drop it
+        rows, scores = self.search(self.store.vectors[row], k + 1)
+        return [result for result in self._results(rows[0], scores[0]) if result['row'] != row][:k]
+
+    def similar_to_text(self, text, k=10, backend=None):
+        """
+        Embed free text with the backend that built the store and return its top-k papers.
+        """
+        if backend is None:
+            from SciX_Embedding_Backends import backend_for_store
+            backend = backend_for_store(self.store)
+        vector = backend.embed([text])[0]
+        if vector is None:
+            raise ValueError("The text could not be embedded")
+        rows, scores = self.search(vector, k)
+        return self._results(rows[0], scores[0])
+
+    def cluster_centroids(self):
+        """
+        Unit-length mean vector of every cluster in `{query}_cluster.json`. Old-layout
+        files are matched to store rows by title (titles are unique after deduplication).
+        """
+        if self._centroids is None:
+            cluster_path = os.path.join(self.output_dir, self.query, f'{self.query}_cluster.json')
+            cluster_output = load_cluster_output(cluster_path, self.query, self.output_dir)
+            row_of_title = None
+            cluster_ids, centroids = [], []
+            for cluster_id, papers in cluster_output.items():
+                if isinstance(papers, ClusterMembers):
+                    rows = sorted(papers.rows)
+                else:
+                    if row_of_title is None:
+                        row_of_title = {meta['title']: row for row, meta in enumerate(self.store.metadata)}
+                    rows = sorted(row_of_title[p['title']] for p in papers if p['title'] in row_of_title)
+                if rows:
+                    cluster_ids.append(cluster_id)
+                    centroids.append(normalize_rows(self.store.vectors[rows]).mean(axis=0))
+            self._centroids = (cluster_ids, normalize_rows(np.vstack(centroids)))
+        return self._centroids
+
+    def nearest_clusters(self, vectors, k=1):
+        """
+        For each vector, the k clusters whose centroids are most similar, as
+        [(cluster_id, score), ...] best first.
+        """
+        cluster_ids, centroids = self.cluster_centroids()
+        scores = normalize_rows(vectors) @ centroids.T
+        order = np.argsort(-scores, axis=1)[:, :k]
+        return [[(cluster_ids[j], round(float(scores[i, j]), 4)) for j in row] for i, row in enumerate(order)]
+
+
+def load_vector_index(query, output_dir, library='auto'):
+    return VectorIndex(query, output_dir, library)
+
+
+def build_vector_index(query, output_dir, library='auto', rebuild=False):
+    """
+    Build (or extend with new rows) the HNSW index of a query's store. Lookups build it
+    on first use anyway, so this is only needed to pay for it ahead of time. With no
+    ANN library installed there is nothing to build; the exact scan reads the store itself.
+    """
+    library = available_library(library)
+    if library == 'exact':
+        return None
+    path = vector_index_path(query, output_dir, library)
+    if rebuild and os.path.exists(path):
+        os.remove(path)
+    start = time.perf_counter()
+    index = VectorIndex(query, output_dir, library)
+    print(f"Vector index ({library}) for {len(index)} papers ready in {time.perf_counter() - start:.2f}s")
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--query', dest='query', type=str, help='query whose papers to search')
+    parser.add_argument('--output_dir', dest='output_dir', default='Data', type=str, help='data directory')
+    parser.add_argument('--library', dest='library', default='auto', choices=('auto',) + INDEX_LIBRARIES, help='index library (auto: hnswlib, faiss, else exact)')
+    parser.add_argument('--paper', dest='paper', default=None, type=int, help='row of the paper to find neighbours of')
+    parser.add_argument('--text', dest='text', default=None, type=str, help='free text to find papers for')
+    parser.add_argument('--k', dest='k', default=10, type=int, help='number of papers to return')
+    parser.add_argument('--rebuild', dest='rebuild', action='store_true', help='rebuild the index from scratch')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        build_vector_index(args.query, args.output_dir, args.library, rebuild=True)
+    index = load_vector_index(args.query, args.output_dir, args.library)
+
+    if args.paper is None and args.text is None:
+        print(f"{len(index)} papers indexed with {index.library}; pass --paper or --text to search")
+    else:
+        start = time.perf_counter()
+        if args.paper is not None:
+            results = index.similar_to_paper(args.paper, args.k)
+            vector = index.store.vectors[args.paper]
+        else:
+            results = index.similar_to_text(args.text, args.k)
+            vector = None
+        elapsed = time.perf_counter() - start
+        for result in results:
+            print(f"{result['score']:.3f}  [{result['row']}] {result['title']}")
+        print(f"Found in {elapsed * 1000:.1f} ms")
+        cluster_path = os.path.join(args.output_dir, args.query, f'{args.query}_cluster.json')
+        if vector is not None and os.path.exists(cluster_path):
+            print(f"Nearest clusters: {index.nearest_clusters(vector, k=3)[0]}")
@@ -1,22 +1,35 @@
 
-from tqdm import tqdm
-
-import json
 import os
+import time
+import argparse
 import numpy as np
-import pickle
-
-# cluster
-from sklearn.cluster import AgglomerativeClustering,KMeans,OPTICS
-from sklearn.mixture import GaussianMixture
-from sklearn.metrics import silhouette_score
+import joblib
+from joblib import Parallel, delayed, effective_n_jobs
 
-import umap
+from SciX_Reduction import reduce_embeddings, warm_up_umap
+from SciX_Embedding_Store import EmbeddingStore
+from SciX_Cluster_Store import save_cluster_output, load_cluster_output, ClusterStoreMismatch
+from SciX_Cluster_Scoring import ClusterScorer
+from SciX_Navigator_utils import load_embeddings
+from SciX_Progress import Progress
+from SciX_Metrics import metrics
 
+CLUSTER_METHODS = ('GMM', 'Kmeans', 'HCL', 'OPTICS', 'MiniBatchKMeans', 'HDBSCAN', 'Leiden', 'Louvain')
+UMAP_PARAMS = {'n_components': 20, 'min_dist': 0, 'metric': 'cosine', 'seed': 42}
+GMM_ASSIGNMENT_THRESHOLD = 0.1  # A paper joins every GMM cluster it has at least this probability for
+N_CENTRAL_REPRESENTATIVES = 15  # Papers closest to the centroid that a cluster is named by
+N_DIVERSE_REPRESENTATIVES = 5  # Further papers picked by maximal marginal relevance
+MMR_LAMBDA = 0.5  # Trade-off between closeness to the centroid and novelty for the diverse picks
 
 
 def extract_data_for_clustering(data,top_k=100):
 
+    if isinstance(data, EmbeddingStore):
+        # Slicing the memory-mapped matrix is zero-copy, and only top_k metadata rows are parsed
+        vector_matrix = data.vectors[:top_k]
+        titles_abstracts = [(m['title'], m['abstract'], m.get('link', '')) for m in data.load_metadata(top_k)]
+        return vector_matrix, titles_abstracts
+
     data = data[0:np.min([top_k,len(data)])]
     # Extract vectors, titles, and abstracts
     vectors = [item[3] for item in data]
@@ -27,16 +40,251 @@ def extract_data_for_clustering(data,top_k=100):
 
     return vector_matrix, titles_abstracts
 
-def cluster_papers(embeddings, titles_abstracts, n_clusters, cluster_method, is_umap, do_bic,do_silhouette):
+def _fit_gmm_candidate(embeddings, n, covariance_type, scorer):
+    # Fit one candidate and score it; runs inside a joblib worker, so timings are
+    # returned to the parent instead of recorded here
+    from sklearn.mixture import GaussianMixture
+    start = time.perf_counter()
+    gmm = GaussianMixture(n_components=n,
+                          random_state=42,
+                          covariance_type=covariance_type)
+    gmm.fit(embeddings)
+    fitted = time.perf_counter()
+    labels = None if scorer.criterion in ('bic', 'aic') else gmm.predict(embeddings)
+    score = scorer.score(embeddings, labels, gmm)
+    return n, score, gmm, {'gmm.fit': fitted - start, f'cluster.score.{scorer.criterion}': time.perf_counter() - fitted}
+
+
+def _find_plateau(results, patience):
+    # Return the first n at which the best score has gone `patience` candidates without improving
+    if patience is None:
+        return None
+    best_score = -np.inf
+    stale = 0
+    for n in sorted(results):
+        if results[n][0] > best_score:
+            best_score, stale = results[n][0], 0
+        else:
+            stale += 1
+            if stale >= patience:
+                return n
+    return None
+
+
+def select_gmm_components(embeddings, min_clusters, max_clusters, covariance_type='full', criterion='silhouette',
+                          n_jobs=-1, search='coarse_to_fine', coarse_points=8, patience=10,
+                          sample_size=None, precompute_distances=False):
+    """
+    Sweep the number of GMM components over [min_clusters, max_clusters] on a joblib
+    process pool and return (optimal_n, fitted_model, scores).
+
+    Candidates are scored with a ClusterScorer for `criterion`; for silhouette the
+    sample and any precomputed distance matrix are built once and shared by every
+    candidate. Scores are oriented so higher is better. search='exhaustive' fits n in increasing
+    order, one worker-sized batch at a time, and stops at the first n where the
+    best score has not improved for `patience` consecutive candidates (None fits
+    them all); search='coarse_to_fine' fits a coarse grid and then repeatedly
+    refines around the current best n. The best model from the sweep is returned
+    already fitted.
+    """
+    cluster_range = range(min_clusters, max_clusters + 1)
+    scorer = ClusterScorer(embeddings, criterion, sample_size=sample_size, precompute=precompute_distances)
+    results = {}
+    parallel = Parallel(n_jobs=n_jobs)
+    n_workers = effective_n_jobs(n_jobs)
+    progress = Progress(len(cluster_range), text='GMM candidates')
+
+    def evaluate(candidates):
+        candidates = [n for n in candidates if n not in results]
+        fitted = parallel(delayed(_fit_gmm_candidate)(embeddings, n, covariance_type, scorer)
+                          for n in candidates)
+        for n, score, gmm, timings in fitted:
+            results[n] = (score, gmm)
+            for name, seconds in timings.items():
+                metrics.record(name, seconds)
+        progress.update(len(candidates))
+
+    def best():
+        return max(results, key=lambda n: results[n][0])
+
+    with parallel:
+        if search == 'exhaustive':
+            for i in range(0, len(cluster_range), n_workers):
+                evaluate(cluster_range[i:i + n_workers])
+                plateau = _find_plateau(results, patience)
+                if plateau is not None:
+                    # Forget candidates past the plateau so the result does not depend on batch size
+                    for n in [n for n in results if n > plateau]:
+                        del results[n]
+                    break
+        elif search == 'coarse_to_fine':
+            step = max(1, len(cluster_range) // coarse_points)
+            evaluate(cluster_range[::step])
+            while step > 1:
+                center = best()
+                step = max(1, step // 2)
+                evaluate([n for n in range(center - 2 * step, center + 2 * step + 1, step) if n in cluster_range])
+        else:
+            raise ValueError(f"Invalid GMM search strategy: {search}")
+    progress.close()
+
+    optimal_n_clusters = best()
+    print(f"Optimal number of clusters based on {criterion} (GMM): {optimal_n_clusters} "
+          f"after {len(results)} of {len(cluster_range)} candidate fits")
+    scores = {n: score for n, (score, _) in sorted(results.items())}
+    return optimal_n_clusters, results[optimal_n_clusters][1], scores
+
+
+class KNNGraphClustering:
+    """
+    Community detection (Leiden or Louvain) over an approximate kNN graph built with
+    pynndescent, for corpora too large for the in-memory methods. Follows the
+    sklearn fit/labels_ convention.
 
+    Needs python-igraph (Leiden and Louvain) or networkx (Louvain only).
+    """
 
+    def __init__(self, algorithm='leiden', n_neighbors=15, metric='cosine', resolution=1.0, random_state=42):
+        self.algorithm = algorithm
+        self.n_neighbors = n_neighbors
+        self.metric = metric
+        self.resolution = resolution
+        self.random_state = random_state
+
+    def _knn_edges(self, X):
+        from pynndescent import NNDescent
+        from scipy.sparse import coo_matrix, triu
+
+        index = NNDescent(X, n_neighbors=self.n_neighbors + 1, metric=self.metric, random_state=self.random_state)
+        neighbors, distances = index.neighbor_graph
+        rows = np.repeat(np.arange(len(X)), neighbors.shape[1])
+        cols = neighbors.ravel()
+        # Gaussian kernel on the kNN distances, scaled by their median
+        scale = np.median(distances[:, 1:]) or 1.0
+        weights = np.exp(-(distances.ravel() / scale) ** 2)
+        keep = (rows != cols) & (cols >= 0)
+        graph = coo_matrix((weights[keep], (rows[keep], cols[keep])), shape=(len(X), len(X))).tocsr()
+        graph = triu(graph.maximum(graph.T), k=1).tocoo()
+        return graph.row, graph.col, graph.data
+
+    def fit(self, X):
+        # Check for a graph library before spending time on the kNN graph
+        try:
+            import igraph
+        except ImportError:
+            igraph = None
+            if self.algorithm != 'louvain':
+                raise ImportError("Leiden clustering needs python-igraph: pip install igraph")
+            try:
+                import networkx
+            except ImportError:
+                raise ImportError("Louvain clustering needs python-igraph or networkx: pip install igraph")
+        rows, cols, weights = self._knn_edges(X)
+
+        if igraph is not None:
+            import random
+            random.seed(self.random_state)
+            graph = igraph.Graph(n=len(X), edges=list(zip(rows.tolist(), cols.tolist())))
+            graph.es['weight'] = weights.tolist()
+            if self.algorithm == 'leiden':
+                partition = graph.community_leiden(objective_function='modularity', weights='weight',
+                                                   resolution=self.resolution, n_iterations=-1)
+            else:
+                partition = graph.community_multilevel(weights='weight', resolution=self.resolution)
+            self.labels_ = np.asarray(partition.membership)
+        else:
+            import networkx as nx
+            graph = nx.Graph()
+            graph.add_nodes_from(range(len(X)))
+            graph.add_weighted_edges_from(zip(rows.tolist(), cols.tolist(), weights.tolist()))
+            communities = nx.community.louvain_communities(graph, weight='weight', resolution=self.resolution,
+                                                           seed=self.random_state)
+            self.labels_ = np.empty(len(X), dtype=int)
+            for label, members in enumerate(communities):
+                self.labels_[list(members)] = label
+        return self
+
+
+def select_representatives(vectors, centroid_distances, n_central=N_CENTRAL_REPRESENTATIVES,
+                           n_diverse=N_DIVERSE_REPRESENTATIVES, mmr_lambda=MMR_LAMBDA):
+    """
+    Pick the members a cluster is named by: the `n_central` closest to its centroid, then
+    `n_diverse` more by maximal marginal relevance (close to the centroid but unlike the
+    papers already picked) so side themes are represented. Returns member indices in
+    selection order.
+    """
+    order = np.argsort(centroid_distances, kind='stable')
+    selected = [int(i) for i in order[:n_central]]
+    remaining = [int(i) for i in order[n_central:]]
+    if not remaining or n_diverse <= 0:
+        return selected
+
+    # Gaussian kernel on distances in the clustering space, scaled by their median
+    scale = np.median(centroid_distances) or 1.0
+    def similarity(i):
+        return np.exp(-(np.linalg.norm(vectors - vectors[i], axis=1) / scale) ** 2)
+
+    relevance = np.exp(-(centroid_distances / scale) ** 2)
+    redundancy = np.max([similarity(i) for i in selected], axis=0) if selected else np.zeros(len(vectors))
+    for _ in range(min(n_diverse, len(remaining))):
+        candidates = np.array(remaining)
+        scores = mmr_lambda * relevance[candidates] - (1 - mmr_lambda) * redundancy[candidates]
+        best = int(candidates[np.argmax(scores)])
+        selected.append(best)
+        remaining.remove(best)
+        redundancy = np.maximum(redundancy, similarity(best))
+    return selected
+
+
+def describe_cluster_members(cluster_id, paper_ids, embeddings, titles_abstracts, clustering_model,
+                             probabilities=None):
+    """
+    The cluster_output entries of one cluster: each paper with its row (its index in
+    the clustered matrix, i.e. its embedding store row), its membership probability and
+    distance to the cluster centre in the clustering space, and a 'representative'
+    rank on the papers select_representatives picked.
+    """
+    vectors = np.asarray(embeddings[paper_ids], dtype=np.float32)
+    if hasattr(clustering_model, 'means_'):  # GMM components have their own means
+        centroid = clustering_model.means_[cluster_id]
+    else:
+        centroid = vectors.mean(axis=0)
+    distances = np.linalg.norm(vectors - centroid, axis=1)
+
+    if probabilities is None:  # Hard assignments
+        member_probabilities = np.ones(len(paper_ids))
+    elif probabilities.ndim == 2:  # GMM predict_proba
+        member_probabilities = probabilities[paper_ids, cluster_id]
+    else:  # HDBSCAN membership strength
+        member_probabilities = probabilities[paper_ids]
+
+    rank = {member: r for r, member in enumerate(select_representatives(vectors, distances))}
+    papers = []
+    for member, paper_id in enumerate(paper_ids):
+        title, abstract, link = titles_abstracts[paper_id]
+        paper = {'title': title, 'abstract': abstract, 'link': link, 'row': int(paper_id),
+                 'probability': round(float(member_probabilities[member]), 4),
+                 'centroid_distance': round(float(distances[member]), 4)}
+        if member in rank:
+            paper['representative'] = rank[member]
+        papers.append(paper)
+    return papers
+
+
+def cluster_papers(embeddings, titles_abstracts, n_clusters, cluster_method, is_umap, do_bic,do_silhouette,
+                   n_jobs=-1, gmm_search='coarse_to_fine', criterion=None, score_sample_size=None,
+                   precompute_distances=False, umap_cache_dir=None, model_path=None):
+
+
+  # sklearn is imported here rather than at module level so loading a cached result stays fast
+  from sklearn.cluster import AgglomerativeClustering, KMeans, OPTICS, MiniBatchKMeans, HDBSCAN
+  from sklearn.mixture import GaussianMixture
+
+  reducer = None
   if is_umap:
-    embeddings = umap.UMAP(n_neighbors= np.min([int((len(embeddings) - 1) ** 0.5) ,50])  ,
-                           n_components=20,
-                           min_dist=0,
-                           metric='cosine',
-                           random_state=42
-                         ).fit_transform(embeddings)
+    # Reduced matrices are cached in umap_cache_dir (when given) and reused across runs
+    embeddings, umap_report = reduce_embeddings(embeddings, cache_dir=umap_cache_dir, **UMAP_PARAMS)
+    reducer = umap_report['reducer']
 
   if cluster_method == 'Kmeans':
     clustering_model = KMeans(n_clusters=n_clusters)
@@ -49,55 +297,63 @@ def cluster_papers(embeddings, titles_abstracts, n_clusters, cluster_method, is_
   elif cluster_method == 'OPTICS':
     clustering_model = OPTICS(metric='cosine', min_samples=2)
 
+  # Scalable backends for 100k+ papers
+  elif cluster_method == 'MiniBatchKMeans':
+    clustering_model = MiniBatchKMeans(n_clusters=n_clusters, batch_size=4096, n_init=3, random_state=42)
+
+  elif cluster_method == 'HDBSCAN':  # Best run on the UMAP output; noise points are left unassigned
+    clustering_model = HDBSCAN(min_cluster_size=max(5, len(embeddings) // 200))
+
+  elif cluster_method in ('Leiden', 'Louvain'):
+    clustering_model = KNNGraphClustering(algorithm=cluster_method.lower(), n_neighbors=15,
+                                          metric='euclidean' if is_umap else 'cosine')
+
   elif cluster_method == 'GMM':
     covariance_type = 'full'
-    threshold = 0.1
-    min_clusters = 5
+    threshold = GMM_ASSIGNMENT_THRESHOLD
+    min_clusters = min(5, n_clusters)
     #reg_covar = 1e-6
-    # Select the optimal number of clusters based on BIC
-    bic_scores = []
-    silhouette_scores = []
-    optimal_n_clusters = n_clusters
-    cluster_range = range(min_clusters, n_clusters + 1)
-    #cluster_range = range(1, n_clusters*2 + 1)
-    for n in tqdm(cluster_range):
-        gmm = GaussianMixture(n_components=n,
-                              random_state=42,
-                              covariance_type=covariance_type)
-        gmm.fit(embeddings)
-        if do_bic:
-            bic_scores.append(gmm.bic(embeddings))
-        if do_silhouette and n > 1:  # Silhouette score requires at least 2 clusters to be meaningful
-            cluster_labels = gmm.predict(embeddings)
-            silhouette_scores.append(silhouette_score(embeddings, cluster_labels))
-
-    # # Select the optimal number of clusters based on BIC or silhouette
-    if do_bic:
-        optimal_n_clusters = cluster_range[np.argmin(bic_scores)]
-        print(f"Optimal number of clusters based on BIC (GMM): {optimal_n_clusters}")
-    if do_silhouette:
-        optimal_n_clusters = cluster_range[np.argmax(silhouette_scores)]
-        print(f"Optimal number of clusters based on silhouette score (GMM): {optimal_n_clusters}")
-
-
-    # Create the final model with the selected number of clusters
-    clustering_model = GaussianMixture(n_components=optimal_n_clusters,
-                                       covariance_type=covariance_type,
-                                       random_state=42)
+    if criterion is None:
+      # do_silhouette takes precedence over do_bic, as before
+      criterion = 'silhouette' if do_silhouette else 'bic' if do_bic else None
+    if criterion is not None:
+      # Select the optimal number of clusters based on the criterion; the winning
+      # model comes back already fitted, so it is not refit below
+      optimal_n_clusters, clustering_model, _ = select_gmm_components(embeddings, min_clusters, n_clusters,
+                                                                      covariance_type, criterion,
+                                                                      n_jobs=n_jobs, search=gmm_search,
+                                                                      sample_size=score_sample_size,
+                                                                      precompute_distances=precompute_distances)
+    else:
+      optimal_n_clusters = n_clusters
+      clustering_model = GaussianMixture(n_components=optimal_n_clusters,
+                                         covariance_type=covariance_type,
+                                         random_state=42).fit(embeddings)
 
     print(f"Optimal number of clusters (GMM): {optimal_n_clusters}")
 
   else:  # Handle invalid clustering methods
     raise ValueError("Invalid clustering method specified")
 
-  clustering_model.fit(embeddings)
+  if cluster_method != 'GMM':
+    with metrics.timer(f'cluster.fit.{cluster_method}'):
+      clustering_model.fit(embeddings)
   if cluster_method =='GMM':
     probabilities = clustering_model.predict_proba(embeddings)
     cluster_assignment =  [np.where(p > threshold)[0] for p in probabilities]
 
   else:
-    cluster_assignment = clustering_model.labels_
-
+    probabilities = getattr(clustering_model, 'probabilities_', None)  # Only HDBSCAN has these
+    # One cluster per paper, as an array like the GMM soft assignment; noise (-1) gets none
+    cluster_assignment = [np.array([label]) if label >= 0 else np.array([], dtype=int)
+                          for label in clustering_model.labels_]
+
+  if model_path is not None:
+    # Keep the fitted model, and the reducer whose space it was fitted in, so later
+    # papers can be assigned without re-clustering
+    joblib.dump({'model': clustering_model, 'cluster_method': cluster_method, 'is_umap': is_umap,
+                 'umap_params': UMAP_PARAMS, 'reducer': reducer, 'threshold': GMM_ASSIGNMENT_THRESHOLD,
+                 'row_indices': list(range(len(embeddings)))}, model_path)
 
   clusters = dict()
   for paper_id,cluster_names in enumerate(cluster_assignment):
@@ -105,31 +361,74 @@ def cluster_papers(embeddings, titles_abstracts, n_clusters, cluster_method, is_
         if cluster not in clusters:
           clusters[cluster] = []
 
-        clusters[cluster].append(titles_abstracts[paper_id])
+        clusters[cluster].append(paper_id)
 
   clusters = dict(sorted(clusters.items(), key=lambda item: len(item[1]),reverse=True))
 
   # Preparing output
   cluster_output = {}
-  for cluster_id, papers in clusters.items():
-    cluster_output[str(cluster_id)] = [{'title': paper[0], 'abstract': paper[1],'link':paper[2]} for paper in papers]
+  for cluster_id, paper_ids in clusters.items():
+    cluster_output[str(cluster_id)] = describe_cluster_members(cluster_id, paper_ids, embeddings, titles_abstracts,
+                                                               clustering_model, probabilities)
 
 
 
   return cluster_output,embeddings,cluster_assignment
 
 
-def run_cluster_subtopics(emeddings,query,output_dir):
+def cluster_model_path(query, output_dir):
+    return f"{output_dir}/{query}/{query}_cluster_model.joblib"
+
+
+def assign_new_papers(model_bundle, new_vectors):
+    """
+    Assign papers to the clusters of a saved model without refitting it. The new rows
+    are transformed by the UMAP reducer saved with the model, so they land in the
+    space it was fitted in, then go through GMM predict_proba, or predict for
+    KMeans-style models. Returns one array of cluster ids per new paper, as
+    cluster_papers does.
+    """
+    model = model_bundle['model']
+    if not hasattr(model, 'predict'):
+        raise ValueError(f"{model_bundle['cluster_method']} cannot assign new papers; re-run the clustering instead")
+
+    vectors = np.asarray(new_vectors, dtype=np.float32)
+    if model_bundle['is_umap']:
+        if model_bundle.get('reducer') is None:
+            # Re-fitting UMAP here would give coordinates the model was not fitted on
+            raise ValueError("the saved model has no UMAP reducer; re-run the clustering instead")
+        warm_up_umap(model_bundle['umap_params']['n_components'], model_bundle['umap_params']['metric'],
+                     transform=True, n_rows=len(model_bundle['row_indices']))
+        vectors = model_bundle['reducer'].transform(vectors)
+
+    if hasattr(model, 'predict_proba'):
+        return [np.where(p > model_bundle['threshold'])[0] for p in model.predict_proba(vectors)]
+    return [np.array([label]) for label in model.predict(vectors)]
+
+
+def run_cluster_subtopics(emeddings,query,output_dir,n_jobs=-1,top_k=1000,cluster_method='GMM',n_clusters=None):
     """
-    Runs the clustering of subtopics.
+    Runs the clustering of subtopics. For a whole subject area, raise top_k and use one
+    of the scalable methods ('MiniBatchKMeans', 'HDBSCAN', 'Leiden', 'Louvain').
     """
+    cluster_path = f"{output_dir}/{query}/{query}_cluster.json"
+    cluster_output = None
+    if os.path.exists(cluster_path):
+        try:
+            cluster_output = load_cluster_output(cluster_path, query, output_dir)
+        except ClusterStoreMismatch as e:
+            print(f"{e}; clustering again")
+
     # Load the data
-    if not os.path.exists(f"{output_dir}/{query}/{query}_cluster.json"):
+    if cluster_output is None:
 
-        vector_matrix, titles_abstracts = extract_data_for_clustering(emeddings,top_k=1000)
+        vector_matrix, titles_abstracts = extract_data_for_clustering(emeddings,top_k=top_k)
 
-        n_clusters = len(vector_matrix) // 10 #Max number of clusters is 10% of the number of papers
-        cluster_method = 'GMM'
+        if n_clusters is None and cluster_method == 'MiniBatchKMeans':
+            # Used as k itself rather than as a maximum, so 10% would be 10,000 clusters at 100k papers
+            n_clusters = max(2, int(np.sqrt(len(vector_matrix))))
+        elif n_clusters is None:
+            n_clusters = len(vector_matrix) // 10 #Max number of clusters is 10% of the number of papers
         is_umap = True
         do_bic = False
         do_silhouette = True
@@ -140,25 +439,28 @@ def run_cluster_subtopics(emeddings,query,output_dir):
                                                                                     cluster_method,
                                                                                     is_umap,
                                                                                     do_bic,
-                                                                                    do_silhouette)
+                                                                                    do_silhouette,
+                                                                                    n_jobs=n_jobs,
+                                                                                    umap_cache_dir=f"{output_dir}/{query}/umap_cache",
+                                                                                    model_path=cluster_model_path(query, output_dir))
 
-        with open(f"{output_dir}/{query}/{query}_cluster.json","w") as f:
-            json.dump(cluster_output, f)
-
-    else:
-        with open(f"{output_dir}/{query}/{query}_cluster.json") as f:
-            cluster_output = json.load(f)
+        # Stored as store rows and scores per cluster; see SciX_Cluster_Store
+        save_cluster_output(cluster_output, cluster_path, query, output_dir)
 
     return cluster_output
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--query', dest='query', type=str, help='Query to cluster')
+    parser.add_argument('--output_dir', dest='output_dir', default='Data', type=str, help='data directory')
+    parser.add_argument('--cluster_method', dest='cluster_method', default='GMM', type=str, help='GMM, Kmeans, HCL, OPTICS, MiniBatchKMeans, HDBSCAN, Leiden or Louvain')
+    parser.add_argument('--top_k', dest='top_k', default=1000, type=int, help='number of papers to cluster')
+    args = parser.parse_args()
 
+    query = args.query
+    output_dir = args.output_dir
 
-    query = 'near-earth asteroids'
-    output_dir = 'Data'
-
-    with open(f"{output_dir}/{query}/{query}_embeddings.pkl", "rb") as f:
-        embeddings = pickle.load(f)
+    embeddings = load_embeddings(query, output_dir)
 
-    run_cluster_subtopics(embeddings,query,output_dir)
+    run_cluster_subtopics(embeddings,query,output_dir,top_k=args.top_k,cluster_method=args.cluster_method)
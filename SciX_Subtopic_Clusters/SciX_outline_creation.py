@@ -1,64 +1,238 @@
 import json
 import os
-from openai import OpenAI
 import argparse
+import numpy as np
+from SciX_Structured_Output import Schema, SchemaError, structured_completion, dispatch_structured_requests
+from SciX_Response_Cache import open_response_cache
+from SciX_LLM_Dispatch import get_client
+from SciX_Embedding_Cache import open_embedding_cache
+from SciX_Navigator_utils import count_tokens
+from SciX_Metrics import metrics
+from SciX_Cluster_Store import load_named_clusters
+from SciX_Embedding_Store import embedding_store_exists, load_embedding_store
+from SciX_Embedding_Backends import backend_for_store
 
-# Initialize OpenAI client
-client = OpenAI(api_key='YOUR-API-KEY')
 
-def clean_response_content(content):
+OUTLINE_MODEL = "gpt-4o-2024-05-13"
+OUTLINE_MODES = ('auto', 'single', 'hierarchical')
+MAX_OUTLINE_PROMPT_TOKENS = 12000  # Larger subtopic sets are outlined hierarchically in 'auto' mode
+MAX_LABEL_SUBTOPICS = 25  # Most central subtopics shown when labelling one chapter
+
+LABEL_PROMPT = """
+You are given subtopics of the research topic "{query}" that were grouped together, as a JSON object keyed by subtopic_id. They will form one foundational chapter of an outline that users navigate the research topic with.
+
+## Output
+- Output a JSON object with:
+  - cluster_title: a clear label for the chapter.
+  - description: one or two sentences describing the subtopics the chapter is dealing with.
+- Write nothing else
+"""
+
+ORDER_PROMPT = """
+You are given the chapters of an outline about the research topic "{query}", as a JSON object keyed by chapter id with each chapter's title and description. Order the chapters so the outline leads from the foundational chapters to the more specialised ones.
+
+## Output
+- Output a JSON object with:
+  - order: list of every chapter id, in reading order.
+- Write nothing else
+"""
+
+# Answer shapes, checked while each answer streams in
+OUTLINE_SCHEMA = Schema({
+    'type': 'object',
+    'properties': {
+        'clusters': {'type': 'array', 'items': {
+            'type': 'object',
+            'properties': {'cluster_id': {'type': ['string', 'integer']}, 'cluster_title': {'type': 'string'},
+                           'description': {'type': 'string'}},
+            'required': ['cluster_id', 'cluster_title', 'description'],
+        }},
+        'subtopics': {'type': 'object'},
+    },
+    'required': ['clusters', 'subtopics'],
+})
+CHAPTER_SCHEMA = Schema({
+    'type': 'object',
+    'properties': {'cluster_title': {'type': 'string'}, 'description': {'type': 'string'}},
+    'required': ['cluster_title', 'description'],
+})
+ORDER_SCHEMA = Schema({
+    'type': 'object',
+    'properties': {'order': {'type': 'array'}},
+    'required': ['order'],
+})
+
+def related_subtopics(subtopic_and_cluster_ids):
+    # Only the subtopics marked as related go into the outline
+    return {k: {'Subtopic': v['Subtopic'], 'Description': v['Description']}
+            for k, v in subtopic_and_cluster_ids.items()
+            if isinstance(v, dict) and v['Is Related'] == 'RELATED'}
+
+def generate_outline(subtopic_and_cluster_ids, query, output_dir, number_of_chapters=8, response_cache=None,
+                     openai_client=None, mode='auto', embedding_backend=None, embedding_cache=None):
     """
-    Clean the response content by removing code block markers and extra whitespace.
+    Group the related subtopics into chapters. 'single' asks for the whole outline in
+    one prompt; 'hierarchical' builds it map-reduce style (see generate_hierarchical_outline);
+    'auto' switches to hierarchical once the single prompt would exceed
+    MAX_OUTLINE_PROMPT_TOKENS.
     """
-    if content.startswith('```json'):
-        content = content[7:]  # Remove the opening ```json
-    if content.endswith('```'):
-        content = content[:-3]  # Remove the closing ```
-    return content.strip()
-
-def generate_outline(subtopic_and_cluster_ids, query, output_dir, number_of_chapters=8):
-    # Filter subtopics that are marked as related
-    subtopic_and_cluster_ids = {k: {'Subtopic': v['Subtopic'], 'Description': v['Description']}
-                                for k, v in subtopic_and_cluster_ids.items()
-                                if v != 'Removed' and v['Is Related'] == 'RELATED'}
+    subtopic_and_cluster_ids = related_subtopics(subtopic_and_cluster_ids)
+    user_content = f"Subtopic dictionary: {subtopic_and_cluster_ids}"
+
+    if mode == 'auto':
+        too_long = count_tokens(user_content, OUTLINE_MODEL) > MAX_OUTLINE_PROMPT_TOKENS
+        mode = 'hierarchical' if too_long else 'single'
+    if mode == 'hierarchical':
+        try:
+            return generate_hierarchical_outline(subtopic_and_cluster_ids, query, number_of_chapters,
+                                                 response_cache, openai_client, embedding_backend, embedding_cache)
+        except Exception as e:
+            print(f"Error during hierarchical outline generation: {e}")
+            return None
 
     sys_content = f"""You are given a nested dictionary where each key is a subtopic_id and the value is a dictionary of subtopics of the topic "{query}". Reflect on the subtopics and their descriptions and define clusters of topics that group the subtopics into meaningful research clusters. Create the clusters as an outline where each cluster is a foundational chapter about "{query}". Those clusters will be used by a user to navigate between different domains of the research topic. Give each topic a clear label and describe the subtopics that the cluster is dealing with. Output must be in JSON. Do not leave any subtopic without a cluster.
 
     ## Output
     - Output a JSON object with:
-      - clusters: list of dictionaries with digits from '1' to 'N' containing "cluster_ids", "cluster_title", and "description".
+      - clusters: list of dictionaries with digits from '1' to 'N' containing "cluster_id", "cluster_title", and "description".
       - subtopics: dictionary with the subtopic_id as a field and the appropriate cluster id as a key for each subtopic in the input.
     """
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-2024-05-13",
-            messages=[
+        outline = structured_completion(
+            openai_client or get_client(),
+            OUTLINE_MODEL,
+            [
                 {"role": "system", "content": sys_content.strip()},
-                {"role": "user", "content": f"Subtopic dictionary: {subtopic_and_cluster_ids}"}
-            ]
+                {"role": "user", "content": user_content}
+            ],
+            OUTLINE_SCHEMA,
+            cache=response_cache
         )
+    except SchemaError as e:
+        print(f"Error: Invalid outline from the API: {e}")
+        return None
+    except Exception as e:
+        print(f"Error during API call: {e}")
+        return None
 
-        response_content = response.choices[0].message.content
-        response_content = clean_response_content(response_content)
+    add_unassigned_subtopics(outline, subtopic_and_cluster_ids)
+    print("Outline generated successfully!")
+    return outline
 
-        try:
-            outline = json.loads(response_content)
-            if 'clusters' not in outline or 'subtopics' not in outline:
-                print("Error: The response does not contain the expected 'clusters' or 'subtopics' fields.")
-                print("Response content:", response_content)
-                return None
-
-            print("Outline generated successfully!")
-            return outline
-
-        except json.JSONDecodeError as e:
-            print(f"Error: Invalid JSON response from the API: {e}")
-            print("Response content after cleaning:", response_content)
-            return None
+def add_unassigned_subtopics(outline, subtopics):
+    """
+    Put subtopics the outline left out, or assigned to a chapter it does not define,
+    into an extra chapter rather than lose them.
+    """
+    chapter_ids = {str(cluster['cluster_id']) for cluster in outline['clusters']}
+    unassigned = [sid for sid in subtopics if str(outline['subtopics'].get(sid)) not in chapter_ids]
+    if not unassigned:
+        return outline
+    print(f"Warning: {len(unassigned)} subtopics were not assigned to a chapter; adding them as 'Other subtopics'")
+    other_id = str(len(outline['clusters']) + 1)
+    while other_id in chapter_ids:
+        other_id = str(int(other_id) + 1)
+    outline['clusters'].append({'cluster_id': other_id, 'cluster_title': 'Other subtopics',
+                                'description': 'Subtopics not assigned to any other chapter.'})
+    for sid in unassigned:
+        outline['subtopics'][sid] = other_id
+    return outline
 
-    except Exception as e:
-        print(f"Error during API call: {e}")
+def group_subtopics(subtopics, n_groups, backend, cache=None):
+    """
+    Split subtopic ids into at most `n_groups` groups by k-means over the embeddings of
+    their titles and descriptions. Each group lists its subtopics from most to least
+    central; groups are returned largest first.
+    """
+    from sklearn.cluster import KMeans
+
+    ids = list(subtopics)
+    texts = [f"{v['Subtopic']}: {v['Description']}" for v in subtopics.values()]
+    vectors = backend.embed(texts, cache)
+    dim = next((len(vector) for vector in vectors if vector is not None), 1)
+    # A description the backend could not embed still gets a group (the zero vector's nearest)
+    vectors = np.vstack([vector if vector is not None else np.zeros(dim, dtype=np.float32) for vector in vectors])
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    kmeans = KMeans(n_clusters=min(n_groups, len(ids)), n_init=10, random_state=0).fit(vectors)
+    distances = kmeans.transform(vectors)[np.arange(len(ids)), kmeans.labels_]
+    groups = []
+    for label in range(kmeans.n_clusters):
+        members = np.flatnonzero(kmeans.labels_ == label)
+        if len(members):
+            groups.append([ids[i] for i in members[np.argsort(distances[members], kind='stable')]])
+    return sorted(groups, key=len, reverse=True)
+
+def generate_hierarchical_outline(subtopics, query, number_of_chapters=8, response_cache=None, openai_client=None,
+                                  embedding_backend=None, embedding_cache=None, max_concurrency=8):
+    """
+    Build the outline map-reduce style so its latency does not grow with the number of
+    subtopics: group the subtopics into chapters by embedding, label every chapter
+    concurrently from its MAX_LABEL_SUBTOPICS most central subtopics, then order the
+    chapter titles in one small call. Returns the same {'clusters', 'subtopics'} layout
+    as the single-prompt outline.
+    """
+    if not subtopics:
+        print("No related subtopics to outline.")
         return None
+    client = openai_client or get_client()
+    if embedding_backend is None:
+        from SciX_Embedding_Backends import OpenAIBackend
+        embedding_backend = OpenAIBackend(client=client)
+
+    with metrics.timer('outline.group'):
+        groups = group_subtopics(subtopics, number_of_chapters, embedding_backend, embedding_cache)
+    print(f"Grouped {len(subtopics)} subtopics into {len(groups)} chapters")
+
+    # Map: one label per chapter, all requested at once
+    label_messages = [[
+        {"role": "system", "content": LABEL_PROMPT.format(query=query).strip()},
+        {"role": "user", "content": "Subtopics: " + json.dumps({sid: subtopics[sid] for sid in group[:MAX_LABEL_SUBTOPICS]})}
+    ] for group in groups]
+    with metrics.timer('outline.label'):
+        responses = dispatch_structured_requests(client, OUTLINE_MODEL, label_messages, CHAPTER_SCHEMA,
+                                                 max_concurrency=max_concurrency, cache=response_cache)
+
+    chapters = {}
+    for number, (group, chapter) in enumerate(zip(groups, responses), start=1):
+        if isinstance(chapter, Exception):
+            # Name the chapter after its most central subtopics rather than lose it
+            print(f"Could not label chapter {number}: {chapter}")
+            names = [subtopics[sid]['Subtopic'] for sid in group[:3]]
+            chapter = {'cluster_title': names[0], 'description': f"Subtopics such as {', '.join(names)}."}
+        chapters[str(number)] = {'title': chapter['cluster_title'], 'description': chapter['description']}
+
+    # Reduce: only the chapter titles and descriptions go into the ordering prompt
+    order = list(chapters)
+    if len(chapters) > 1:
+        try:
+            with metrics.timer('outline.order'):
+                answer = structured_completion(client, OUTLINE_MODEL, [
+                    {"role": "system", "content": ORDER_PROMPT.format(query=query).strip()},
+                    {"role": "user", "content": "Chapters: " + json.dumps(chapters)}
+                ], ORDER_SCHEMA, cache=response_cache)
+        except Exception as e:
+            answer = e
+        if not isinstance(answer, Exception):
+            ordered = [str(chapter_id) for chapter_id in answer['order']]
+            ordered = [chapter_id for i, chapter_id in enumerate(ordered)
+                       if chapter_id in chapters and chapter_id not in ordered[:i]]
+            # Chapters the answer left out keep their place at the end
+            order = ordered + [chapter_id for chapter_id in chapters if chapter_id not in ordered]
+        else:
+            print(f"Could not order the chapters, keeping them largest first: {answer}")
+
+    # Renumber in reading order, in the layout parse_outline expects
+    outline = {'clusters': [], 'subtopics': {}}
+    for number, chapter_id in enumerate(order, start=1):
+        chapter = chapters[chapter_id]
+        outline['clusters'].append({'cluster_id': str(number), 'cluster_title': chapter['title'],
+                                    'description': chapter['description']})
+        for sid in groups[int(chapter_id) - 1]:
+            outline['subtopics'][sid] = str(number)
+
+    print("Outline generated successfully!")
+    return outline
 
 # def parse_outline(outline, subtopic_and_cluster):
 #     if outline is None:
@@ -115,7 +289,7 @@ def parse_outline(outline, subtopic_and_cluster):
 
     return parsed_outline
 
-def get_outline_for_subtopics(subtopic_and_cluster, query, output_dir):
+def get_outline_for_subtopics(subtopic_and_cluster, query, output_dir, mode='auto'):
     output_path = f"{output_dir}/{query}/{query}_outline.json"
 
     # Ensure the output directory exists
@@ -123,7 +297,21 @@ def get_outline_for_subtopics(subtopic_and_cluster, query, output_dir):
 
     if not os.path.exists(output_path):
         id_subtopic_dict = {k: v[0] for k, v in subtopic_and_cluster.items()}
-        subtopics_outline = generate_outline(id_subtopic_dict, query, output_dir)
+        embedding_backend = None
+        if mode != 'single' and embedding_store_exists(query, output_dir):
+            # Subtopics are grouped with the backend and model the query's papers were embedded with
+            store = load_embedding_store(query, output_dir)
+            options = {'client': get_client()} if store.info.get('backend', 'openai') == 'openai' else {}
+            embedding_backend = backend_for_store(store, **options)
+        response_cache = open_response_cache(output_dir)
+        embedding_cache = open_embedding_cache(output_dir)
+        try:
+            subtopics_outline = generate_outline(id_subtopic_dict, query, output_dir, response_cache=response_cache,
+                                                 mode=mode, embedding_backend=embedding_backend,
+                                                 embedding_cache=embedding_cache)
+        finally:
+            response_cache.close()
+            embedding_cache.close()
 
         if subtopics_outline is None:
             print("No valid outline generated.")
@@ -148,14 +336,16 @@ def get_outline_for_subtopics(subtopic_and_cluster, query, output_dir):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--query', dest='query', type=str, help='Query to search')
+    parser.add_argument('--output_dir', dest='output_dir', default='Data', type=str, help='data directory')
+    parser.add_argument('--mode', dest='mode', default='auto', choices=OUTLINE_MODES, help='single prompt, hierarchical (map-reduce), or auto by prompt size')
     args = parser.parse_args()
 
-    query = 'near-earth asteroids'  # For testing
-    output_dir = 'Data'
+    query = args.query
+    output_dir = args.output_dir
 
     # Load clusters with subtopics
-    with open(f"{output_dir}/{query}/{query}_clusters_with_subtopics.json") as f:
-        cluster_with_subtopics = json.load(f)
+    cluster_with_subtopics = load_named_clusters(f"{output_dir}/{query}/{query}_clusters_with_subtopics.json",
+                                                 query, output_dir)
 
     # Generate and save the outline
-    outline = get_outline_for_subtopics(cluster_with_subtopics, query, output_dir)
+    outline = get_outline_for_subtopics(cluster_with_subtopics, query, output_dir, args.mode)
@@ -1,13 +1,123 @@
 import json
 import os
-from openai import OpenAI
-import streamlit as st
+import logging
+import numpy as np
 import argparse
+from SciX_Structured_Output import Schema, dispatch_structured_requests
+from SciX_Response_Cache import open_response_cache
+from SciX_LLM_Dispatch import get_client
+from SciX_Navigator_utils import count_tokens, truncate_to_tokens
+from SciX_Progress import Progress
+from SciX_Cluster_Store import (save_named_clusters, load_named_clusters, load_cluster_output, ClusterStoreMismatch,
+                               FAILED, membership)
 
-# Instantiate the OpenAI client
-client = OpenAI(api_key='YOUR-API-KEY')
+logger = logging.getLogger(__name__)
 
-def generate_subtopic_aspects(clusters, query, model="gpt-4o-2024-05-13", chunk_size=30):
+
+MAX_PROMPT_TOKENS = 12000  # Token budget for one cluster-naming prompt, system prompt included
+N_NAMING_PAPERS = 20  # Papers a cluster is named by when the clustering stage marked no representatives
+
+MERGE_PROMPT = """
+You are given a general topic and several partial analyses of one cluster of scientific papers. Each analysis was written for a different subset of the same cluster and is a JSON with the fields Description, Subtopic, Relatedness and Is Related.
+
+Combine them into a single analysis of the whole cluster.
+
+# Output Requirements:
+Output should be a JSON with the following fields:
+Description: One summary describing the common subtopic of the whole cluster in relation to the Topic.
+Subtopic: One concise title for the cluster (not a list of the partial titles).
+Relatedness: Rate the relatedness on a scale from 1 to 5.
+Is Related: "RELATED" or "NOT RELATED".
+- Write nothing else
+"""
+
+# What every naming and merge answer must contain; checked while the answer streams in
+ASPECT_SCHEMA = Schema({
+    "type": "object",
+    "properties": {
+        "Description": {"type": "string"},
+        "Subtopic": {"type": "string"},
+        "Relatedness": {"type": "number"},
+        "Is Related": {"type": "string", "pattern": "(?i)^(RELATED|NOT RELATED)$"},
+    },
+    "required": ["Description", "Subtopic", "Relatedness", "Is Related"],
+})
+
+def rank_papers_by_centrality(papers):
+    """
+    Order a cluster's papers from most to least representative. Uses the
+    'centroid_distance' the clustering stage stores when available, otherwise the
+    cosine similarity of each paper's TF-IDF vector to the cluster's mean vector.
+    """
+    if all('centroid_distance' in paper for paper in papers):
+        return sorted(papers, key=lambda paper: paper['centroid_distance'])
+
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    texts = [f"{paper['title']} {paper['abstract']}" for paper in papers]
+    try:
+        tfidf = TfidfVectorizer(stop_words='english').fit_transform(texts)
+    except ValueError:  # Empty vocabulary, nothing to rank on
+        return list(papers)
+    centroid = np.asarray(tfidf.mean(axis=0)).ravel()
+    similarity = tfidf @ centroid / (np.linalg.norm(centroid) or 1.0)
+    order = np.argsort(-similarity, kind='stable')
+    return [papers[i] for i in order]
+
+def select_representative_papers(papers, max_papers=N_NAMING_PAPERS):
+    """
+    The papers a cluster is named by: the representatives the clustering stage picked
+    (most central plus a few diverse ones), in their order, or else the `max_papers`
+    most central papers.
+    """
+    marked = [paper for paper in papers if 'representative' in paper]
+    if marked:
+        return sorted(marked, key=lambda paper: paper['representative'])
+    return rank_papers_by_centrality(papers)[:max_papers]
+
+def pack_cluster_chunks(papers, query, system_prompt, model, max_prompt_tokens=MAX_PROMPT_TOKENS,
+                        max_abstract_tokens=None, max_papers_per_chunk=None, max_chunks=None):
+    """
+    Greedily fill prompts with papers, in the given order, until each reaches the
+    token budget. Abstracts can be truncated to `max_abstract_tokens`. Returns the
+    user-message contents; papers left over after `max_chunks` prompts are skipped.
+    """
+    header = f"Topic: {query}\nPapers: "
+    budget = max_prompt_tokens - count_tokens(system_prompt, model) - count_tokens(header, model)
+
+    chunks = []
+    lines = []
+    used = 0
+    for paper in papers:
+        abstract = paper['abstract']
+        if max_abstract_tokens is not None:
+            abstract = truncate_to_tokens(abstract, max_abstract_tokens, model)
+        line = f"\n{len(lines)}: {paper['title']}\nAbstract: {abstract}"
+        n_tokens = count_tokens(line, model)
+
+        full = lines and (used + n_tokens > budget or
+                          (max_papers_per_chunk is not None and len(lines) >= max_papers_per_chunk))
+        if full:
+            chunks.append(header + ''.join(lines))
+            if max_chunks is not None and len(chunks) >= max_chunks:
+                return chunks
+            lines = []
+            used = 0
+            line = f"\n0: {paper['title']}\nAbstract: {abstract}"
+            n_tokens = count_tokens(line, model)
+        # A single paper larger than the whole budget still gets its own prompt
+        lines.append(line)
+        used += n_tokens
+
+    if lines and (max_chunks is None or len(chunks) < max_chunks):
+        chunks.append(header + ''.join(lines))
+    return chunks
+
+def generate_subtopic_aspects(clusters, query, model="gpt-4o-2024-05-13", chunk_size=None, max_concurrency=8,
+                              requests_per_minute=None, tokens_per_minute=None, openai_client=None,
+                              response_cache=None, max_prompt_tokens=MAX_PROMPT_TOKENS, max_abstract_tokens=None,
+                              max_chunks_per_cluster=None, representatives_only=True, stream=True,
+                              repair_budget=None):
     SYSTEM_PROMPT = """
 # Task Overview:
 You are provided with a general topic and a set of scientific papers retrieved by a lexical search system using this topic as a query. Your task is to analyze how the papers relate to the topic and categorize their relevance.
@@ -31,90 +141,117 @@ Is Related: State whether the papers are "RELATED" or "NOT RELATED" based on the
 """
 
     subtopics = []
-    progress_text = f"Generating {query} Aspects. Please wait."
-    progress_bar = st.progress(0, text=progress_text)
 
-    for cl, (cluster_id, papers) in enumerate(clusters.items()):
+    # Pack every cluster's papers into token-budgeted prompts up front so they can
+    # all be dispatched concurrently. By default only its representative papers name a
+    # cluster; otherwise all of them go in, most central first
+    cluster_items = list(clusters.items())
+    prompts = []  # (cluster index, chunk number, messages)
+    for cl, (cluster_id, papers) in enumerate(cluster_items):
         if len(papers) > 3:
-            print(f"\nProcessing cluster {cluster_id} with {len(papers)} papers...\n")
-
-            # Split the papers into smaller chunks
-            chunked_subtopics = []
-            for i in range(0, len(papers), chunk_size):
-                chunk = papers[i:i + chunk_size]
-                papers_list = ''
-                for j, paper in enumerate(chunk):
-                    line = f"\n{j}: {paper['title']}\nAbstract: {paper['abstract']}"
-                    papers_list += line
-
-                content = f"Topic: {query}\nPapers: {papers_list}"
-
-                try:
-                    response = client.chat.completions.create(
-                        model=model,
-                        messages=[
-                            {"role": "system", "content": SYSTEM_PROMPT.strip()},
-                            {"role": "user", "content": content}
-                        ]
-                    )
-
-                    response_content = response.choices[0].message.content
-                    
-                    # Debug: Print the raw response for inspection
-                    print(f"Cluster {cluster_id} - Chunk Response:\n{response_content}\n")
-
-                    # Clean up the response content
-                    if response_content.startswith('```json'):
-                        response_content = response_content[7:-3].strip()
-
-                    # Parse the JSON response
-                    try:
-                        subtopic_json = json.loads(response_content)
-
-                        # Check if the subtopic is marked as "RELATED"
-                        if subtopic_json.get("Is Related", "").upper() == "RELATED":
-                            chunked_subtopics.append(subtopic_json)
-                            print(f"Chunk {i // chunk_size + 1} of Cluster {cluster_id} is marked as RELATED.")
-                        else:
-                            print(f"Chunk {i // chunk_size + 1} of Cluster {cluster_id} is marked as NOT RELATED.")
-
-                    except json.JSONDecodeError:
-                        print(f"Invalid JSON response for chunk {i // chunk_size + 1} of cluster {cluster_id}: {response_content}")
-
-                except Exception as e:
-                    print(f"Error generating subtopic for chunk {i // chunk_size + 1} of cluster {cluster_id}: {e}")
-
-            # Merge results from all chunks
-            if chunked_subtopics:
-                # Combine the descriptions and subtopics into one
-                combined_description = ' '.join([subtopic['Description'] for subtopic in chunked_subtopics])
-                combined_subtopic = ', '.join([subtopic['Subtopic'] for subtopic in chunked_subtopics])
-
-                # Create a unified response for the cluster
-                unified_subtopic_json = {
-                    "Description": combined_description,
-                    "Subtopic": combined_subtopic,
-                    "Relatedness": max(subtopic['Relatedness'] for subtopic in chunked_subtopics),
-                    "Is Related": "RELATED"
-                }
-                subtopics.append(unified_subtopic_json)
+            selected = select_representative_papers(papers) if representatives_only else rank_papers_by_centrality(papers)
+            chunks = pack_cluster_chunks(selected, query, SYSTEM_PROMPT.strip(), model,
+                                         max_prompt_tokens, max_abstract_tokens, chunk_size, max_chunks_per_cluster)
+            print(f"\nProcessing cluster {cluster_id} with {len(papers)} papers ({len(selected)} sent) in {len(chunks)} prompts...\n")
+            for chunk_number, content in enumerate(chunks, start=1):
+                messages = [
+                    {"role": "system", "content": SYSTEM_PROMPT.strip()},
+                    {"role": "user", "content": content}
+                ]
+                prompts.append((cl, chunk_number, messages))
+
+    progress = Progress(len(prompts), text=f"Generating {query} Aspects. Please wait.")
+
+    def update_progress(done, total):
+        progress.update()
+
+    # Answers are streamed in JSON mode and validated as they arrive; a malformed one is
+    # repaired on its own rather than dropped, within a repair budget shared by the batch
+    dispatch_options = dict(max_concurrency=max_concurrency,
+                            requests_per_minute=requests_per_minute,
+                            tokens_per_minute=tokens_per_minute,
+                            cache=response_cache,
+                            stream=stream,
+                            repair_budget=repair_budget)
+    responses = dispatch_structured_requests(openai_client or get_client(), model,
+                                             [messages for _, _, messages in prompts], ASPECT_SCHEMA,
+                                             on_complete=update_progress, **dispatch_options)
+
+    # Merge the chunk results back per cluster, in chunk order, so the output is deterministic
+    chunk_responses = {}
+    for (cl, chunk_number, _), response_content in zip(prompts, responses):
+        chunk_responses.setdefault(cl, []).append((chunk_number, response_content))
+
+    related_chunks = {}
+    failed_chunks = {}
+    for cl, (cluster_id, papers) in enumerate(cluster_items):
+        chunked_subtopics = []
+        for chunk_number, subtopic_json in chunk_responses.get(cl, []):
+            if isinstance(subtopic_json, Exception):
+                print(f"Error generating subtopic for chunk {chunk_number} of cluster {cluster_id}: {subtopic_json}")
+                failed_chunks[cl] = failed_chunks.get(cl, 0) + 1
+                continue
+
+            logger.debug("Cluster %s - chunk %s response:\n%s", cluster_id, chunk_number, subtopic_json)
+
+            # Check if the subtopic is marked as "RELATED"
+            if subtopic_json["Is Related"].upper() == "RELATED":
+                chunked_subtopics.append(subtopic_json)
+                print(f"Chunk {chunk_number} of Cluster {cluster_id} is marked as RELATED.")
+            else:
+                print(f"Chunk {chunk_number} of Cluster {cluster_id} is marked as NOT RELATED.")
+        related_chunks[cl] = chunked_subtopics
+
+    # Clusters that still needed several prompts get one extra call that reconciles
+    # the chunk answers into a single coherent label
+    to_merge = [cl for cl, chunked in related_chunks.items() if len(chunked) > 1]
+    merge_messages = [[
+        {"role": "system", "content": MERGE_PROMPT.strip()},
+        {"role": "user", "content": f"Topic: {query}\nPartial analyses: {json.dumps(related_chunks[cl])}"}
+    ] for cl in to_merge]
+    merged = dict(zip(to_merge, dispatch_structured_requests(openai_client or get_client(), model, merge_messages,
+                                                             ASPECT_SCHEMA, **dispatch_options)))
+
+    for cl, (cluster_id, papers) in enumerate(cluster_items):
+        if len(papers) > 3:
+            chunked_subtopics = related_chunks[cl]
+
+            if len(chunked_subtopics) == 1:
+                subtopics.append(chunked_subtopics[0])
+                print(f"Cluster {cluster_id} marked as RELATED.")
+            elif chunked_subtopics:
+                merged_json = merged[cl]
+                if isinstance(merged_json, Exception):
+                    # Fall back to joining the chunk answers
+                    merged_json = {
+                        "Description": ' '.join([subtopic['Description'] for subtopic in chunked_subtopics]),
+                        "Subtopic": ', '.join([subtopic['Subtopic'] for subtopic in chunked_subtopics]),
+                        "Relatedness": max(subtopic['Relatedness'] for subtopic in chunked_subtopics),
+                    }
+                merged_json["Is Related"] = "RELATED"
+                subtopics.append(merged_json)
                 print(f"Cluster {cluster_id} combined result marked as RELATED.")
+            elif cl in failed_chunks:
+                # Not known to be unrelated: keep the cluster so a later run can name it
+                subtopics.append(FAILED)
+                print(f"Cluster {cluster_id} could not be named: {failed_chunks[cl]} prompts failed after repairs.")
             else:
                 subtopics.append('Removed')
-                print(f"Cluster {cluster_id} could not be processed.")
+                print(f"Cluster {cluster_id} marked as NOT RELATED.")
 
         else:
             print(f"Cluster {cluster_id} skipped due to insufficient papers.")
             subtopics.append('Removed')
 
-        progress_bar.progress(cl + 1, text=progress_text)
+    progress.close()
+
+    failed = [cluster_id for (cluster_id, _), subtopic in zip(cluster_items, subtopics) if subtopic == FAILED]
+    if failed:
+        print(f"{len(failed)} clusters could not be named and are marked '{FAILED}': {', '.join(map(str, failed))}")
 
     # Update clusters with the generated subtopics
     for i, (cluster_id, titles) in enumerate(clusters.items()):
-        if isinstance(subtopics[i], dict):
-            clusters[cluster_id] = (subtopics[i], titles)
-        else:
-            clusters[cluster_id] = ('Removed', titles)
+        clusters[cluster_id] = (subtopics[i], titles)
 
     return clusters
 
@@ -122,31 +259,54 @@ def name_the_clusters(clusters, query, output_dir):
     output_path = f"{output_dir}/{query}/{query}_clusters_with_subtopics.json"
     
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    
-    if not os.path.exists(output_path):
-        clusters_with_subtopics = generate_subtopic_aspects(clusters, query)
 
-        # Save the generated subtopics to a JSON file
-        with open(output_path, "w") as f:
-            json.dump(clusters_with_subtopics, f, indent=4)
-    else:
-        with open(output_path, "r") as f:
-            clusters_with_subtopics = json.load(f)
+    named = {}
+    if os.path.exists(output_path):
+        try:
+            named = load_named_clusters(output_path, query, output_dir)
+        except ClusterStoreMismatch as e:
+            print(f"{e}; naming the clusters again")
+
+    # Only clusters that are new, whose papers changed since they were named (e.g. after a
+    # re-cluster) or that a previous run could not name are asked again
+    stale = {cluster_id: papers for cluster_id, papers in clusters.items()
+             if cluster_id not in named or named[cluster_id][0] == FAILED
+             or membership(named[cluster_id][1]) != membership(papers)}
+    clusters_with_subtopics = {cluster_id: named[cluster_id] for cluster_id in clusters if cluster_id not in stale}
+    if stale:
+        if named:
+            print(f"Naming {len(stale)} of {len(clusters)} clusters again")
+        # Unchanged chunk prompts, e.g. of a cluster that only lost papers it was not named by,
+        # are answered from the response cache
+        response_cache = open_response_cache(output_dir)
+        try:
+            renamed = generate_subtopic_aspects(stale, query, response_cache=response_cache)
+            print(f"LLM response cache: {response_cache.stats()}")
+        finally:
+            response_cache.close()
+        for cluster_id, (subtopic, papers) in renamed.items():
+            clusters_with_subtopics[cluster_id] = [subtopic, papers]
+    clusters_with_subtopics = {cluster_id: clusters_with_subtopics[cluster_id] for cluster_id in clusters
+                               if cluster_id in clusters_with_subtopics}
+
+    if stale or set(named) != set(clusters):
+        # Saved with the clusters' store rows rather than their papers
+        save_named_clusters(clusters_with_subtopics, output_path, query, output_dir)
 
     return clusters_with_subtopics
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--query', dest='query', type=str, help='Query to search')
+    parser.add_argument('--output_dir', dest='output_dir', default='Data', type=str, help='data directory')
     args = parser.parse_args()
 
-    query = "near-earth asteroids"
-    output_dir = 'Data'
+    query = args.query
+    output_dir = args.output_dir
 
     cluster_file = f"{output_dir}/{query}/{query}_cluster.json"
     if os.path.exists(cluster_file):
-        with open(cluster_file, "r") as f:
-            cluster_output = json.load(f)
+        cluster_output = load_cluster_output(cluster_file, query, output_dir)
     else:
         print(f"Cluster file not found: {cluster_file}")
         exit(1)
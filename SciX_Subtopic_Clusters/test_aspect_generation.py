@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import SciX_Benchmark as bench
+import SciX_LLM_Dispatch
+from SciX_Embedding_Store import save_embedding_store
+from SciX_subtopic_aspect_generation import name_the_clusters
+
+QUERY = 'dust'
+
+
+@pytest.fixture
+def prompts(monkeypatch):
+    # Every prompt that reaches the fake chat endpoint, by its first paper
+    asked = []
+
+    def responder(messages):
+        asked.append(messages[-1]['content'].split('\n0: ', 1)[-1].split('\n', 1)[0])
+        return bench.fake_aspect_response(messages)
+
+    server, url = bench.start_mock_server(bench.make_chat_handler(responder, latency=0))
+    monkeypatch.setattr(SciX_LLM_Dispatch, 'client', bench.make_stub_openai_client(url))
+    yield asked
+    server.shutdown()
+
+
+def clusters_of(papers, rows_by_cluster):
+    return {cluster_id: [{**papers[row], 'row': row} for row in rows] for cluster_id, rows in rows_by_cluster.items()}
+
+
+def test_only_changed_clusters_are_named_again(prompts, tmp_path):
+    output_dir = str(tmp_path)
+    papers = [{'title': f"Paper {i}", 'abstract': f"Abstract {i}"} for i in range(15)]
+    save_embedding_store(papers, np.eye(15, dtype=np.float32), QUERY, output_dir)
+
+    first = name_the_clusters(clusters_of(papers, {'0': range(0, 5), '1': range(5, 10), '2': range(10, 15)}),
+                              QUERY, output_dir)
+    assert sorted(first) == ['0', '1', '2']
+    prompts.clear()
+
+    # Paper 9 moves to cluster 0; cluster 2 keeps its papers and is not asked again
+    moved = {'0': [9, 0, 1, 2, 3, 4], '1': range(5, 9), '2': range(10, 15)}
+    second = name_the_clusters(clusters_of(papers, moved), QUERY, output_dir)
+    assert sorted(prompts) == ['Paper 5', 'Paper 9']
+    assert second['0'][0]['Subtopic'] == 'Paper 9'
+    assert second['2'][0] == first['2'][0]
+
+    # A cluster that no longer exists is dropped without asking anything
+    prompts.clear()
+    del moved['1']
+    assert sorted(name_the_clusters(clusters_of(papers, moved), QUERY, output_dir)) == ['0', '2']
+    assert prompts == []
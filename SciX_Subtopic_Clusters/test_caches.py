@@ -0,0 +1,55 @@
+import time
+
+import numpy as np
+
+from SciX_Embedding_Cache import EmbeddingCache
+from SciX_Response_Cache import ResponseCache
+
+
+def vectors(n):
+    return [np.full(4, i, dtype=np.float32) for i in range(n)]
+
+
+def test_count_follows_inserts_and_replacements(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite'), max_entries=100)
+    cache.put_many('m', ['a', 'b', 'c'], vectors(3))
+    cache.put_many('m', ['b', 'c', 'd', 'd'], vectors(4))
+    assert cache._count == 4
+    assert cache.stats()['entries'] == 4
+    cache.close()
+    # Reopening recounts the rows on disk
+    assert EmbeddingCache(str(tmp_path / 'cache.sqlite'), max_entries=100)._count == 4
+
+
+def test_puts_do_not_count_the_table(tmp_path, monkeypatch):
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite'), max_entries=100)
+    recounts = []
+    monkeypatch.setattr(cache, '_recount', lambda: recounts.append(1) or 0)
+    for i in range(50):
+        cache.put_many('m', [f"text {i}"], vectors(1))
+    assert recounts == []
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite'), max_entries=20)
+    texts = [f"text {i}" for i in range(20)]
+    cache.put_many('m', texts, vectors(20))
+    time.sleep(0.01)
+    cache.get_many('m', texts[:5])  # The first five are now the most recently used
+    cache.put_many('m', ['one more'], vectors(1))
+
+    # Past max_entries, down to 95% of it in one go
+    assert cache.stats()['entries'] == 19
+    found = cache.get_many('m', texts)
+    assert all(v is not None for v in found[:5])
+    assert sum(v is None for v in found) == 2
+
+
+def test_expired_responses_are_dropped(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'), max_entries=10, ttl_seconds=0.05)
+    messages = [{'role': 'user', 'content': 'hello'}]
+    cache.put('m', messages, 'hi')
+    assert cache.get('m', messages) == 'hi'
+    time.sleep(0.1)
+    assert cache.get('m', messages) is None
+    assert cache.stats() == {'entries': 0, 'hits': 1, 'misses': 1, 'expired': 1, 'hit_rate': 0.5}
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from sklearn.metrics import silhouette_score
+from sklearn.mixture import GaussianMixture
+
+from SciX_Cluster_Scoring import ClusterScorer, CRITERIA
+
+
+@pytest.fixture(scope='module')
+def blobs():
+    # Three well separated blobs, and the labels that recover them
+    rng = np.random.default_rng(0)
+    centers = np.array([[0, 0], [10, 0], [0, 10]], dtype=np.float32)
+    labels = np.repeat(np.arange(3), 60)
+    return centers[labels] + rng.standard_normal((180, 2)).astype(np.float32), labels
+
+
+def shuffled(labels):
+    return np.random.default_rng(1).permutation(labels)
+
+
+@pytest.mark.parametrize('criterion', ['silhouette', 'davies_bouldin', 'calinski_harabasz'])
+def test_higher_is_better(blobs, criterion):
+    embeddings, labels = blobs
+    scorer = ClusterScorer(embeddings, criterion)
+    assert scorer.score(embeddings, labels) > scorer.score(embeddings, shuffled(labels))
+
+
+@pytest.mark.parametrize('criterion', ['bic', 'aic'])
+def test_information_criteria_prefer_the_true_number_of_components(blobs, criterion):
+    embeddings, _ = blobs
+    scorer = ClusterScorer(embeddings, criterion)
+    scores = {n: scorer.score(embeddings, None, GaussianMixture(n, random_state=0).fit(embeddings))
+              for n in (1, 3)}
+    assert scores[3] > scores[1]
+
+
+def test_information_criteria_need_a_gmm(blobs):
+    embeddings, labels = blobs
+    with pytest.raises(ValueError, match='GaussianMixture'):
+        ClusterScorer(embeddings, 'bic').score(embeddings, labels)
+
+
+def test_unknown_criterion(blobs):
+    with pytest.raises(ValueError, match='Invalid scoring criterion'):
+        ClusterScorer(blobs[0], 'elbow')
+
+
+@pytest.mark.parametrize('criterion', [c for c in CRITERIA if c not in ('bic', 'aic')])
+def test_a_single_cluster_scores_lowest(blobs, criterion):
+    embeddings, labels = blobs
+    assert ClusterScorer(embeddings, criterion).score(embeddings, np.zeros_like(labels)) == -np.inf
+
+
+def test_precomputed_distances_give_the_same_silhouette(blobs):
+    embeddings, labels = blobs
+    direct = ClusterScorer(embeddings).score(embeddings, labels)
+    precomputed = ClusterScorer(embeddings, precompute=True)
+    assert precomputed.distances.shape == (180, 180)
+    assert precomputed.score(embeddings, labels) == pytest.approx(direct, abs=1e-5)
+
+
+def test_sampled_silhouette_uses_the_same_rows_for_every_candidate(blobs):
+    embeddings, labels = blobs
+    scorer = ClusterScorer(embeddings, sample_size=50, precompute=True)
+    assert len(scorer.sample) == 50 and scorer.distances.shape == (50, 50)
+    expected = silhouette_score(embeddings[scorer.sample], labels[scorer.sample])
+    assert scorer.score(embeddings, labels) == pytest.approx(expected, abs=1e-5)
+    assert np.array_equal(ClusterScorer(embeddings, sample_size=50).sample, scorer.sample)
@@ -0,0 +1,95 @@
+import json
+
+import numpy as np
+import pytest
+
+from SciX_Cluster_Store import (ClusterMembers, ClusterStoreMismatch, FAILED, CLUSTER_FORMAT, save_cluster_output,
+                                load_cluster_output, save_named_clusters, load_named_clusters, has_failed_clusters,
+                                membership)
+from SciX_Embedding_Store import save_embedding_store, append_to_embedding_store
+
+QUERY = 'dust'
+PAPERS = [{'title': f"Paper {i}", 'abstract': f"Abstract {i}", 'link': f"link/{i}"} for i in range(6)]
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    save_embedding_store(PAPERS, np.random.default_rng(0).standard_normal((6, 4)), QUERY, str(tmp_path))
+    return str(tmp_path)
+
+
+def cluster_path(output_dir):
+    return f"{output_dir}/{QUERY}/{QUERY}_cluster.json"
+
+
+def clusters():
+    # As cluster_papers returns them: full paper dicts with their store row and scores
+    return {'0': [{**PAPERS[row], 'row': row, 'probability': 0.9, 'representative': 1} for row in (0, 2, 4)],
+            '1': [{**PAPERS[row], 'row': row, 'probability': 0.5} for row in (1, 3)]}
+
+
+def test_round_trip_keeps_papers_and_scores(output_dir):
+    save_cluster_output(clusters(), cluster_path(output_dir), QUERY, output_dir)
+    with open(cluster_path(output_dir)) as f:
+        saved = json.load(f)
+    assert saved['format'] == CLUSTER_FORMAT and saved['clusters']['0']['rows'] == [0, 2, 4]
+    assert 'title' not in json.dumps(saved)
+
+    loaded = load_cluster_output(cluster_path(output_dir), QUERY, output_dir)
+    assert isinstance(loaded['0'], ClusterMembers)
+    assert [list(papers) for papers in loaded.values()] == list(clusters().values())
+
+
+def test_papers_without_a_row_are_matched_by_title(output_dir):
+    save_cluster_output({'0': [PAPERS[5], PAPERS[2]]}, cluster_path(output_dir), QUERY, output_dir)
+    assert load_cluster_output(cluster_path(output_dir), QUERY, output_dir)['0'].rows == [5, 2]
+
+
+def test_papers_missing_from_the_store_keep_the_old_layout(output_dir):
+    papers = [PAPERS[0], {'title': 'Not embedded', 'abstract': ''}]
+    save_cluster_output({'0': papers}, cluster_path(output_dir), QUERY, output_dir)
+    assert load_cluster_output(cluster_path(output_dir), QUERY, output_dir) == {'0': papers}
+
+
+def test_a_rewritten_store_is_a_mismatch(output_dir):
+    save_cluster_output(clusters(), cluster_path(output_dir), QUERY, output_dir)
+    # Same papers, different vectors: e.g. re-embedded with another model
+    save_embedding_store(PAPERS, np.ones((6, 4)), QUERY, output_dir)
+    with pytest.raises(ClusterStoreMismatch, match='different embedding store'):
+        load_cluster_output(cluster_path(output_dir), QUERY, output_dir)
+
+
+def test_a_smaller_store_is_a_mismatch(output_dir):
+    save_cluster_output(clusters(), cluster_path(output_dir), QUERY, output_dir)
+    save_embedding_store(PAPERS[:3], np.zeros((3, 4)), QUERY, output_dir)
+    with pytest.raises(ClusterStoreMismatch):
+        load_cluster_output(cluster_path(output_dir), QUERY, output_dir)
+
+
+def test_appended_rows_keep_the_stamp(output_dir):
+    save_cluster_output(clusters(), cluster_path(output_dir), QUERY, output_dir)
+    append_to_embedding_store([{'title': 'New', 'abstract': ''}], np.zeros((1, 4)), QUERY, output_dir)
+    assert load_cluster_output(cluster_path(output_dir), QUERY, output_dir)['1'].rows == [1, 3]
+
+
+def test_named_clusters_and_failed_ones(output_dir):
+    path = f"{output_dir}/{QUERY}/{QUERY}_clusters_with_subtopics.json"
+    named = {cluster_id: [{'Subtopic': f"Subtopic {cluster_id}"}, papers] for cluster_id, papers in clusters().items()}
+    save_named_clusters(named, path, QUERY, output_dir)
+    loaded = load_named_clusters(path, QUERY, output_dir)
+    assert loaded['1'][0] == {'Subtopic': 'Subtopic 1'} and list(loaded['1'][1]) == clusters()['1']
+    assert not has_failed_clusters(path)
+
+    named['1'][0] = FAILED
+    save_named_clusters(named, path, QUERY, output_dir)
+    assert has_failed_clusters(path)
+
+
+def test_members_append_and_membership(output_dir):
+    save_cluster_output(clusters(), cluster_path(output_dir), QUERY, output_dir)
+    members = load_cluster_output(cluster_path(output_dir), QUERY, output_dir)['1']
+    members.append({**PAPERS[5], 'row': 5})
+    assert members[-1]['title'] == 'Paper 5' and 'probability' not in members[-1]
+    assert membership(members) == (1, 3, 5)
+    assert membership(clusters()['1']) == (1, 3)
+    assert membership([PAPERS[0]]) == ('Paper 0',)
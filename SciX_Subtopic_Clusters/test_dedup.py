@@ -0,0 +1,61 @@
+import pytest
+
+from SciX_Benchmark import make_duplicated_papers, make_synthetic_papers
+from SciX_Dedup import PaperDeduplicator, deduplicate_papers, normalize_title
+
+ABSTRACT = ("We measure the thermal inertia of near-earth asteroids from mid-infrared light curves and find that "
+            "small rubble piles are covered in coarse regolith, which changes their Yarkovsky drift rates.")
+
+
+def test_titles_are_normalized():
+    assert normalize_title(['The YORP Effect:', ' a Review.']) == normalize_title('the yorp effect a review')
+    assert normalize_title('  ...  ') is None
+    assert normalize_title(None) is None
+
+
+def test_exact_duplicates_ignore_case_and_punctuation():
+    papers = [{'title': ['Dust in Disks'], 'abstract': 'a'}, {'title': 'DUST IN DISKS.', 'abstract': 'b'},
+              {'title': 'Gas in disks', 'abstract': 'c'}]
+    kept, report = deduplicate_papers(papers)
+    assert [paper['title'] for paper in kept] == ['Dust in Disks', 'Gas in disks']
+    assert report == {'kept': 2, 'dropped': 1, 'reasons': {'duplicate_title': 1}}
+
+
+def test_near_duplicate_titles_are_dropped_only_when_asked():
+    papers = [{'title': 'Thermal inertia of near-earth asteroids', 'abstract': ABSTRACT},
+              {'title': 'Thermal inertia of near-earth asteroids (preprint)', 'abstract': ABSTRACT + ' Revised.'},
+              {'title': 'Spin states of main-belt asteroids', 'abstract': 'Unrelated light curves of large bodies.'}]
+    assert len(deduplicate_papers([dict(p) for p in papers])[0]) == 3
+
+    kept, report = deduplicate_papers([dict(p) for p in papers], near_duplicates=True)
+    assert [paper['title'] for paper in kept] == [papers[0]['title'], papers[2]['title']]
+    assert report['reasons'] == {'near_duplicate': 1}
+
+
+def test_invalid_records_are_counted():
+    kept, report = deduplicate_papers(['not a paper', {'title': 'No abstract'}, {'title': 3, 'abstract': ''}])
+    assert kept == []
+    assert report['reasons'] == {'not_a_dict': 1, 'invalid_title_or_abstract': 2}
+
+
+def test_a_seeded_deduplicator_drops_papers_seen_before():
+    dedup = PaperDeduplicator()
+    dedup.check('Dust in disks')
+    kept, _ = deduplicate_papers([{'title': 'Dust in disks', 'abstract': ''}, {'title': 'New', 'abstract': ''}],
+                                 dedup=dedup)
+    assert [paper['title'] for paper in kept] == ['New']
+
+
+@pytest.mark.parametrize('near_duplicates', [False, True])
+def test_synthetic_corpus(near_duplicates):
+    # Every planted copy of an original paper is caught, and no original is dropped. A copy
+    # of a copy has drifted twice and may stay under the similarity threshold
+    papers = make_duplicated_papers(500, exact_rate=0.1, near_rate=0.05 if near_duplicates else 0.0)
+    originals = {paper['title'][0] for paper in make_synthetic_papers(500)}
+    copies = [paper['title'][0] for paper in papers if paper['title'][0].endswith(' (preprint)')
+              and paper['title'][0][:-len(' (preprint)')] in originals]
+    kept, _ = deduplicate_papers(papers, near_duplicates=near_duplicates)
+    kept_titles = {paper['title'] for paper in kept}
+    assert kept_titles.isdisjoint(copies)
+    assert kept_titles >= {paper['title'] for paper in papers} & originals
+    assert len({normalize_title(title) for title in kept_titles}) == len(kept)
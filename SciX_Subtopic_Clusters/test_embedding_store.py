@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+import pytest
+
+from SciX_Embedding_Store import (save_embedding_store, append_to_embedding_store, load_embedding_store,
+                                  embedding_info_path)
+
+QUERY = 'dust'
+
+
+@pytest.fixture
+def store(tmp_path):
+    papers = [{'title': f"Paper {i}", 'abstract': f"Abstract {i}", 'link': f"link/{i}"} for i in range(10)]
+    vectors = np.arange(30, dtype=np.float32).reshape(10, 3)
+    save_embedding_store(papers, vectors, QUERY, str(tmp_path), info={'backend': 'openai', 'dim': 3})
+    return load_embedding_store(QUERY, str(tmp_path))
+
+
+def test_round_trip(store):
+    assert len(store) == 10
+    title, abstract, link, vector = store[4]
+    assert (title, abstract, link) == ('Paper 4', 'Abstract 4', 'link/4')
+    assert vector.tolist() == [12.0, 13.0, 14.0]
+    assert store.info == {'backend': 'openai', 'dim': 3}
+
+
+@pytest.mark.parametrize('rows', [slice(None, 3), slice(2, 8, 3), slice(-2, None), slice(None, None, -4)])
+def test_slices_match_the_legacy_list(store, rows):
+    legacy = list(store)
+    assert [item[0] for item in store[rows]] == [item[0] for item in legacy[rows]]
+    assert all(np.array_equal(a[3], b[3]) for a, b in zip(store[rows], legacy[rows]))
+
+
+def test_a_slice_parses_only_the_rows_it_needs(tmp_path, store):
+    # Truncate the metadata file after row 3: a slice that ends there never reads further
+    with open(store.metadata_path) as f:
+        lines = f.readlines()
+    with open(store.metadata_path, 'w') as f:
+        f.writelines(lines[:3] + ['not json\n'])
+    fresh = load_embedding_store(QUERY, str(tmp_path))
+    assert [item[0] for item in fresh[:3]] == ['Paper 0', 'Paper 1', 'Paper 2']
+
+
+def test_append_keeps_earlier_rows_and_info(tmp_path, store):
+    appended = append_to_embedding_store([{'title': 'New', 'abstract': 'Paper'}], np.ones((1, 3)), QUERY,
+                                         str(tmp_path))
+    assert len(appended) == 11
+    assert appended[0][0] == 'Paper 0' and appended[10][0] == 'New'
+    assert np.array_equal(appended.vectors[:10], store.vectors)
+    assert appended.info == {'backend': 'openai', 'dim': 3}
+
+
+def test_saving_without_info_removes_the_old_one(tmp_path, store):
+    save_embedding_store([{'title': 'Only', 'abstract': ''}], np.zeros((1, 3)), QUERY, str(tmp_path))
+    assert not os.path.exists(embedding_info_path(QUERY, str(tmp_path)))
+    assert load_embedding_store(QUERY, str(tmp_path)).info == {}
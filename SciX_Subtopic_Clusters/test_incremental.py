@@ -0,0 +1,62 @@
+import json
+import functools
+
+import openai
+import pytest
+
+import SciX_Benchmark as bench
+import SciX_LLM_Dispatch
+import SciX_SearchPapers
+from SciX_Pipeline import STAGES, PIPELINE_STATE_FILE, run_query_pipeline
+from SciX_Incremental import update_query
+
+QUERY = 'dust'
+# The outline needs its own fake answers and adds nothing here
+STAGES_TO_NAME = [stage for stage in STAGES if stage.name != 'outline']
+PARAMS = {'max_results': 120, 'cluster_method': 'Kmeans', 'n_clusters': 4, 'top_k': 1000}
+
+
+@pytest.fixture
+def servers(monkeypatch):
+    # Offline ADS, embeddings and chat endpoints; the update's ADS answers with 30 later papers
+    papers = bench.make_synthetic_papers(150, seed=3)
+    started = [bench.start_mock_server(bench.make_ads_handler(papers[:120], latency=0)),
+               bench.start_mock_server(bench.make_ads_handler(papers[120:], latency=0)),
+               bench.start_mock_server(bench.make_embeddings_handler(dim=32, latency=0)),
+               bench.start_mock_server(bench.make_chat_handler(latency=0))]
+    (_, ads_url), (_, update_url), (_, embeddings_url), (_, chat_url) = started
+    monkeypatch.setattr(openai, 'api_key', 'stub')
+    monkeypatch.setattr(openai, 'base_url', f"{embeddings_url}/v1")
+    monkeypatch.setattr(SciX_LLM_Dispatch, 'client', bench.make_stub_openai_client(chat_url))
+    monkeypatch.setattr(SciX_SearchPapers, 'search_papers_in_ads',
+                        functools.partial(SciX_SearchPapers.search_papers_in_ads, api_url=f"{ads_url}/v1/search/query"))
+    yield f"{update_url}/v1/search/query"
+    for server, _ in started:
+        server.shutdown()
+
+
+def test_pipeline_keeps_an_incremental_update(servers, tmp_path):
+    output_dir = str(tmp_path)
+    run_query_pipeline(QUERY, output_dir, PARAMS, stages=STAGES_TO_NAME)
+    manifest = update_query(QUERY, output_dir, since='2000-01-01', api_url=servers,
+                           chat_client=SciX_LLM_Dispatch.client)
+    assert manifest['added'] == 30
+    with open(f"{output_dir}/{QUERY}/{QUERY}_cluster.json") as f:
+        clusters = f.read()
+
+    timings = run_query_pipeline(QUERY, output_dir, PARAMS, stages=STAGES_TO_NAME)
+    assert [t['status'] for t in timings] == ['skipped'] * len(timings)
+    with open(f"{output_dir}/{QUERY}/{QUERY}_cluster.json") as f:
+        assert f.read() == clusters
+
+
+def test_changed_parameters_still_recompute_after_an_update(servers, tmp_path):
+    output_dir = str(tmp_path)
+    run_query_pipeline(QUERY, output_dir, PARAMS, stages=STAGES_TO_NAME)
+    update_query(QUERY, output_dir, since='2000-01-01', api_url=servers, chat_client=SciX_LLM_Dispatch.client)
+    with open(f"{output_dir}/{QUERY}/{PIPELINE_STATE_FILE}") as f:
+        assert json.load(f)['cluster']['params']['n_clusters'] == 4
+
+    timings = run_query_pipeline(QUERY, output_dir, {**PARAMS, 'n_clusters': 3}, stages=STAGES_TO_NAME)
+    assert {t['stage']: t['status'] for t in timings} == {'search': 'skipped', 'embed': 'skipped',
+                                                          'cluster': 'ran', 'name': 'ran'}
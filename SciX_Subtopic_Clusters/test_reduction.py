@@ -0,0 +1,57 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from SciX_Reduction import reduce_embeddings, _prune, MAX_CACHED_REDUCTIONS
+
+PARAMS = {'n_neighbors': 5, 'n_components': 2}
+
+
+@pytest.fixture(scope='module')
+def vectors():
+    return np.random.default_rng(0).standard_normal((60, 8)).astype(np.float32)
+
+
+def test_same_input_is_a_cache_hit(vectors, tmp_path):
+    reduced, report = reduce_embeddings(vectors, cache_dir=str(tmp_path), **PARAMS)
+    assert report['cache'] == 'miss' and reduced.shape == (60, 2)
+    again, report = reduce_embeddings(vectors.astype(np.float64), cache_dir=str(tmp_path), **PARAMS)
+    assert report['cache'] == 'hit' and report['reducer'] is not None
+    assert np.array_equal(again, reduced)
+
+
+def test_other_parameters_are_a_miss(vectors, tmp_path):
+    reduce_embeddings(vectors, cache_dir=str(tmp_path), **PARAMS)
+    _, report = reduce_embeddings(vectors, cache_dir=str(tmp_path), n_neighbors=6, n_components=2)
+    assert report['cache'] == 'miss'
+
+
+def test_appended_rows_are_transformed_with_the_prefix_reducer(vectors, tmp_path):
+    reduced, _ = reduce_embeddings(vectors[:50], cache_dir=str(tmp_path), **PARAMS)
+    extended, report = reduce_embeddings(vectors, cache_dir=str(tmp_path), **PARAMS)
+    assert report['cache'] == 'transform' and report['fit_seconds'] == 0
+    assert np.array_equal(extended[:50], reduced) and extended.shape == (60, 2)
+    # The extended matrix is cached in turn, sharing the prefix's reducer file
+    with open(tmp_path / 'umap_index.json') as f:
+        index = json.load(f)
+    assert len(index) == 2 and index[0]['reducer'] == index[1]['reducer']
+    assert reduce_embeddings(vectors, cache_dir=str(tmp_path), **PARAMS)[1]['cache'] == 'hit'
+
+
+def test_prune_keeps_the_most_recently_used(tmp_path):
+    index = []
+    for i in range(MAX_CACHED_REDUCTIONS + 2):
+        # Entries 0 and 1 share a reducer, as a reduction and its transformed extension do
+        entry = {'reduced': f"r{i}.npy", 'reducer': f"m{max(i, 1)}.joblib", 'last_used': i}
+        index.append(entry)
+        for name in (entry['reduced'], entry['reducer']):
+            (tmp_path / name).touch()
+    index[0]['last_used'] = 100  # Used again since
+
+    kept = _prune(str(tmp_path), index)
+    assert len(kept) == MAX_CACHED_REDUCTIONS
+    assert {e['reduced'] for e in kept} == {'r0.npy'} | {f"r{i}.npy" for i in range(3, MAX_CACHED_REDUCTIONS + 2)}
+    assert sorted(os.listdir(tmp_path)) == sorted({name for e in kept for name in (e['reduced'], e['reducer'])})
+    assert (tmp_path / 'm1.joblib').exists()  # Still used by entry 0
@@ -0,0 +1,49 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+import SciX_Benchmark as bench
+from SciX_Metrics import metrics
+from SciX_SearchPapers import _retry_wait, fetch_papers_from_ads
+
+
+class Response:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+def test_retry_after_in_seconds():
+    assert _retry_wait(Response({'Retry-After': '2.5'}), 0, 1.0, 60) == 2.5
+
+
+def test_retry_after_as_http_date():
+    wait = _retry_wait(Response({'Retry-After': formatdate(time.time() + 30, usegmt=True)}), 0, 1.0, 60)
+    assert 28 <= wait <= 30
+
+
+def test_retry_after_in_the_past_does_not_wait():
+    assert _retry_wait(Response({'Retry-After': formatdate(time.time() - 30, usegmt=True)}), 0, 1.0, 60) == 0
+
+
+@pytest.mark.parametrize('value', ['soon', ''])
+def test_unreadable_retry_after_backs_off(value):
+    # Exponential backoff with up to `backoff` of jitter
+    assert 4.0 <= _retry_wait(Response({'Retry-After': value}), 2, 1.0, 60) <= 5.0
+
+
+def test_exhausted_quota_pauses_before_the_next_request():
+    # 2 requests per second: the second response reports the quota used up, so the
+    # third request waits for the reset instead of getting a 429
+    server, url = bench.start_mock_server(bench.make_ads_handler(bench.make_synthetic_papers(50), latency=0,
+                                                                 rate_limit=2))
+    metrics.reset()
+    try:
+        papers = fetch_papers_from_ads('dust', max_results=50, rows=10, max_workers=1,
+                                       api_url=f"{url}/v1/search/query")
+    finally:
+        server.shutdown()
+    assert len(papers) == 50
+    counters = metrics.snapshot()['counters']
+    assert counters.get('ads.retries', 0) == 0
+    assert counters['ads.quota_waits'] >= 1
@@ -0,0 +1,131 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from SciX_Structured_Output import (Schema, SchemaError, JSONStreamValidator, MAX_PREAMBLE_CHARS, parse_structured,
+                                   structured_completion)
+
+SCHEMA = Schema({
+    'type': 'object',
+    'properties': {'Subtopic': {'type': 'string'}, 'Relatedness': {'type': 'number'}},
+    'required': ['Subtopic', 'Relatedness'],
+})
+
+
+def stream(text, size=1):
+    # Feed the text in pieces, as a streamed completion arrives
+    validator = JSONStreamValidator(SCHEMA)
+    for i in range(0, len(text), size):
+        validator.feed(text[i:i + size])
+    return validator
+
+
+@pytest.mark.parametrize('size', [1, 3, 1000])
+def test_complete_object_in_any_chunking(size):
+    text = '{"Subtopic": "Dust", "Relatedness": 4}'
+    assert stream(text, size).result() == {'Subtopic': 'Dust', 'Relatedness': 4}
+
+
+@pytest.mark.parametrize('subtopic', [
+    'a \\"quoted\\" word',  # Escaped quotes do not end the string
+    'ends with a backslash \\\\',  # An escaped backslash before the closing quote
+    'braces } { and ] [ inside',  # Brackets in strings do not change the depth
+    'commas, at, the top level',  # Nor do commas split members
+    'unicode \\u00e9',
+])
+def test_strings_with_escapes_and_brackets(subtopic):
+    text = f'{{"Subtopic": "{subtopic}", "Relatedness": 1}}'
+    assert stream(text).result() == json.loads(text)
+
+
+def test_nested_values_are_one_member():
+    schema = Schema({'type': 'object', 'properties': {'order': {'type': 'array'}}, 'required': ['order']})
+    validator = JSONStreamValidator(schema)
+    validator.feed('{"order": [["a", {"b": "}"}], "c"], "extra": {"d": [1, 2]}}')
+    assert validator.result()['order'] == [['a', {'b': '}'}], 'c']
+
+
+def test_code_fences_are_ignored():
+    text = '```json\n{"Subtopic": "Dust", "Relatedness": 4}\n```'
+    assert stream(text).result() == {'Subtopic': 'Dust', 'Relatedness': 4}
+
+
+def test_text_after_the_object_is_ignored():
+    validator = stream('{"Subtopic": "Dust", "Relatedness": 4} I hope this helps {')
+    assert validator.result()['Subtopic'] == 'Dust'
+
+
+def test_wrong_member_stops_the_stream_before_the_end():
+    validator = JSONStreamValidator(SCHEMA)
+    with pytest.raises(SchemaError, match='Subtopic'):
+        validator.feed('{"Subtopic": 12, ')
+
+
+def test_truncated_answer():
+    validator = stream('{"Subtopic": "Dust", "Relatedness": 4')
+    with pytest.raises(SchemaError, match='cut off'):
+        validator.result()
+
+
+def test_truncated_inside_a_string():
+    validator = stream('{"Subtopic": "Dust }')
+    with pytest.raises(SchemaError, match='cut off'):
+        validator.result()
+
+
+def test_missing_field():
+    with pytest.raises(SchemaError, match='Relatedness'):
+        parse_structured('{"Subtopic": "Dust"}', SCHEMA)
+
+
+def test_no_json_object():
+    with pytest.raises(SchemaError, match='no JSON object'):
+        parse_structured('I cannot help with that.', SCHEMA)
+
+
+def test_long_preamble():
+    with pytest.raises(SchemaError, match='does not start'):
+        stream('x' * (MAX_PREAMBLE_CHARS + 1) + '{"Subtopic": "Dust", "Relatedness": 4}', 50)
+
+
+def test_invalid_json():
+    with pytest.raises(SchemaError, match='invalid JSON'):
+        parse_structured('{"Subtopic": "Dust", "Relatedness": 4,}', SCHEMA)
+
+
+def test_reset_starts_over():
+    validator = stream('{"Subtopic": "Du')
+    validator.reset()
+    validator.feed('{"Subtopic": "Gas", "Relatedness": 2}')
+    assert validator.result() == {'Subtopic': 'Gas', 'Relatedness': 2}
+
+
+@pytest.mark.parametrize('content', [None, ''])
+def test_no_content(content):
+    with pytest.raises(SchemaError, match='no content'):
+        parse_structured(content, SCHEMA)
+
+
+class Answers:
+    # A chat client that answers with the given contents in turn, without streaming
+    def __init__(self, *contents):
+        self.contents = list(contents)
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, model, messages, **options):
+        message = SimpleNamespace(content=self.contents.pop(0))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+def test_refusal_is_repaired():
+    client = Answers(None, '{"Subtopic": "Dust", "Relatedness": 4}')
+    messages = [{'role': 'user', 'content': 'Name it'}]
+    assert structured_completion(client, 'gpt-4o', messages, SCHEMA, stream=False) == {'Subtopic': 'Dust',
+                                                                                        'Relatedness': 4}
+
+
+def test_repeated_refusals_raise_a_schema_error():
+    client = Answers(None, None)
+    with pytest.raises(SchemaError, match='no content'):
+        structured_completion(client, 'gpt-4o', [{'role': 'user', 'content': 'Name it'}], SCHEMA, stream=False,
+                              max_repairs=1)
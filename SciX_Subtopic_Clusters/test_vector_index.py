@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+import SciX_Vector_Index
+from SciX_Cluster_Store import save_cluster_output
+from SciX_Embedding_Store import save_embedding_store, append_to_embedding_store
+from SciX_Vector_Index import load_vector_index, normalize_rows
+
+QUERY = 'dust'
+
+
+def save_store(output_dir, vectors):
+    papers = [{'title': f"Paper {i}", 'abstract': ''} for i in range(len(vectors))]
+    save_embedding_store(papers, vectors, QUERY, output_dir)
+
+
+def brute_force(store_vectors, queries, k):
+    scores = normalize_rows(queries) @ normalize_rows(store_vectors).T
+    return np.argsort(-scores, axis=1)[:, :k], np.sort(scores, axis=1)[:, ::-1][:, :k]
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).standard_normal((300, 16)).astype(np.float32)
+
+
+@pytest.mark.parametrize('block_rows', [7, 64, 16384])
+def test_exact_neighbours_in_any_block_size(tmp_path, monkeypatch, vectors, block_rows):
+    # Blocks smaller than k, uneven blocks and a single block give the same answer
+    monkeypatch.setattr(SciX_Vector_Index, 'EXACT_BLOCK_ROWS', block_rows)
+    save_store(str(tmp_path), vectors * np.arange(1, 301, dtype=np.float32)[:, None])  # Norms must not matter
+    queries = np.random.default_rng(1).standard_normal((5, 16)).astype(np.float32)
+    rows, scores = load_vector_index(QUERY, str(tmp_path), library='exact').search(queries, k=10)
+    expected_rows, expected_scores = brute_force(vectors, queries, 10)
+    assert np.array_equal(rows, expected_rows)
+    assert np.allclose(scores, expected_scores, atol=1e-5)
+
+
+def test_k_larger_than_the_store(tmp_path, vectors):
+    save_store(str(tmp_path), vectors[:4])
+    rows, _ = load_vector_index(QUERY, str(tmp_path), library='exact').search(vectors[0], k=10)
+    assert rows.shape == (1, 4) and rows[0, 0] == 0
+
+
+def test_similar_to_paper_leaves_out_the_paper(tmp_path, vectors):
+    save_store(str(tmp_path), vectors)
+    results = load_vector_index(QUERY, str(tmp_path), library='exact').similar_to_paper(42, k=5)
+    assert [r['row'] for r in results] == brute_force(vectors, vectors[42], 6)[0][0, 1:].tolist()
+    assert results[0]['title'] == f"Paper {results[0]['row']}"
+
+
+def test_nearest_clusters(tmp_path, vectors):
+    save_store(str(tmp_path), vectors)
+    save_cluster_output({'0': [{'row': row} for row in range(0, 150)], '1': [{'row': row} for row in range(150, 300)]},
+                        f"{tmp_path}/{QUERY}/{QUERY}_cluster.json", QUERY, str(tmp_path))
+    centroid = normalize_rows(vectors[150:]).mean(axis=0)
+    nearest = load_vector_index(QUERY, str(tmp_path), library='exact').nearest_clusters(centroid, k=2)
+    assert [cluster_id for cluster_id, _ in nearest[0]] == ['1', '0']
+
+
+def test_hnsw_matches_the_exact_scan_and_follows_the_store(tmp_path, vectors):
+    pytest.importorskip('hnswlib')
+    save_store(str(tmp_path), vectors)
+    queries = vectors[:20]
+    index = load_vector_index(QUERY, str(tmp_path), library='hnswlib')
+    assert np.array_equal(index.search(queries, k=5)[0], brute_force(vectors, queries, 5)[0])
+
+    # Appended rows are added to the saved graph; a rewritten store gets a new one
+    extra = np.random.default_rng(2).standard_normal((20, 16)).astype(np.float32)
+    append_to_embedding_store([{'title': f"New {i}", 'abstract': ''} for i in range(20)], extra, QUERY,
+                              str(tmp_path))
+    index = load_vector_index(QUERY, str(tmp_path), library='hnswlib')
+    assert len(index) == 320 and index.search(extra[3], k=1)[0][0, 0] == 303
+    save_store(str(tmp_path), extra)
+    assert load_vector_index(QUERY, str(tmp_path), library='hnswlib').search(extra[3], k=1)[0][0, 0] == 3